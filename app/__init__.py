@@ -2,8 +2,9 @@
 import importlib
 import logging
 import os
-from flask import Flask, request
+from flask import Flask, request, g
 
+from app import figure_cache, jobs, metrics, tracing
 from app.views import base_app
 from config import Config
 
@@ -26,7 +27,14 @@ def create_app(test_config=None):
     except OSError:
         pass
 
+    # catalogue of past simulation runs. See data/catalogue.py
+    app.config.setdefault("CATALOGUE_DB", os.path.join(app.instance_path, "catalogue.sqlite"))
+
     app.register_blueprint(base_app)
+    metrics.init_app(app)
+    tracing.init_app(app)
+    jobs.init_app(app)
+    figure_cache.init_app(app)
 
     # Find all Dash apps files (names ends with "_dash_app.py")
     files = [f for f in os.listdir(os.path.join(os.path.dirname(__file__), "dash_apps")) if f.endswith("_dash_app.py")]
@@ -39,6 +47,7 @@ def create_app(test_config=None):
     # log exceptions
     @app.errorhandler(Exception)
     def basic_error(e):
+        g.request_failed = True
         logging.error("Error processing request to {}. Exception information follows:".format(request.path))
         logging.exception(e)
         return "An error occurred. It has been logged."
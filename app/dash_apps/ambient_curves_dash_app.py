@@ -1,3 +1,4 @@
+from app import figure_cache
 from app.dash_apps import create_dash_app
 from dash import html, dcc
 
@@ -48,6 +49,9 @@ def create_dash(server):
     # dash app definitions goes here
     app.config.suppress_callback_exceptions = True
     app.title = "Ambient Options"
+    # the layout is static apart from the figure, which only depends on config, so can be validated on the config (and this module's) hash
+    figure_cache.register("ambient", make_ambient_curves)
+    figure_cache.add_conditional_path(URL_BASE_PATHNAME + "_dash-layout", __name__)
 
     app.layout = html.Div([
 
@@ -64,7 +68,7 @@ def create_dash(server):
                         dcc.Graph(
                             id="temp_chart",
                             config={"displayModeBar": True},
-                            figure=make_ambient_curves()
+                            figure=figure_cache.get_figure("ambient")
                         ),
                         id="temp_spinner",
                         type="circle"
@@ -0,0 +1,198 @@
+from datetime import datetime
+
+from app.dash_apps import create_dash_app
+from dash import html, dcc, dash_table, no_update
+
+from dash.dependencies import Output, Input
+
+from data.catalogue import RunCatalogue
+
+# endpoint of this page
+URL_RULE = "/catalogue"
+# dash internal route prefix, must be start and end with "/"
+URL_BASE_PATHNAME = "/dash/catalogue/"
+
+# columns shown in the runs table: (column id, heading)
+TABLE_COLUMNS = [
+    ("id", "Run"),
+    ("created_str", "When"),
+    ("page", "Simulation"),
+    ("cop_option", "COP Model"),
+    ("amb_option", "Ambient"),
+    ("lwt", "LWT"),
+    ("heat_loss_factor", "HLF (W/K)"),
+    ("emitter_std_power", "Emitter (W)"),
+    ("energy_kwh", "Energy (kWh)"),
+    ("mean_cop", "Mean COP"),
+    ("comfort_shortfall", "Shortfall (K.h)"),
+    ("starts_per_hour", "Starts/hr"),
+    ("n_iterations", "Iterations")
+]
+
+
+def _table_row(run):
+    row = {c: run.get(c) for c, _ in TABLE_COLUMNS}
+    row["created_str"] = datetime.fromtimestamp(run["created"]).strftime("%Y-%m-%d %H:%M")
+    for c in ("energy_kwh", "mean_cop", "comfort_shortfall", "starts_per_hour"):
+        if row[c] is not None:
+            row[c] = round(row[c], 2)
+    return row
+
+
+def create_dash(server):
+    """Create a Dash view"""
+    app = create_dash_app(server, URL_RULE, URL_BASE_PATHNAME)
+
+    # dash app definitions goes here
+    app.config.suppress_callback_exceptions = True
+    app.title = "Past Simulation Runs"
+    catalogue = RunCatalogue(server.config["CATALOGUE_DB"])
+
+    # layout "constants"
+    # > for standard label + input/dropdown
+    left_col_class = "col-md-4"
+    right_col_class = "col-md-8"
+
+    app.layout = html.Div([
+
+        html.Div(
+            [
+                html.H1("Past Simulation Runs", className="header-title"),
+                html.P("Every computed run is catalogued. Filter, then select runs to compare.", className="header-description")
+            ],
+            className="header"),
+
+        html.Div(
+            [
+                html.Div(
+                    [
+                        html.Div([html.Label("Simulation")], className=left_col_class),
+                        html.Div(dcc.Dropdown(id="page_filter"), className=right_col_class)
+                    ], className="row"
+                ),
+                html.Div(
+                    [
+                        html.Div([html.Label("COP Model")], className=left_col_class),
+                        html.Div(dcc.Dropdown(id="cop_filter"), className=right_col_class)
+                    ], className="row"
+                ),
+                html.Div(
+                    [
+                        html.Div([html.Label("Ambient Temp Model")], className=left_col_class),
+                        html.Div(dcc.Dropdown(id="ambient_filter"), className=right_col_class)
+                    ], className="row"
+                ),
+                html.Div(
+                    [
+                        html.Div([html.Button("Refresh", id="refresh")], className=left_col_class)
+                    ], className="row"
+                ),
+                html.Hr()
+            ],
+            className="container-fluid"
+        ),
+
+        html.Div(
+            dash_table.DataTable(
+                id="runs_table",
+                columns=[{"id": c, "name": n} for c, n in TABLE_COLUMNS],
+                row_selectable="multi",
+                sort_action="native",
+                page_size=20
+            ),
+            className="container-fluid"
+        ),
+
+        html.Div(
+            [
+                html.Div(dcc.Graph(id="compare_chart", config={"displayModeBar": True}), className="card"),
+                html.Div(id="compare_params", className="card")
+            ],
+            className="wrapper"
+        )
+    ],
+        className="wrapper"
+    )
+
+    @app.callback(
+        [
+            Output("page_filter", "options"),
+            Output("cop_filter", "options"),
+            Output("ambient_filter", "options")
+        ],
+        Input("refresh", "n_clicks")
+    )
+    def load_filter_options(n_clicks):
+        return [catalogue.distinct("page"), catalogue.distinct("cop_option"), catalogue.distinct("amb_option")]
+
+    @app.callback(
+        [
+            Output("runs_table", "data"),
+            Output("runs_table", "selected_rows")
+        ],
+        [
+            Input("page_filter", "value"),
+            Input("cop_filter", "value"),
+            Input("ambient_filter", "value"),
+            Input("refresh", "n_clicks")
+        ]
+    )
+    def filter_runs(page, cop_option, amb_option, n_clicks):
+        runs = catalogue.query(page=page, cop_option=cop_option, amb_option=amb_option, limit=500)
+        return [[_table_row(r) for r in runs], []]
+
+    @app.callback(
+        [
+            Output("compare_chart", "figure"),
+            Output("compare_params", "children")
+        ],
+        [
+            Input("runs_table", "selected_rows"),
+            Input("runs_table", "data")
+        ]
+    )
+    def compare(selected_rows, data):
+        if not selected_rows or not data:
+            return [{"data": [], "layout": {"title": {"text": "Select runs to compare"}}}, ""]
+
+        runs = catalogue.get([data[i]["id"] for i in selected_rows if i < len(data)])
+        if not runs:
+            return [no_update, no_update]
+        labels = [f"Run {r['id']}" for r in runs]
+
+        data_chunks = [
+            {
+                "x": labels,
+                "y": [r["energy_kwh"] for r in runs],
+                "type": "bar",
+                "hovertemplate": "%{x}: %{y:.2f}kWh<extra></extra>",
+                "name": "Energy"
+            },
+            {
+                "x": labels,
+                "y": [r["mean_cop"] for r in runs],
+                "mode": "markers",
+                "marker": {"size": 12},
+                "hovertemplate": "%{x}: COP %{y:.2f}<extra></extra>",
+                "name": "Mean COP",
+                "yaxis": "y2"
+            }
+        ]
+        layout_chunk = {
+            "title": {"text": "Run Comparison", "x": 0.05, "xanchor": "left"},
+            "legend": {"x": -0.07, "xanchor": "left", "y": 1.0, "yanchor": "bottom", "orientation": "h"},
+            "yaxis": {"title": "Energy", "ticksuffix": "kWh", "fixedrange": False},
+            "yaxis2": {"title": "COP", "fixedrange": False, "overlaying": "y", "side": "right", "showgrid": False}
+        }
+
+        # show only the parameters which differ between the selected runs
+        param_keys = sorted({k for r in runs for k in r["params"]})
+        differing = [k for k in param_keys if len({str(r["params"].get(k)) for r in runs}) > 1]
+        params_table = html.Table(
+            [html.Tr([html.Th("Parameter")] + [html.Th(label) for label in labels])] +
+            [html.Tr([html.Td(k)] + [html.Td(str(r["params"].get(k, ""))) for r in runs]) for k in differing]
+        ) if differing else html.P("Selected runs have identical parameters.")
+
+        return [{"data": data_chunks, "layout": layout_chunk}, params_table]
+
+    return app.server
@@ -1,10 +1,12 @@
+from app import jobs, metrics, tracing
 from app.dash_apps import create_dash_app
 from dash import html, dcc, ctx, no_update
 
 from dash.dependencies import Output, Input, State
 
 from config import get_building_default_options, get_tmp_options, get_ambient_hr_options
-from data.solver import RoomTempSolver2
+from data import engines
+from data.catalogue import RunCatalogue
 
 # endpoint of this page
 URL_RULE = "/constant"
@@ -19,6 +21,9 @@ def create_dash(server):
     # dash app definitions goes here
     app.config.suppress_callback_exceptions = True
     app.title = "ASHP Room Temperature Simulation for Constant LWT"
+    catalogue = RunCatalogue(server.config["CATALOGUE_DB"])
+    job_queue = jobs.get_queue(server)
+    engine_name = server.config.get("SOLVER_ENGINES", dict()).get("constant_lwt", engines.DEFAULT_ENGINE)
 
     # Get the various parameter options
     building_default_options = get_building_default_options()
@@ -117,7 +122,8 @@ def create_dash(server):
                             config={"displayModeBar": True}
                         ),
                         id="temp_spinner",
-                        type="circle"
+                        type="circle",
+                        delay_show=1000  # don't flash on every job poll
                     ),
                     className="card"
                 )
@@ -129,9 +135,11 @@ def create_dash(server):
             [
                 html.P(id="summary_results"),
                 html.Div([
-                    html.Div([html.Button("Compute", id="compute")], className="col-md-2"),
+                    html.Div([html.Button("Compute", id="compute"), html.Button("Cancel", id="cancel")], className="col-md-2"),
                     html.Div(id="compute_errors", className="col-md-10")
-                ], className="row")
+                ], className="row"),
+                dcc.Store(id="job_id"),
+                dcc.Interval(id="job_poll", interval=server.config["JOB_POLL_INTERVAL_MS"], disabled=True)
             ], className="container-fluid"
         ),
         html.Hr()
@@ -161,9 +169,8 @@ def create_dash(server):
 
     @app.callback(
         [
-            Output("temp_chart", "figure"),
-            Output("summary_results", "children"),
-            Output("compute_errors", "children")
+            Output("job_id", "data"),
+            Output("job_poll", "disabled")
         ],
         [
             Input("lwt", "value"),
@@ -185,9 +192,7 @@ def create_dash(server):
                 tmp,
                 floor_area):
         if ctx.triggered_id is None:  # no compute on initial load
-            return [no_update, "", ""]
-
-        error_msg = ""
+            return [no_update, no_update]
 
         building_params = {
             "heat_loss_factor": float(heat_loss_factor),
@@ -197,76 +202,96 @@ def create_dash(server):
             # "fluid_volume": float(fluid_volume)
         }
 
-        solver = RoomTempSolver2(building_params, ambient_model, lwt=lwt, initial_temp=16, steps_per_hour=12)
-
-        MAX_ITERS = 20
-        CONV_THRESHOLD = 0.05
-        print("Iterations:")
-        print("\tfull_day_loss \tfull_day_energy_delta \tmax_t_iter_delta \tmean_t_iter_delta")
-        while (solver.full_day_loss_delta > CONV_THRESHOLD) and (solver.n_iterations < MAX_ITERS):
-            solver.iterate()
-            print(f"{solver.n_iterations}: \t{solver.full_day_loss:.3f} \t\t\t\t{solver.full_day_loss_delta:.4f} \t\t\t\t\t{solver.max_t_iter_delta:.4f} \t\t\t\t{solver.mean_t_iter_delta:.4f}")
-
-        if (solver.full_day_loss_delta > CONV_THRESHOLD) and (solver.n_iterations == MAX_ITERS):
-            error_msg = f"Failed to converge after {MAX_ITERS} solver iterations. Last loss delta={solver.full_day_loss_delta:.3f}kWh. Try increasing steps_per_hour."
-
-        formatted_times = [f"{int(t):02d}:{int(t * 60 + 0.5) % 60:02d}" for t in solver.times]
-        rt_diffs = [(solver.iter_room_temp[i + 1] - solver.iter_room_temp[i]) for i in range(len(solver.iter_room_temp) - 1)]
-        rt_diffs.append(solver.iter_room_temp[0] - solver.iter_room_temp[-1])
-        rt_rates = [r / solver.time_step_duration for r in rt_diffs]
-
-        tc_data_chunks = [
-            # temps
-            {
-                "x": formatted_times,
-                "y": solver.iter_room_temp,
-                "text": rt_rates,
-                "mode": "lines",
-                "hovertemplate": "Rm: %{y:.1f}C @ t=%{x}<br>Rate: %{text:.2f}C/hr<extra></extra>",
-                "name": "Room"
-            },
-            {
-                "x": formatted_times,
-                "y": solver.ambient_temps,
-                "mode": "lines",
-                "hovertemplate": "Outside: %{y:.1f}C @ t=%{x}<extra></extra>",
-                "name": "Ambient"
-            },
-            # Solver returns Watt.hours
-            {
-                "x": formatted_times,
-                "y": [wh / solver.time_step_duration / 1000 for wh in solver.energy_lost],
-                "mode": "lines",
-                "hovertemplate": "Loss: %{y:.2f}kW @ t=%{x}<extra></extra>",
-                "name": "Loss",
-                "yaxis": "y2",
-            },
-
-            {
-                "x": formatted_times,
-                "y": [wh / solver.time_step_duration / 1000 for wh in solver.energy_emitted],
-                "mode": "lines",
-                "hovertemplate": "Emitted: %{y:.2f}kW @ t=%{x}<extra></extra>",
-                "name": "Emitted",
-                "yaxis": "y2",
-            }
-        ]
+        # the solver runs in a background job; poll_job() renders the result
+        job_id = job_queue.submit("constant_lwt", {
+            "engine": engine_name,
+            "building": building_params,
+            "amb_option": ambient_model,
+            "lwt": lwt,
+            # coarse passes first, shown while refined to the resolution at which the time step error is within the tolerance
+            "energy_tolerance": engines.ENERGY_TOLERANCE
+        })
+        return [job_id, False]
 
-        tc_layout_chunk = {
-            "title": {
-                "text": f"Temperatures & Energy Balance",
-                "x": 0.05,
-                "xanchor": "left",
-            },
-            "legend": {"x": -0.07, "xanchor": "left", "y": 1.0, "yanchor": "bottom", "orientation": "h"},
-            "xaxis": {"title": "Time", "fixedrange": False, "tickangle": 90},
-            "yaxis": {"title": "Temperature", "ticksuffix": "C", "fixedrange": False},
-            "yaxis2": {"title": "Power Input", "ticksuffix": "kW", "fixedrange": False, "overlaying": "y", "side": "right", "showgrid": False}
-        }
+    @app.callback(
+        Output("compute_errors", "children", allow_duplicate=True),
+        Input("cancel", "n_clicks"),
+        State("job_id", "data"),
+        prevent_initial_call=True
+    )
+    def cancel(n_clicks, job_id):
+        if job_id and job_queue.cancel(job_id):
+            return "Cancelling..."
+        return no_update
 
-        # summary
+    def render_result(result):
+        """Figures, summary and convergence warning for a job result (or the partial result of a progressive job)"""
+        error_msg = ""
+        if not result["converged"]:
+            error_msg = f"Failed to converge after {result['n_iterations']} solver iterations. Last loss delta={result['energy_delta']:.3f}kWh."
+        elif result["energy_error"] is not None and result["energy_error"] > engines.ENERGY_TOLERANCE:
+            error_msg = f"Time step error of about {result['energy_error']:.2f}kWh, even at {result['steps_per_hour']} steps/hour."
+
+        with tracing.span("figures"):
+            formatted_times = [f"{int(t):02d}:{int(t * 60 + 0.5) % 60:02d}" for t in result["times"]]
+            rt_diffs = [(result["room_temp"][i + 1] - result["room_temp"][i]) for i in range(len(result["room_temp"]) - 1)]
+            rt_diffs.append(result["room_temp"][0] - result["room_temp"][-1])
+            rt_rates = [r / result["step_hours"] for r in rt_diffs]
+
+            tc_data_chunks = [
+                # temps
+                {
+                    "x": formatted_times,
+                    "y": result["room_temp"],
+                    "text": rt_rates,
+                    "mode": "lines",
+                    "hovertemplate": "Rm: %{y:.1f}C @ t=%{x}<br>Rate: %{text:.2f}C/hr<extra></extra>",
+                    "name": "Room"
+                },
+                {
+                    "x": formatted_times,
+                    "y": result["ambient_temp"],
+                    "mode": "lines",
+                    "hovertemplate": "Outside: %{y:.1f}C @ t=%{x}<extra></extra>",
+                    "name": "Ambient"
+                },
+                # Solver returns Watt.hours
+                {
+                    "x": formatted_times,
+                    "y": [wh / result["step_hours"] / 1000 for wh in result["heat_lost"]],
+                    "mode": "lines",
+                    "hovertemplate": "Loss: %{y:.2f}kW @ t=%{x}<extra></extra>",
+                    "name": "Loss",
+                    "yaxis": "y2",
+                },
+
+                {
+                    "x": formatted_times,
+                    "y": [wh / result["step_hours"] / 1000 for wh in result["heat_emitted"]],
+                    "mode": "lines",
+                    "hovertemplate": "Emitted: %{y:.2f}kW @ t=%{x}<extra></extra>",
+                    "name": "Emitted",
+                    "yaxis": "y2",
+                }
+            ]
+
+            tc_layout_chunk = {
+                "title": {
+                    "text": f"Temperatures & Energy Balance",
+                    "x": 0.05,
+                    "xanchor": "left",
+                },
+                "legend": {"x": -0.07, "xanchor": "left", "y": 1.0, "yanchor": "bottom", "orientation": "h"},
+                "xaxis": {"title": "Time", "fixedrange": False, "tickangle": 90},
+                "yaxis": {"title": "Temperature", "ticksuffix": "C", "fixedrange": False},
+                "yaxis2": {"title": "Power Input", "ticksuffix": "kW", "fixedrange": False, "overlaying": "y", "side": "right", "showgrid": False}
+            }
 
-        summary = f"Total Heat Loss: {solver.full_day_loss:.2f}kWh"
+            # summary
+
+            summary = f"Total Heat Loss: {result['energy_kwh']:.2f}kWh"
+            if result["energy_error"] is not None:
+                summary += f" (time step error about {result['energy_error']:.2f}kWh)"
 
         return [
             {"data": tc_data_chunks, "layout": tc_layout_chunk},
@@ -274,4 +299,43 @@ def create_dash(server):
             html.B(error_msg, style={"background": "yellow"})
         ]
 
+    @app.callback(
+        [
+            Output("temp_chart", "figure"),
+            Output("summary_results", "children"),
+            Output("compute_errors", "children"),
+            Output("job_poll", "disabled", allow_duplicate=True)
+        ],
+        [
+            Input("job_poll", "n_intervals"),
+            Input("job_id", "data")
+        ],
+        prevent_initial_call=True
+    )
+    @tracing.traced
+    def poll_job(n_intervals, job_id):
+        status = job_queue.status(job_id) if job_id else None
+        if status is None or status["state"] == jobs.FAILED:
+            return [no_update, no_update, html.B(jobs.describe(status), style={"background": "yellow"}), True]
+        if status["state"] == jobs.CANCELLED:
+            return [no_update, no_update, jobs.describe(status), True]
+        if status["state"] != jobs.DONE:
+            if status["partial"] is not None:
+                # a progressive job's coarse result, while it is refined
+                *figures, summary, error_msg = render_result(status["partial"])
+                return figures + [f"{summary} (at {status['partial']['steps_per_hour']} steps/hour, refining...)", jobs.describe(status), False]
+            # show the latest iteration's room temps while converging
+            return [jobs.trajectory_figure(status) or no_update, no_update, jobs.describe(status), False]
+
+        result = status["result"]
+        params = status["params"]
+        if job_queue.collect(job_id):
+            metrics.record_solver_run(f"{result['engine']}:{result['kind']}", n_steps=result["n_steps"], converged=result["converged"], duration=status["duration"],
+                                      n_iterations=result["n_iterations"])
+            catalogue.record("constant",
+                             dict(params["building"], amb_option=params["amb_option"], lwt=params["lwt"], steps_per_hour=result["steps_per_hour"]),
+                             result["summary"])
+
+        return render_result(result) + [True]
+
     return app.server
@@ -1,3 +1,4 @@
+from app import figure_cache, tracing
 from app.dash_apps import create_dash_app
 from dash import html, dcc, ctx, no_update
 
@@ -12,6 +13,65 @@ URL_RULE = "/cop_curves"
 URL_BASE_PATHNAME = "/dash/cop_curves/"
 
 
+def make_cop_curves(cop_vs, cop_model_options, show_points):
+    cop_defs = get_cop_point_options(cop_vs)
+
+    data_chunks = []
+    points_chunks = []
+    if cop_vs == "ambient":
+        temps = list(range(-10, 13))
+        t_key = "T_amb"
+        x_title = "Ambient Temperature"
+    else:
+        temps = list(range(30, 56))
+        t_key = "LWT"
+        x_title = "LWT"
+
+    for option in cop_model_options:
+        cop_def = cop_defs[option]
+
+        # points
+        t_points, cop_points = cop_def[t_key], cop_def["COP"]
+        # points makes the legend messy (if points in legend) or the use of the legend to show/hide curves silly (cant hide points if not in legend!)
+        # so using a checkbox control is a middle way...
+        if show_points:
+            points_chunks.append(
+                {
+                    "x": t_points,
+                    "y": cop_points,
+                    "mode": "markers",
+                    "marker": {"color": "grey", "symbol": "circle-open"},
+                    "hovertemplate": option + ": %{y:.2f} @ T=%{x}C<extra></extra>",
+                    "showlegend": False
+                }
+            )
+
+        # spline
+        cop_model = COP(t_points, cop_points)
+        data_chunks.append(
+            {
+                "x": temps,
+                "y": [cop_model.cop(t) for t in temps],
+                "mode": "lines",
+                "hovertemplate": option + ": %{y:.2f} @ T=%{x}<extra></extra>",
+                "name": option
+            }
+        )
+
+    layout_chunk = {
+        # "title": {
+        #     "text": f"Power and COP",
+        #     "x": 0.05,
+        #     "xanchor": "left",
+        # },
+        "legend": {"x": -0.07, "xanchor": "left", "y": 1.0, "yanchor": "bottom", "orientation": "h"},
+        "xaxis": {"title": x_title, "ticksuffix": "C", "range": (min(temps), max(temps)), "tickangle": 90},
+        "yaxis": {"title": "COP", "fixedrange": False}
+    }
+
+    return {"data": data_chunks + points_chunks, "layout": layout_chunk}  # appending points_chunks keeps the line colours when points shown/hidden
+
+
 def create_dash(server):
     """Create a Dash view"""
     app = create_dash_app(server, URL_RULE, URL_BASE_PATHNAME)
@@ -103,65 +163,13 @@ def create_dash(server):
         ],
         State("cop_vs", "value")
     )
+    @tracing.traced
     def compute(cop_model_options, show_points, cop_vs):
         if cop_model_options is None:  # no compute on initial load or if show_points changed before setting COP model
             return [no_update]
 
-        cop_defs = get_cop_point_options(cop_vs)
-
-        data_chunks = []
-        points_chunks = []
-        if cop_vs == "ambient":
-            temps = list(range(-10, 13))
-            t_key = "T_amb"
-            x_title = "Ambient Temperature"
-        else:
-            temps = list(range(30, 56))
-            t_key = "LWT"
-            x_title = "LWT"
-
-        for option in cop_model_options:
-            cop_def = cop_defs[option]
-
-            # points
-            t_points, cop_points = cop_def[t_key], cop_def["COP"]
-            # points makes the legend messy (if points in legend) or the use of the legend to show/hide curves silly (cant hide points if not in legend!)
-            # so using a checkbox control is a middle way...
-            if show_points:
-                points_chunks.append(
-                    {
-                        "x": t_points,
-                        "y": cop_points,
-                        "mode": "markers",
-                        "marker": {"color": "grey", "symbol": "circle-open"},
-                        "hovertemplate": option + ": %{y:.2f} @ T=%{x}C<extra></extra>",
-                        "showlegend": False
-                    }
-                )
-
-            # spline
-            cop_model = COP(t_points, cop_points)
-            data_chunks.append(
-                {
-                    "x": temps,
-                    "y": [cop_model.cop(t) for t in temps],
-                    "mode": "lines",
-                    "hovertemplate": option + ": %{y:.2f} @ T=%{x}<extra></extra>",
-                    "name": option
-                }
-            )
-
-        layout_chunk = {
-            # "title": {
-            #     "text": f"Power and COP",
-            #     "x": 0.05,
-            #     "xanchor": "left",
-            # },
-            "legend": {"x": -0.07, "xanchor": "left", "y": 1.0, "yanchor": "bottom", "orientation": "h"},
-            "xaxis": {"title": x_title, "ticksuffix": "C", "range": (min(temps), max(temps)), "tickangle": 90},
-            "yaxis": {"title": "COP", "fixedrange": False}
-        }
-
-        return [{"data": data_chunks + points_chunks, "layout": layout_chunk}]  # appending points_chunks keeps the line colours when points shown/hidden
+        figure = figure_cache.cached_figure(("cop", cop_vs, tuple(cop_model_options), bool(show_points)), make_cop_curves,
+                                            cop_vs, cop_model_options, show_points)
+        return [figure]
 
     return app.server
@@ -1,12 +1,15 @@
 import plotly.graph_objs
+from time import perf_counter
 
+from app import metrics, tracing
 from app.dash_apps import create_dash_app
 from dash import html, dcc, ctx, no_update
 
 from dash.dependencies import Output, Input, State
 
 from config import get_building_default_options, get_tmp_options, get_cop_point_options
-from data.solver import CyclingSolver
+from data import engines
+from data.catalogue import RunCatalogue
 
 # endpoint of this page
 URL_RULE = "/cycling"
@@ -21,6 +24,8 @@ def create_dash(server):
     # dash app definitions goes here
     app.config.suppress_callback_exceptions = True
     app.title = "ASHP Cycling Simulation"
+    catalogue = RunCatalogue(server.config["CATALOGUE_DB"])
+    engine = engines.get_engine(server.config.get("SOLVER_ENGINES", dict()).get("cycling", engines.DEFAULT_ENGINE))
 
     # Get the various parameter options
     building_default_options = get_building_default_options()
@@ -155,7 +160,8 @@ def create_dash(server):
             [
                 html.Div(id="summary_results"),
                 html.Div([
-                    html.Div([html.Button("Compute", id="compute")], className="col-md-2"),
+                    html.Div([html.Button("Compute", id="compute"),
+                              dcc.Checklist(["Limit cycle"], id="limit_cycle")], className="col-md-2"),
                     html.Div(id="compute_errors", className="col-md-10")
                 ], className="row")
             ], className="container-fluid"
@@ -222,9 +228,11 @@ def create_dash(server):
             State("lwt", "value"),
             State("lwt_overshoot", "value"),
             State("hp_capacity", "value"),
-            State("setpoint_temp", "value")
+            State("setpoint_temp", "value"),
+            State("limit_cycle", "value")
         ]
     )
+    @tracing.traced
     def compute(n_clicks,
                 heat_loss_factor,
                 emitter_std_power,
@@ -234,7 +242,8 @@ def create_dash(server):
                 cop_model,
                 lwt, lwt_overshoot,
                 hp_capacity,
-                setpoint_temp):
+                setpoint_temp,
+                limit_cycle):
         if ctx.triggered_id is None:  # no compute on initial load
             return [no_update, "", ""]
 
@@ -248,79 +257,105 @@ def create_dash(server):
             "fluid_volume": float(fluid_volume) + (float(volumiser_volume) if with_volumiser else 0)
         }
 
-        solver = CyclingSolver(building_params, cop_model, lwt=lwt, lwt_overshoot=lwt_overshoot, hp_capacity=hp_capacity, initial_temp=setpoint_temp,
-                               steps_per_minute=10)
+        solve_start = perf_counter()
+        with tracing.span("solve"):
+            # limit_cycle: the periodic cycle, independent of the setpoint temp the search starts from
+            result = engine.solve({"kind": "cycling", "building": building_params, "cop_option": cop_model, "lwt": lwt, "lwt_overshoot": lwt_overshoot,
+                                   "hp_capacity": hp_capacity, "initial_temp": setpoint_temp, "limit_cycle": bool(limit_cycle),
+                                   # steps_per_minute is chosen to meet this
+                                   "energy_tolerance": engines.CYCLING_ENERGY_TOLERANCE})
 
-        solver.iterate()
+        cycle_found = result.on_duration is not None and result.off_duration is not None
+        metrics.record_solver_run(f"{result.engine}:{result.kind}", n_steps=result.n_steps, converged=cycle_found, duration=perf_counter() - solve_start,
+                                  n_iterations=result.n_iterations)
 
-        if solver.on_duration is None or solver.off_duration is None:
+        catalogue.record("cycling",
+                         dict(building_params, cop_option=cop_model, lwt=lwt, lwt_overshoot=lwt_overshoot, hp_capacity=hp_capacity,
+                              setpoint_temp=setpoint_temp, steps_per_minute=int(round(1 / result.step_hours / 60)), limit_cycle=bool(limit_cycle)),
+                         result.summary)
+
+        if not cycle_found:
             return [
                 {"data": [], "layout": {"title": {"text": "No Cycle"}}},
                 "",
-                html.B(f"Cycle period exceeds simulation limit of {int(round(solver.max_steps * solver.time_step_secs / 60, 0))} minutes.", style={"background": "orange"})]
-
-        power = [e / solver.time_step_secs * 3600 for e in solver.cycle_elec_used]  # Wh to W
-
-        tc_data_chunks = [
-            {
-                "x": solver.times_mins,
-                "y": solver.mean_water_temp,
-                "mode": "lines",
-                "hovertemplate": "Mean Water: %{y:.1f}C @ t=%{x}<extra></extra>",
-                "name": "Mean Water Temp"
-            },
-            # {
-            #     "x": solver.times_mins,
-            #     "y": solver.cycle_room_temp,
-            #     "mode": "lines",
-            #     "hovertemplate": "Room: %{y:.1f}C @ t=%{x}<extra></extra>",
-            #     "name": "Room Temp"
-            # },
-            {
-                "x": solver.times_mins,
-                "y": power,
-                "text": solver.cycle_cop,
-                "mode": "lines",
-                "hovertemplate": "In: %{y:.1f}kW @ t=%{x}<br>COP = %{text:.2f}<extra></extra>",
-                "name": "In",
-                "yaxis": "y2",
-            },
-            {
-                "x": solver.times_mins,
-                "y": solver.cycle_emitter_output,
-                "mode": "lines",
-                "hovertemplate": "Emitter: %{y:.1f}W @ t=%{x}<extra></extra>",
-                "name": "Emitter",
-                "yaxis": "y2",
+                html.B(f"Cycle period exceeds simulation limit of {int(round(len(result.times) * result.step_hours * 60, 0))} minutes.", style={"background": "orange"})]
+
+        with tracing.span("figures"):
+            times_mins = [t * 60 for t in result.times]
+            power = [e / result.step_hours for e in result.elec_used]  # Wh to W
+            cops = [None if c != c else c for c in result.cop]  # NaN when off
+
+            tc_data_chunks = [
+                {
+                    "x": times_mins,
+                    "y": result.mean_water_temp,
+                    "mode": "lines",
+                    "hovertemplate": "Mean Water: %{y:.1f}C @ t=%{x}<extra></extra>",
+                    "name": "Mean Water Temp"
+                },
+                # {
+                #     "x": times_mins,
+                #     "y": result.room_temp,
+                #     "mode": "lines",
+                #     "hovertemplate": "Room: %{y:.1f}C @ t=%{x}<extra></extra>",
+                #     "name": "Room Temp"
+                # },
+                {
+                    "x": times_mins,
+                    "y": power,
+                    "text": cops,
+                    "mode": "lines",
+                    "hovertemplate": "In: %{y:.1f}kW @ t=%{x}<br>COP = %{text:.2f}<extra></extra>",
+                    "name": "In",
+                    "yaxis": "y2",
+                },
+                {
+                    "x": times_mins,
+                    "y": result.heat_emitted / result.step_hours,
+                    "mode": "lines",
+                    "hovertemplate": "Emitter: %{y:.1f}W @ t=%{x}<extra></extra>",
+                    "name": "Emitter",
+                    "yaxis": "y2",
+                }
+            ]
+
+            tc_layout_chunk = {
+                "title": {
+                    "text": f"One Cycle Pattern",
+                    "x": 0.05,
+                    "xanchor": "left",
+                },
+                "legend": {"x": -0.07, "xanchor": "left", "y": 1.0, "yanchor": "bottom", "orientation": "h"},
+                "xaxis": {"title": "Time (minutes)", "fixedrange": False},
+                "yaxis": {"title": "Temperature", "ticksuffix": "C", "fixedrange": False},
+                "yaxis2": {"title": "Power", "ticksuffix": "W", "fixedrange": False, "overlaying": "y", "side": "right", "showgrid": False}
             }
-        ]
 
-        tc_layout_chunk = {
-            "title": {
-                "text": f"One Cycle Pattern",
-                "x": 0.05,
-                "xanchor": "left",
-            },
-            "legend": {"x": -0.07, "xanchor": "left", "y": 1.0, "yanchor": "bottom", "orientation": "h"},
-            "xaxis": {"title": "Time (minutes)", "fixedrange": False},
-            "yaxis": {"title": "Temperature", "ticksuffix": "C", "fixedrange": False},
-            "yaxis2": {"title": "Power", "ticksuffix": "W", "fixedrange": False, "overlaying": "y", "side": "right", "showgrid": False}
-        }
-
-        # summary
-        duty = round(100 * solver.on_duration / (solver.on_duration + solver.off_duration), 0)
-        cycle_duration_hrs = (solver.on_duration + solver.off_duration) / 60
-        starts_per_hour = 1 / cycle_duration_hrs
-        from math import fabs
-        thermostat_period = cycle_duration_hrs * 1 / fabs(solver.iter_room_temp_delta)  # estimate period for a 1C thermostat hysteresis around target temp
-        mean_input_power = sum(solver.cycle_elec_used) / cycle_duration_hrs / 1000
-        clean_cops = [c for c in solver.cycle_cop if c is not None]
-        mean_cop = sum(clean_cops) / len(clean_cops)
-        summary = [
-            html.P(f"Starts/hr: {starts_per_hour:.1f}, Duty: {duty}%, Room Temp Change: {solver.iter_room_temp_delta:.1f}C, "
-                   f"Thermostatic Period: {thermostat_period:.1f}h"),
-            html.P(f"Mean Power: {mean_input_power:.2f}kW, Mean COP: {mean_cop:.2f}")
-        ]
+            # summary
+            duty = round(100 * result.on_duration / (result.on_duration + result.off_duration), 0)
+            cycle_duration_hrs = (result.on_duration + result.off_duration) / 60
+            starts_per_hour = 1 / cycle_duration_hrs
+            from math import fabs
+            mean_input_power = result.energy_kwh / cycle_duration_hrs
+            mean_cop = result.mean_cop
+            if limit_cycle:
+                # the room temp doesn't change over a limit cycle, so there is no thermostatic period
+                summary = [
+                    html.P(f"Starts/hr: {starts_per_hour:.1f}, Duty: {duty}%, Limit Cycle Room Temp: {result.room_temp[0]:.2f}C "
+                           f"({result.n_iterations} cycle simulations)"),
+                    html.P(f"Mean Power: {mean_input_power:.2f}kW, Mean COP: {mean_cop:.2f}")
+                ]
+                if not result.converged:
+                    error_msg = f"Limit cycle not found after {result.n_iterations} cycle simulations. Last room temp change={result.room_temp_delta:.3f}C."
+            else:
+                thermostat_period = cycle_duration_hrs * 1 / fabs(result.room_temp_delta)  # estimate period for a 1C thermostat hysteresis around target temp
+                summary = [
+                    html.P(f"Starts/hr: {starts_per_hour:.1f}, Duty: {duty}%, Room Temp Change: {result.room_temp_delta:.1f}C, "
+                           f"Thermostatic Period: {thermostat_period:.1f}h"),
+                    html.P(f"Mean Power: {mean_input_power:.2f}kW, Mean COP: {mean_cop:.2f}")
+                ]
+            if result.energy_error is not None:
+                summary.append(html.P(f"At {int(round(1 / result.step_hours / 60))} steps/minute, time step error about {result.energy_error * 1000:.1f}Wh per cycle"))
         return [
             {"data": tc_data_chunks, "layout": tc_layout_chunk},
             summary,
@@ -2,6 +2,7 @@ import json
 import logging
 from os import rename, remove
 
+from app import jobs, metrics, tracing
 from app.dash_apps import create_dash_app
 from dash import html, dcc, ctx, no_update
 
@@ -10,7 +11,9 @@ from dash.dependencies import Output, Input, State
 import plotly.express as px
 
 from config import get_building_default_options, get_tmp_options, get_ambient_hr_options, get_cop_point_options, get_target_temp_options
-from data.solver import RoomTempSolver
+from data import engines
+from data.catalogue import RunCatalogue
+from data.estimate import degree_day_estimate
 
 # endpoint of this page
 URL_RULE = "/room_temp"
@@ -25,6 +28,9 @@ def create_dash(server):
     # dash app definitions goes here
     app.config.suppress_callback_exceptions = True
     app.title = "ASHP Room Temperature Simulation"
+    catalogue = RunCatalogue(server.config["CATALOGUE_DB"])
+    job_queue = jobs.get_queue(server)
+    engine_name = server.config.get("SOLVER_ENGINES", dict()).get("room_temp", engines.DEFAULT_ENGINE)
 
     # Get the various parameter options
     building_default_options = get_building_default_options()
@@ -157,7 +163,8 @@ def create_dash(server):
                             config={"displayModeBar": True}
                         ),
                         id="temp_spinner",
-                        type="circle"
+                        type="circle",
+                        delay_show=1000  # don't flash on every job poll
                     ),
                     className="card"
                 ),
@@ -168,7 +175,8 @@ def create_dash(server):
                             config={"displayModeBar": True}
                         ),
                         id="pwr_spinner",
-                        type="circle"
+                        type="circle",
+                        delay_show=1000  # don't flash on every job poll
                     ),
                     className="card"
                 )
@@ -180,9 +188,17 @@ def create_dash(server):
             [
                 html.P(id="summary_results"),
                 html.Div([
-                    html.Div([html.Button("Compute", id="compute")], className="col-md-2"),
+                    html.Div([html.Button("Compute", id="compute"), html.Button("Cancel", id="cancel")], className="col-md-2"),
                     html.Div(id="compute_errors", className="col-md-10")
-                ], className="row")
+                ], className="row"),
+                dcc.Store(id="job_id"),
+                dcc.Interval(id="job_poll", interval=server.config["JOB_POLL_INTERVAL_MS"], disabled=True),
+                html.Div([
+                    html.Div([html.Button("Find Min LWT", id="find_min_lwt")], className="col-md-2"),
+                    html.Div(id="min_lwt_results", className="col-md-10")
+                ], className="row"),
+                dcc.Store(id="min_lwt_job_id"),
+                dcc.Interval(id="min_lwt_poll", interval=server.config["JOB_POLL_INTERVAL_MS"], disabled=True)
             ], className="container-fluid"
         ),
         html.Hr(),
@@ -272,11 +288,26 @@ def create_dash(server):
         return target_values
 
     @app.callback(
+        Output("summary_results", "children", allow_duplicate=True),
         [
-            Output("temp_chart", "figure"),
-            Output("power_chart", "figure"),
-            Output("summary_results", "children"),
-            Output("compute_errors", "children")
+            Input("heat_loss_factor", "value"),
+            Input("cop_model", "value"),
+            Input("ambient_model", "value")
+        ] + [Input(f"target_{hour:02d}", "value") for hour in range(24)],
+        prevent_initial_call="initial_duplicate"
+    )
+    def estimate(heat_loss_factor, cop_model, ambient_model, *target_temps):
+        # instant steady-state figure, replaced by the solver result when a compute job finishes
+        if heat_loss_factor is None or None in target_temps:
+            return no_update
+        result = degree_day_estimate({"heat_loss_factor": float(heat_loss_factor)}, cop_model, ambient_model, target_temps)
+        mean_cop = "n/a (no heating)" if result["mean_cop"] is None else f"{result['mean_cop']:.2f}"  # None when there is no demand
+        return f"Estimate (steady state, no thermal mass): {result['energy_kwh']:.2f}kWh, COP {mean_cop}. Compute for the full simulation."
+
+    @app.callback(
+        [
+            Output("job_id", "data"),
+            Output("job_poll", "disabled")
         ],
         Input("compute", "n_clicks"),
         [
@@ -301,9 +332,7 @@ def create_dash(server):
                 # passive_heat,
                 *target_temps):
         if ctx.triggered_id is None:  # no compute on initial load
-            return [no_update, no_update, "", ""]
-
-        error_msg = ""
+            return [no_update, no_update]
 
         building_params = {
             "heat_loss_factor": float(heat_loss_factor),
@@ -313,128 +342,147 @@ def create_dash(server):
             # "fluid_volume": float(fluid_volume)
         }
 
-        solver = RoomTempSolver(building_params, cop_model, ambient_model, target_temps_hourly=target_temps,  # passive_heat=passive_heat,
-                                initial_temp=16, steps_per_hour=12)
-
-        MAX_ITERS = 20
-        CONV_THRESHOLD = 0.05
-        print("Iterations:")
-        print("\tfull_day_energy \tfull_day_energy_delta \tmax_t_iter_delta \tmean_t_iter_delta")
-        while (solver.full_day_energy_delta > CONV_THRESHOLD) and (solver.n_iterations < MAX_ITERS):
-            solver.iterate()
-            print(f"{solver.n_iterations}: \t{solver.full_day_energy:.3f} \t\t\t\t{solver.full_day_energy_delta:.4f} \t\t\t\t\t{solver.max_t_iter_delta:.4f} \t\t\t\t{solver.mean_t_iter_delta:.4f}")
-
-        if (solver.full_day_energy_delta > CONV_THRESHOLD) and (solver.n_iterations == MAX_ITERS):
-            error_msg = f"Failed to converge after {MAX_ITERS} solver iterations. Last energy delta={solver.full_day_energy_delta:.3f}kWh. Try increasing steps_per_hour."
-
-        formatted_times = [f"{int(t):02d}:{int(t * 60 + 0.5) % 60:02d}" for t in solver.times]
-        rt_diffs = [(solver.iter_room_temp[i + 1] - solver.iter_room_temp[i]) for i in range(len(solver.iter_room_temp) - 1)]
-        rt_diffs.append(solver.iter_room_temp[0] - solver.iter_room_temp[-1])
-        rt_rates = [r / solver.time_step_duration for r in rt_diffs]
-
-        tc_data_chunks = [
-            # temps
-            {
-                "x": formatted_times,
-                "y": solver.iter_room_temp,
-                "text": rt_rates,
-                "mode": "lines",
-                "hovertemplate": "Rm: %{y:.1f}C @ t=%{x}<br>Rate: %{text:.2f}C/hr<extra></extra>",
-                "name": "Room"
-            },
-            {
-                "x": formatted_times,
-                "y": solver.ambient_temps,
-                "mode": "lines",
-                "hovertemplate": "Outside: %{y:.1f}C @ t=%{x}<extra></extra>",
-                "name": "Ambient"
-            },
-            # power in. Solver returns Watt.hours
-            {
-                "x": formatted_times,
-                "y": [wh / solver.time_step_duration / 1000 for wh in solver.iter_elec_used],
-                "mode": "lines",
-                "hovertemplate": "Power: %{y:.1f}kW @ t=%{x}<extra></extra>",
-                "name": "Power",
-                "yaxis": "y2",
-            }
-        ]
+        # the solver runs in a background job; poll_job() renders the result
+        job_id = job_queue.submit("room_temp", {
+            "engine": engine_name,
+            "building": building_params,
+            "cop_option": cop_model,
+            "amb_option": ambient_model,
+            "target_temps_hourly": list(target_temps),
+            # coarse passes first, shown while refined to the resolution at which the time step error is within the tolerance
+            "energy_tolerance": engines.ENERGY_TOLERANCE
+        })
+        return [job_id, False]
 
-        # add the target temps as a stepped coloured background.
-        y0 = min(int(min(solver.ambient_temps)), int(min(solver.iter_room_temp)))
-        shapes = list()
-        shape_template = {
-            # "fillcolor": "blue",
-            "line": {"width": 0},
-            "opacity": 0.2,
-            "type": "rect",
-            "x0": None,
-            "x1": None,
-            "y0": y0,
-            "y1": None
-            }
-        for hr, target_temp in enumerate(target_temps):
-            if target_temp > y0:  # see above
-                x0, x1 = hr * solver.steps_per_hour, (hr + 1) * solver.steps_per_hour  # x index is really steps
-                shape_template.update({"x0": x0, "x1": x1, "y1": target_temp, "fillcolor": "red" if hr >= 9 else "blue"})
-                shapes.append(shape_template.copy())
-
-        tc_layout_chunk = {
-            "title": {
-                "text": f"Temperatures & Energy In",
-                "x": 0.05,
-                "xanchor": "left",
-            },
-            "legend": {"x": -0.07, "xanchor": "left", "y": 1.0, "yanchor": "bottom", "orientation": "h"},
-            "xaxis": {"title": "Time", "fixedrange": False, "tickangle": 90},
-            "yaxis": {"title": "Temperature", "ticksuffix": "C", "fixedrange": False},
-            "yaxis2": {"title": "Power Input", "ticksuffix": "kW", "fixedrange": False, "overlaying": "y", "side": "right", "showgrid": False},
-            "shapes": shapes
-        }
+    @app.callback(
+        Output("compute_errors", "children", allow_duplicate=True),
+        Input("cancel", "n_clicks"),
+        State("job_id", "data"),
+        prevent_initial_call=True
+    )
+    def cancel(n_clicks, job_id):
+        if job_id and job_queue.cancel(job_id):
+            return "Cancelling..."
+        return no_update
 
-        pwr_data_chunks = [
-            # power in. Solver returns Watt.hours
-            {
-                "x": formatted_times,
-                "y": [wh / solver.time_step_duration / 1000 for wh in solver.iter_elec_used],
-                "mode": "lines",
-                "hovertemplate": "In: %{y:.1f}kW @ t=%{x}<extra></extra>",
-                "name": "Power In"
-            },
-            {
-                "x": formatted_times,
-                "y": [None if cop is None else cop * wh / solver.time_step_duration / 1000 for wh, cop in zip(solver.iter_elec_used, solver.cops)],
-                "mode": "lines",
-                "hovertemplate": "Out: %{y:.1f}kW @ t=%{x}<extra></extra>",
-                "name": "Power Out"
-            },
-            # COP
-            {
-                "x": formatted_times,
-                "y": solver.cops,
-                "mode": "lines",
-                "hovertemplate": "COP: %{y:.2f} @ t=%{x}<extra></extra>",
-                "name": "COP",
-                "yaxis": "y2",
+    def render_result(result, target_temps):
+        """Figures, summary and convergence warning for a job result (or the partial result of a progressive job)"""
+        error_msg = ""
+        if not result["converged"]:
+            error_msg = f"Failed to converge after {result['n_iterations']} solver iterations. Last energy delta={result['energy_delta']:.3f}kWh."
+        elif result["energy_error"] is not None and result["energy_error"] > engines.ENERGY_TOLERANCE:
+            error_msg = f"Time step error of about {result['energy_error']:.2f}kWh, even at {result['steps_per_hour']} steps/hour."
+
+        with tracing.span("figures"):
+            formatted_times = [f"{int(t):02d}:{int(t * 60 + 0.5) % 60:02d}" for t in result["times"]]
+            rt_diffs = [(result["room_temp"][i + 1] - result["room_temp"][i]) for i in range(len(result["room_temp"]) - 1)]
+            rt_diffs.append(result["room_temp"][0] - result["room_temp"][-1])
+            rt_rates = [r / result["step_hours"] for r in rt_diffs]
+
+            tc_data_chunks = [
+                # temps
+                {
+                    "x": formatted_times,
+                    "y": result["room_temp"],
+                    "text": rt_rates,
+                    "mode": "lines",
+                    "hovertemplate": "Rm: %{y:.1f}C @ t=%{x}<br>Rate: %{text:.2f}C/hr<extra></extra>",
+                    "name": "Room"
+                },
+                {
+                    "x": formatted_times,
+                    "y": result["ambient_temp"],
+                    "mode": "lines",
+                    "hovertemplate": "Outside: %{y:.1f}C @ t=%{x}<extra></extra>",
+                    "name": "Ambient"
+                },
+                # power in. Solver returns Watt.hours
+                {
+                    "x": formatted_times,
+                    "y": [wh / result["step_hours"] / 1000 for wh in result["elec_used"]],
+                    "mode": "lines",
+                    "hovertemplate": "Power: %{y:.1f}kW @ t=%{x}<extra></extra>",
+                    "name": "Power",
+                    "yaxis": "y2",
+                }
+            ]
+
+            # add the target temps as a stepped coloured background.
+            y0 = min(int(min(result["ambient_temp"])), int(min(result["room_temp"])))
+            shapes = list()
+            shape_template = {
+                # "fillcolor": "blue",
+                "line": {"width": 0},
+                "opacity": 0.2,
+                "type": "rect",
+                "x0": None,
+                "x1": None,
+                "y0": y0,
+                "y1": None
+                }
+            for hr, target_temp in enumerate(target_temps):
+                if target_temp > y0:  # see above
+                    x0, x1 = hr * result["steps_per_hour"], (hr + 1) * result["steps_per_hour"]  # x index is really steps
+                    shape_template.update({"x0": x0, "x1": x1, "y1": target_temp, "fillcolor": "red" if hr >= 9 else "blue"})
+                    shapes.append(shape_template.copy())
+
+            tc_layout_chunk = {
+                "title": {
+                    "text": f"Temperatures & Energy In",
+                    "x": 0.05,
+                    "xanchor": "left",
+                },
+                "legend": {"x": -0.07, "xanchor": "left", "y": 1.0, "yanchor": "bottom", "orientation": "h"},
+                "xaxis": {"title": "Time", "fixedrange": False, "tickangle": 90},
+                "yaxis": {"title": "Temperature", "ticksuffix": "C", "fixedrange": False},
+                "yaxis2": {"title": "Power Input", "ticksuffix": "kW", "fixedrange": False, "overlaying": "y", "side": "right", "showgrid": False},
+                "shapes": shapes
             }
-        ]
 
-        pwr_layout_chunk = {
-            "title": {
-                "text": f"ASHP Power and COP",
-                "x": 0.05,
-                "xanchor": "left",
-            },
-            "legend": {"x": -0.07, "xanchor": "left", "y": 1.0, "yanchor": "bottom", "orientation": "h"},
-            "xaxis": {"title": "Time", "fixedrange": False, "tickangle": 90},
-            "yaxis": {"title": "Power", "ticksuffix": "kW", "fixedrange": False},
-            "yaxis2": {"title": "COP", "fixedrange": False, "overlaying": "y", "side": "right", "showgrid": False},
-        }
+            pwr_data_chunks = [
+                # power in. Solver returns Watt.hours
+                {
+                    "x": formatted_times,
+                    "y": [wh / result["step_hours"] / 1000 for wh in result["elec_used"]],
+                    "mode": "lines",
+                    "hovertemplate": "In: %{y:.1f}kW @ t=%{x}<extra></extra>",
+                    "name": "Power In"
+                },
+                {
+                    "x": formatted_times,
+                    "y": [None if cop is None else cop * wh / result["step_hours"] / 1000 for wh, cop in zip(result["elec_used"], result["cop"])],
+                    "mode": "lines",
+                    "hovertemplate": "Out: %{y:.1f}kW @ t=%{x}<extra></extra>",
+                    "name": "Power Out"
+                },
+                # COP
+                {
+                    "x": formatted_times,
+                    "y": result["cop"],
+                    "mode": "lines",
+                    "hovertemplate": "COP: %{y:.2f} @ t=%{x}<extra></extra>",
+                    "name": "COP",
+                    "yaxis": "y2",
+                }
+            ]
+
+            pwr_layout_chunk = {
+                "title": {
+                    "text": f"ASHP Power and COP",
+                    "x": 0.05,
+                    "xanchor": "left",
+                },
+                "legend": {"x": -0.07, "xanchor": "left", "y": 1.0, "yanchor": "bottom", "orientation": "h"},
+                "xaxis": {"title": "Time", "fixedrange": False, "tickangle": 90},
+                "yaxis": {"title": "Power", "ticksuffix": "kW", "fixedrange": False},
+                "yaxis2": {"title": "COP", "fixedrange": False, "overlaying": "y", "side": "right", "showgrid": False},
+            }
 
-        # summary
-        clean_cops = [c for c in solver.cops if c is not None]
-        mean_cop = sum(clean_cops) / len(clean_cops)
-        summary = f"Total Energy: {solver.full_day_energy:.2f}kWh, Mean COP: {mean_cop:.2f}"
+            # summary
+            mean_cop = result["summary"]["mean_cop"]  # None if the heating was never on
+            summary = f"Total Energy: {result['energy_kwh']:.2f}kWh, Mean COP: {'n/a (no heating)' if mean_cop is None else f'{mean_cop:.2f}'}"
+            if result["energy_error"] is not None:
+                summary += f" (time step error about {result['energy_error']:.2f}kWh)"
 
         return [
             {"data": tc_data_chunks, "layout": tc_layout_chunk},
@@ -443,4 +491,121 @@ def create_dash(server):
             html.B(error_msg, style={"background": "yellow"})
         ]
 
+    @app.callback(
+        [
+            Output("temp_chart", "figure"),
+            Output("power_chart", "figure"),
+            Output("summary_results", "children"),
+            Output("compute_errors", "children"),
+            Output("job_poll", "disabled", allow_duplicate=True)
+        ],
+        [
+            Input("job_poll", "n_intervals"),
+            Input("job_id", "data")
+        ],
+        prevent_initial_call=True
+    )
+    @tracing.traced
+    def poll_job(n_intervals, job_id):
+        status = job_queue.status(job_id) if job_id else None
+        if status is None or status["state"] == jobs.FAILED:
+            return [no_update, no_update, no_update, html.B(jobs.describe(status), style={"background": "yellow"}), True]
+        if status["state"] == jobs.CANCELLED:
+            return [no_update, no_update, no_update, jobs.describe(status), True]
+        if status["state"] != jobs.DONE:
+            if status["partial"] is not None:
+                # a progressive job's coarse result, while it is refined
+                *figures, summary, error_msg = render_result(status["partial"], status["params"]["target_temps_hourly"])
+                return figures + [f"{summary} (at {status['partial']['steps_per_hour']} steps/hour, refining...)", jobs.describe(status), False]
+            # show the latest iteration's room temps while converging
+            return [jobs.trajectory_figure(status) or no_update, no_update, no_update, jobs.describe(status), False]
+
+        result = status["result"]
+        params = status["params"]
+        target_temps = params["target_temps_hourly"]
+        if job_queue.collect(job_id):
+            metrics.record_solver_run(f"{result['engine']}:{result['kind']}", n_steps=result["n_steps"], converged=result["converged"], duration=status["duration"],
+                                      n_iterations=result["n_iterations"])
+            catalogue.record("room_temp",
+                             dict(params["building"], cop_option=params["cop_option"], amb_option=params["amb_option"],
+                                  lwt=cop_point_options[params["cop_option"]]["LWT"], steps_per_hour=result["steps_per_hour"], target_temps=target_temps),
+                             result["summary"])
+
+        return render_result(result, target_temps) + [True]
+
+    @app.callback(
+        [
+            Output("min_lwt_job_id", "data"),
+            Output("min_lwt_poll", "disabled")
+        ],
+        Input("find_min_lwt", "n_clicks"),
+        [
+            State("heat_loss_factor", "value"),
+            State("emitter_std_power", "value"),
+            State("tmp", "value"),
+            State("floor_area", "value"),
+            State("cop_model", "value"),
+            State("ambient_model", "value")
+        ] + [State(f"target_{hour:02d}", "value") for hour in range(24)]
+    )
+    def find_min_lwt(n_clicks,
+                     heat_loss_factor,
+                     emitter_std_power,
+                     tmp,
+                     floor_area,
+                     cop_model,
+                     ambient_model,
+                     *target_temps):
+        if ctx.triggered_id is None:  # no compute on initial load
+            return [no_update, no_update]
+
+        building_params = {
+            "heat_loss_factor": float(heat_loss_factor),
+            "emitter_std_power": float(emitter_std_power),
+            "tmp": float(tmp),
+            "floor_area": float(floor_area)
+        }
+
+        # the search runs in a background job; poll_min_lwt() renders the result
+        job_id = job_queue.submit("min_lwt", {
+            "building": building_params,
+            "cop_option": cop_model,
+            "amb_option": ambient_model,
+            "target_temps_hourly": list(target_temps),
+            "steps_per_hour": 12
+        })
+        return [job_id, False]
+
+    @app.callback(
+        [
+            Output("min_lwt_results", "children"),
+            Output("min_lwt_poll", "disabled", allow_duplicate=True)
+        ],
+        [
+            Input("min_lwt_poll", "n_intervals"),
+            Input("min_lwt_job_id", "data")
+        ],
+        prevent_initial_call=True
+    )
+    @tracing.traced
+    def poll_min_lwt(n_intervals, job_id):
+        status = job_queue.status(job_id) if job_id else None
+        if status is None or status["state"] == jobs.FAILED:
+            return [html.B(jobs.describe(status), style={"background": "yellow"}), True]
+        if status["state"] != jobs.DONE:
+            return [jobs.describe(status), status["state"] == jobs.CANCELLED]
+
+        result = status["result"]
+        cop_model = status["params"]["cop_option"]
+        if result["lwt"] is None:
+            message = "The simulation at the highest LWT did not converge, so the search could not start." if result["n_unconverged"] \
+                else "The target temperatures cannot be met even at the highest LWT for this COP model."
+            return [html.B(message, style={"background": "yellow"}), True]
+        mean_cop = "n/a (no heating)" if result["mean_cop"] is None else f"{result['mean_cop']:.2f}"
+        unconverged = f" {result['n_unconverged']} did not converge; the min LWT is between {result['lwt_low']:.1f}C and " \
+                      f"{result['lwt_high']:.1f}C." if result["n_unconverged"] else ""
+        return [(f"Min LWT: {result['lwt']:.1f}C (comfort shortfall {result['comfort_shortfall']:.2f}K.h), "
+                 f"Total Energy: {result['energy_kwh']:.2f}kWh, Mean COP: {mean_cop}. "
+                 f"COPs interpolated across {cop_model.split('_LWT')[0]} LWTs; {result['n_evaluations']} simulations.{unconverged}"), True]
+
     return app.server
@@ -0,0 +1,168 @@
+"""Cache for figures which are deterministic functions of the config.py tables (ambient curves, COP curves).
+
+Figures are built on first use and kept for the life of the process. Named figures are also served as JSON at /figures/<name>.json,
+and those routes plus the Dash layouts added with add_conditional_path() are sent with ETag and Last-Modified validators so that browsers
+and reverse proxies revalidate with a 304 rather than have the server rebuild or resend them. The ETag is a hash of the config tables
+and of the source of the modules which build the figures and layouts, so it changes (and caches are invalidated) when either does.
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from flask import Response, abort, request
+from plotly.utils import PlotlyJSONEncoder
+
+from app import metrics
+from config import get_ambient_hr_options, get_cop_point_options
+
+_lock = threading.Lock()
+_builders = dict()  # figure name -> function returning the figure dict
+_figures = dict()  # cache key -> figure dict
+_figure_json = dict()  # figure name -> serialised figure
+
+# Dash layouts containing only cached figures, so which can also be validated on the config hash. See add_conditional_path()
+CONDITIONAL_PATHS = set()
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config.py")
+# source files which the cached figures and conditional layouts are built by, besides config.py
+_sources = set()
+
+# user-chosen combinations (e.g. of COP options) are unbounded, so the oldest entries are dropped beyond this
+MAX_CACHED_FIGURES = 256
+
+CACHE_CONTROL = "public, no-cache"  # i.e. may be stored, but must be revalidated on each use
+
+
+@lru_cache(maxsize=4)
+def _validators(sources):
+    tables = {
+        "ambient": get_ambient_hr_options(),
+        "cop_ambient": get_cop_point_options(vs="ambient"),
+        "cop_lwt": get_cop_point_options(vs="lwt")
+    }
+    digest = hashlib.sha256(json.dumps(tables, sort_keys=True, default=str).encode())
+    for source in sources:
+        with open(source, "rb") as f:
+            digest.update(f.read())
+    last_modified = max(int(os.path.getmtime(source)) for source in (CONFIG_FILE,) + sources)
+    return digest.hexdigest()[:20], datetime.fromtimestamp(last_modified, tz=timezone.utc)
+
+
+def config_hash():
+    """
+    Hash of the config tables which figures are built from, and of the source of the modules building the figures and conditional layouts.
+    These are code, so this is fixed for the life of the process (once the Dash apps have registered).
+    """
+    return _validators(tuple(sorted(_sources)))[0]
+
+
+def config_last_modified():
+    """
+    Last-Modified for the cached figures: when config.py or one of the modules building them was last changed, to the second (as HTTP
+    dates are)
+    """
+    return _validators(tuple(sorted(_sources)))[1]
+
+
+def _add_source(module_name):
+    source = getattr(sys.modules.get(module_name), "__file__", None)
+    if source is not None:
+        _sources.add(os.path.abspath(source))
+
+
+def register(name, builder):
+    """Make a figure available as /figures/<name>.json. :param builder: function with no arguments returning a plotly figure dict"""
+    _builders[name] = builder
+    _add_source(builder.__module__)
+
+
+def add_conditional_path(path, module_name):
+    """
+    Validate a Dash layout, which must contain only cached figures, as for the /figures routes.
+
+    :param path: e.g. URL_BASE_PATHNAME + "_dash-layout"
+    :param module_name: of the module defining the layout, i.e. __name__, so that its source is part of the ETag
+    """
+    CONDITIONAL_PATHS.add(path)
+    _add_source(module_name)
+
+
+def cached_figure(key, builder, *args):
+    """
+    Get a figure from the cache, building it on a miss.
+
+    :param key: hashable cache key. Must identify the figure completely, given the config tables
+    :param builder: function which builds the figure from args
+    """
+    with _lock:
+        figure = _figures.get(key)
+    metrics.record_cache("figures", figure is not None)
+    if figure is None:
+        figure = builder(*args)
+        with _lock:
+            _figures[key] = figure
+            while len(_figures) > MAX_CACHED_FIGURES:
+                del _figures[next(iter(_figures))]
+    return figure
+
+
+def get_figure(name):
+    """A registered figure, see register()"""
+    return cached_figure(name, _builders[name])
+
+
+def figure_json(name):
+    with _lock:
+        text = _figure_json.get(name)
+    if text is None:
+        text = json.dumps(get_figure(name), cls=PlotlyJSONEncoder)
+        with _lock:
+            _figure_json[name] = text
+    return text
+
+
+def _is_conditional(path):
+    if path.startswith("/figures/") and path.endswith(".json"):
+        return path[len("/figures/"):-len(".json")] in _builders
+    return path in CONDITIONAL_PATHS
+
+
+def _not_modified():
+    """True if the request's validators match the cached figures. If-None-Match takes precedence, as in RFC 9110"""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(config_hash())
+    return request.if_modified_since is not None and request.if_modified_since >= config_last_modified()
+
+
+def _set_validators(response):
+    response.set_etag(config_hash())
+    response.last_modified = config_last_modified()
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    return response
+
+
+def init_app(app):
+    """Add the /figures route and conditional GET handling for it and CONDITIONAL_PATHS"""
+
+    @app.route("/figures/<name>.json")
+    def figure(name):
+        if name not in _builders:
+            abort(404)
+        return Response(figure_json(name), mimetype="application/json")
+
+    @app.before_request
+    def check_not_modified():
+        if request.method == "GET" and _is_conditional(request.path) and _not_modified():
+            metrics.record_cache("figures_http", True)
+            return _set_validators(Response(status=304))
+
+    @app.after_request
+    def add_validators(response):
+        if request.method == "GET" and _is_conditional(request.path) and response.status_code == 200:
+            metrics.record_cache("figures_http", False)
+            _set_validators(response)
+        return response
@@ -0,0 +1,348 @@
+"""Background execution of slow solver runs, so Dash callbacks don't hold a Flask worker for the duration of a convergence loop.
+
+A compute callback submits a job and returns at once; the page then polls the job with a dcc.Interval until it is done.
+Jobs run in a process pool. Their state, progress (iteration number and the current convergence deltas) and result are kept in a
+SQLite table, which both the workers and the Flask process can read and write, so polling needs no shared memory. Finished jobs are
+deleted retention_seconds after they finish (JOB_RETENTION_SECONDS in config.py), on the next submit() or app start.
+
+Each job kind is a module-level function run_xxx(params, progress) -> result dict, see JOB_KINDS. It must call progress() once per
+solver iteration and return something JSON-serialisable. progress() also records the iteration's room temp trajectory, so pages can draw
+the solution as it converges, and raises JobCancelled if cancellation has been requested, which ends the job at the next iteration.
+
+The solver job kinds run a solver engine (see data/engines.py) on their params, which are an engine config without the "kind", plus
+optionally "engine" (default data.engines.DEFAULT_ENGINE). Results are Result.to_dict(). For a progressive solve (params "resolutions" or "energy_tolerance")
+each pass's result but the last is published as the job's partial result, so a page can show the coarse result while it is refined.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+
+from data import engines
+from data.lwt_search import find_min_lwt
+
+DEFAULT_WORKERS = 2
+# seconds a finished job is kept for polling before it is deleted
+DEFAULT_RETENTION_SECONDS = 3600
+
+# job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+_SCHEMA = """
+PRAGMA journal_mode=WAL;
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    state TEXT NOT NULL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    iteration INTEGER NOT NULL DEFAULT 0,
+    progress TEXT,
+    history TEXT,
+    trajectory TEXT,
+    partial TEXT,
+    result TEXT,
+    error TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    collected INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ix_jobs_created ON jobs (created);
+CREATE INDEX IF NOT EXISTS ix_jobs_finished ON jobs (finished);
+"""
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=10)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _update(db_path, job_id, **columns):
+    with closing(_connect(db_path)) as conn, conn:
+        conn.execute(f"UPDATE jobs SET {', '.join(f'{c} = ?' for c in columns)} WHERE id = ?", list(columns.values()) + [job_id])
+
+
+def _finish(db_path, job_id, state, **columns):
+    """Record a job's outcome. The per-iteration trajectory and partial result are dropped, as they are only shown while it runs"""
+    _update(db_path, job_id, state=state, finished=time.time(), trajectory=None, partial=None, **columns)
+
+
+def _cancel_requested(db_path, job_id):
+    with closing(_connect(db_path)) as conn:
+        return conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()[0] == 1
+
+
+def _run_engine(kind, params, progress):
+    """Solve params (an engine config without the kind, plus optionally "engine") with a registered engine, see data/engines.py"""
+    def engine_progress(iteration, trajectory=None, partial=None, **deltas):
+        progress(iteration, trajectory=trajectory, partial=None if partial is None else partial.to_dict(), **deltas)
+
+    config = {k: v for k, v in params.items() if k != "engine"}
+    config["kind"] = kind
+    return engines.solve(config, params.get("engine", engines.DEFAULT_ENGINE), engine_progress).to_dict()
+
+
+def run_room_temp(params, progress):
+    """
+    Converge a room_temp solve, progressively if params has "resolutions" or "energy_tolerance".
+
+    :param params: data.engines config for "room_temp", e.g. "building", "cop_option", "amb_option", "target_temps_hourly" and
+        "steps_per_hour", "resolutions" or "energy_tolerance"
+    :param progress: called after each iteration
+    """
+    return _run_engine("room_temp", params, progress)
+
+
+def run_constant_lwt(params, progress):
+    """
+    Converge a constant_lwt solve, progressively if params has "resolutions" or "energy_tolerance".
+
+    :param params: data.engines config for "constant_lwt", e.g. "building", "amb_option", "lwt" and "steps_per_hour", "resolutions" or "energy_tolerance"
+    :param progress: called after each iteration
+    """
+    return _run_engine("constant_lwt", params, progress)
+
+
+def run_min_lwt(params, progress):
+    """
+    Search for the lowest LWT which meets a target temp schedule, see data.lwt_search.find_min_lwt(). Progress is reported per search round.
+    The candidates are evaluated one at a time in the job's worker process, by bisection, so a search takes no more processes than any job.
+
+    :param params: "building", "cop_option", "amb_option", "target_temps_hourly" and optionally "steps_per_hour"
+    :param progress: called after each round
+    """
+    return find_min_lwt(params["building"], params["cop_option"], params["amb_option"], params["target_temps_hourly"],
+                        steps_per_hour=params.get("steps_per_hour", 12), progress=progress)
+
+
+JOB_KINDS = {
+    "room_temp": run_room_temp,
+    "constant_lwt": run_constant_lwt,
+    "min_lwt": run_min_lwt
+}
+
+
+def _run_job(db_path, job_id, kind, params):
+    """Worker process entry point. All outcomes, including exceptions, are written to the job table."""
+    if _cancel_requested(db_path, job_id):  # cancelled while queued
+        _finish(db_path, job_id, CANCELLED)
+        return
+    _update(db_path, job_id, state=RUNNING, started=time.time())
+    history = list()
+
+    def progress(iteration, trajectory=None, partial=None, **deltas):
+        """
+        :param iteration: solver iteration number
+        :param trajectory: optional dict of series (e.g. "times", "room_temp") for the iteration just completed
+        :param partial: optional result dict for a pass which has completed, e.g. the coarse pass of a progressive job. Called
+            without deltas, it doesn't count as an iteration
+        :param deltas: summary numbers for the iteration, e.g. energy and convergence deltas
+        """
+        if partial is not None:
+            _update(db_path, job_id, partial=json.dumps(partial))
+        if deltas:
+            history.append(deltas)
+            _update(db_path, job_id, iteration=iteration, progress=json.dumps(deltas), history=json.dumps(history),
+                    trajectory=None if trajectory is None else json.dumps(trajectory))
+        if _cancel_requested(db_path, job_id):
+            raise JobCancelled()
+
+    try:
+        result = JOB_KINDS[kind](params, progress)
+        _finish(db_path, job_id, DONE, result=json.dumps(result))
+    except JobCancelled:
+        _finish(db_path, job_id, CANCELLED)
+    except Exception as e:
+        logging.exception(e)
+        _finish(db_path, job_id, FAILED, error=f"{type(e).__name__}: {e}")
+
+
+class JobQueue:
+    def __init__(self, db_path, max_workers=DEFAULT_WORKERS, retention_seconds=DEFAULT_RETENTION_SECONDS):
+        """
+        Job table plus the process pool which works through it. One instance per Flask app; see init_app().
+        The pool is started on the first submit(), using "spawn" so that workers don't inherit the Flask process's threads and locks.
+
+        :param db_path: sqlite file, created (with the schema) if it doesn't exist
+        :param max_workers: number of worker processes, i.e. jobs computed at once. Further jobs wait in the queued state
+        :param retention_seconds: finished (done, failed or cancelled) jobs are deleted this long after finishing, see purge()
+        """
+        self.db_path = db_path
+        self.max_workers = max_workers
+        self.retention_seconds = retention_seconds
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        with closing(_connect(db_path)) as conn, conn:
+            conn.executescript(_SCHEMA)
+        self.purge()
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def submit(self, kind, params):
+        """
+        Queue a job.
+
+        :param kind: key into JOB_KINDS
+        :param params: JSON-serialisable dict passed to the job function
+        :return: job id
+        """
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind {kind}. Allowed: {sorted(JOB_KINDS)}")
+        self.purge()
+        job_id = uuid.uuid4().hex
+        with closing(_connect(self.db_path)) as conn, conn:
+            conn.execute("INSERT INTO jobs (id, kind, params, state, created) VALUES (?, ?, ?, ?, ?)",
+                         (job_id, kind, json.dumps(params), QUEUED, time.time()))
+        future = self._get_executor().submit(_run_job, self.db_path, job_id, kind, params)
+        future.add_done_callback(lambda f: self._check_future(job_id, f))
+        return job_id
+
+    def _check_future(self, job_id, future):
+        # _run_job catches exceptions from the job itself; this catches the pool failing, e.g. a worker being killed
+        if not future.cancelled() and future.exception() is not None:
+            logging.error("Job {} failed in the process pool: {}".format(job_id, future.exception()))
+            _finish(self.db_path, job_id, FAILED, error=str(future.exception()))
+
+    def status(self, job_id):
+        """
+        :return: dict with "id", "kind", "params", "state", "iteration", "progress" (dict of the latest deltas, or None), "history" (list of
+            deltas for every iteration so far), "trajectory" (series for the latest iteration, or None), "partial" (result of the latest
+            completed pass of a progressive job, or None), "result" (dict, once done),
+            "error", and "duration" (seconds running so far, or to completion). The trajectory and partial result are None once the job has
+            finished. None for an unknown job id, including one deleted by purge()
+        """
+        with closing(_connect(self.db_path)) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        status = {k: row[k] for k in ("id", "kind", "state", "iteration", "error")}
+        status["progress"] = None if row["progress"] is None else json.loads(row["progress"])
+        status["history"] = list() if row["history"] is None else json.loads(row["history"])
+        status["trajectory"] = None if row["trajectory"] is None else json.loads(row["trajectory"])
+        status["partial"] = None if row["partial"] is None else json.loads(row["partial"])
+        status["result"] = None if row["result"] is None else json.loads(row["result"])
+        status["params"] = json.loads(row["params"])
+        status["duration"] = None if row["started"] is None else (row["finished"] or time.time()) - row["started"]
+        return status
+
+    def cancel(self, job_id):
+        """
+        Ask for a job to be stopped. A running job stops at its next progress() call, i.e. at the end of the current solver iteration;
+        a queued job doesn't start.
+
+        :return: False if the job had already finished
+        """
+        with closing(_connect(self.db_path)) as conn, conn:
+            return conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND state IN (?, ?)", (job_id, QUEUED, RUNNING)).rowcount == 1
+
+    def collect(self, job_id):
+        """
+        Mark a finished job's result as having been used, so that side effects of completion (metrics, catalogue) happen once even if
+        it is polled more than once.
+
+        :return: True the first time it is called for the job
+        """
+        with closing(_connect(self.db_path)) as conn, conn:
+            return conn.execute("UPDATE jobs SET collected = 1 WHERE id = ? AND collected = 0", (job_id,)).rowcount == 1
+
+    def purge(self):
+        """
+        Delete the jobs which finished more than retention_seconds ago, collected or not. Queued and running jobs are kept.
+
+        :return: number of jobs deleted
+        """
+        with closing(_connect(self.db_path)) as conn, conn:
+            return conn.execute("DELETE FROM jobs WHERE finished < ? AND state IN (?, ?, ?)",
+                                (time.time() - self.retention_seconds, DONE, FAILED, CANCELLED)).rowcount
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+def describe(status):
+    """One line description of a job which isn't done, for display while polling"""
+    if status is None:
+        return "Unknown job."
+    if status["state"] == QUEUED:
+        return "Waiting for a free worker..."
+    if status["state"] == FAILED:
+        return f"Computation failed: {status['error']}"
+    if status["state"] == CANCELLED:
+        return f"Cancelled after {status['iteration']} iterations."
+    progress = status["progress"]
+    if progress is None:
+        return "Starting..."
+    if status["kind"] == "min_lwt":
+        return (f"Search round {status['iteration']}: LWT between {progress['lwt_low']:.1f}C and {progress['lwt_high']:.1f}C, "
+                f"{progress['n_evaluations']} simulations ({status['duration']:.1f}s)")
+    energies = ", ".join(f"{h['energy_kwh']:.2f}" for h in status["history"][-8:])
+    resolution = f" at {progress['steps_per_hour']} steps/hour" if "steps_per_hour" in progress else ""
+    return (f"Iteration {status['iteration']}{resolution}: {progress['energy_kwh']:.2f}kWh, energy delta {progress['energy_delta']:.3f}kWh, "
+            f"max room temp delta {progress['max_t_iter_delta']:.3f}K ({status['duration']:.1f}s). Energy by iteration: {energies}kWh")
+
+
+def trajectory_figure(status):
+    """Figure of the room temp for the latest iteration of a running job, or None if there isn't one yet"""
+    trajectory = status["trajectory"]
+    if trajectory is None:
+        return None
+    formatted_times = [f"{int(t):02d}:{int(t * 60 + 0.5) % 60:02d}" for t in trajectory["times"]]
+    return {
+        "data": [
+            {
+                "x": formatted_times,
+                "y": trajectory["room_temp"],
+                "mode": "lines",
+                "hovertemplate": "Rm: %{y:.1f}C @ t=%{x}<extra></extra>",
+                "name": "Room"
+            },
+            {
+                "x": formatted_times,
+                "y": trajectory["ambient_temps"],
+                "mode": "lines",
+                "hovertemplate": "Outside: %{y:.1f}C @ t=%{x}<extra></extra>",
+                "name": "Ambient"
+            }
+        ],
+        "layout": {
+            "title": {"text": f"Converging: iteration {status['iteration']}", "x": 0.05, "xanchor": "left"},
+            "legend": {"x": -0.07, "xanchor": "left", "y": 1.0, "yanchor": "bottom", "orientation": "h"},
+            "xaxis": {"title": "Time", "fixedrange": False, "tickangle": 90},
+            "yaxis": {"title": "Temperature", "ticksuffix": "C", "fixedrange": False}
+        }
+    }
+
+
+def init_app(app):
+    """Create the app's JobQueue. Dash apps get it with get_queue(server)."""
+    app.config.setdefault("JOBS_DB", os.path.join(app.instance_path, "jobs.sqlite"))
+    app.config.setdefault("JOB_WORKERS", DEFAULT_WORKERS)
+    app.config.setdefault("JOB_RETENTION_SECONDS", DEFAULT_RETENTION_SECONDS)
+    app.extensions["job_queue"] = JobQueue(app.config["JOBS_DB"], app.config["JOB_WORKERS"], app.config["JOB_RETENTION_SECONDS"])
+
+
+def get_queue(server):
+    return server.extensions["job_queue"]
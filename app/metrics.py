@@ -0,0 +1,211 @@
+"""Lightweight Prometheus-style metrics for the Flask app and the solvers.
+
+Deliberately does not depend on prometheus_client: the metric types here are just dicts of label-tuple -> value behind a lock,
+so recording is cheap enough to leave on permanently. The /metrics route renders them in the Prometheus text exposition format.
+"""
+import os
+import re
+import resource
+import threading
+from time import perf_counter
+
+from flask import Response, g, request
+
+_lock = threading.Lock()
+_registry = list()  # all metrics, in order of creation, for rendering
+
+# matches the Dash callback endpoint and captures the page name from URL_BASE_PATHNAME, e.g. /dash/room_temp/_dash-update-component
+_DASH_UPDATE_RE = re.compile(r"^/dash/([^/]+)/_dash-update-component$")
+
+# seconds. Callbacks range from a few ms (COP curves) to many seconds (long convergence)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class _Metric:
+    metric_type = None
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = dict()  # key is tuple of label values in the order of label_names
+        with _lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        with _lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def __init__(self, name, documentation, label_names=(), function=None):
+        """
+        :param function: if set, called at scrape time to get the (un-labelled) value, rather than using set()
+        """
+        super().__init__(name, documentation, label_names)
+        self._function = function
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = value
+
+    def render(self):
+        if self._function is not None:
+            self.set(self._function())
+        return super().render()
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                # per-bucket (non-cumulative) counts + one for +Inf, then sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            ix = 0
+            while ix < len(self.buckets) and value > self.buckets[ix]:
+                ix += 1
+            state[0][ix] += 1
+            state[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        with _lock:
+            items = sorted((k, (list(v[0]), v[1])) for k, v in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for le, count in zip(list(self.buckets) + ["+Inf"], counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', le))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+def _resident_memory_bytes():
+    # /proc is cheap and gives current RSS on Linux; otherwise fall back to peak RSS (kB on Linux, bytes on macOS)
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# request/callback latency
+DASH_CALLBACK_SECONDS = Histogram("thermal_sims_dash_callback_seconds", "Latency of Dash callback requests, by page.", ["page"])
+DASH_CALLBACK_ERRORS = Counter("thermal_sims_dash_callback_errors_total", "Dash callback requests returning an error status, by page.", ["page"])
+
+# solver work
+SOLVER_RUNS = Counter("thermal_sims_solver_runs_total", "Solver runs, by solver class.", ["solver"])
+SOLVER_ITERATIONS = Counter("thermal_sims_solver_iterations_total", "Solver iterations (calls to iterate()), by solver class.", ["solver"])
+SOLVER_STEPS = Counter("thermal_sims_solver_steps_total", "Solver time steps computed, by solver class.", ["solver"])
+SOLVER_NON_CONVERGENCE = Counter("thermal_sims_solver_non_convergence_total", "Solver runs which failed to converge (or hit max steps), by solver class.",
+                                 ["solver"])
+SOLVER_SECONDS = Histogram("thermal_sims_solver_seconds", "Wall time spent in solver runs, by solver class.", ["solver"])
+
+# caches. Hit rate = hits / (hits + misses)
+CACHE_REQUESTS = Counter("thermal_sims_cache_requests_total", "Cache lookups, by cache name and result (hit or miss).", ["cache", "result"])
+
+# process
+PROCESS_RESIDENT_MEMORY = Gauge("thermal_sims_process_resident_memory_bytes", "Resident memory size of the server process in bytes.",
+                                function=_resident_memory_bytes)
+
+
+def record_solver_run(solver, n_steps, converged=True, duration=None, n_iterations=None):
+    """
+    Record the work done by one solver run. Call once the caller's iteration loop has finished.
+
+    :param solver: the solver instance; its class name is used as the label and n_iterations is read from it.
+        Or a name, e.g. "reference:room_temp" for an engine Result (see data/engines.py), in which case n_iterations must be given
+    :param n_steps: total number of time steps computed over all iterations
+    :param converged: False if the run hit the iteration or step limit
+    :param duration: optional wall time of the run in seconds
+    :param n_iterations: overrides solver.n_iterations
+    """
+    name = solver if isinstance(solver, str) else type(solver).__name__
+    if n_iterations is None:
+        n_iterations = solver.n_iterations
+    SOLVER_RUNS.inc(solver=name)
+    SOLVER_ITERATIONS.inc(n_iterations, solver=name)
+    SOLVER_STEPS.inc(n_steps, solver=name)
+    if not converged:
+        SOLVER_NON_CONVERGENCE.inc(solver=name)
+    if duration is not None:
+        SOLVER_SECONDS.observe(duration, solver=name)
+
+
+def record_cache(cache, hit):
+    """Record a cache lookup. :param hit: True for a hit, False for a miss"""
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def render_metrics():
+    with _lock:
+        metrics = list(_registry)
+    lines = list()
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def init_app(app):
+    """Add request timing hooks and the /metrics route to the Flask app"""
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = perf_counter()
+
+    @app.after_request
+    def record_latency(response):
+        match = _DASH_UPDATE_RE.match(request.path)
+        start = g.get("metrics_start")
+        if match is not None and start is not None:
+            page = match.group(1)
+            DASH_CALLBACK_SECONDS.observe(perf_counter() - start, page=page)
+            # the app's catch-all errorhandler returns a 200 so it flags failures in g
+            if response.status_code >= 400 or g.get("request_failed", False):
+                DASH_CALLBACK_ERRORS.inc(page=page)
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
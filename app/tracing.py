@@ -0,0 +1,115 @@
+"""Per-request latency tracing for Dash callbacks.
+
+A trace is started for each /dash/*/_dash-update-component request. Code running inside the request can open nested spans with
+    with tracing.span("iteration"):
+        ...
+and callbacks decorated with @tracing.traced get a span of their own. Whatever time remains between the callback returning and
+the response leaving Flask is recorded as "serialisation" (Dash JSON-encodes the outputs after the callback returns).
+
+Requests slower than app.config["SLOW_REQUEST_THRESHOLD_MS"] are written to the log (hence to the rotating log file).
+Outside of a traced request span() is a no-op, so solver code can be instrumented without caring who calls it.
+"""
+import logging
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter
+
+from flask import request
+
+_local = threading.local()
+
+DEFAULT_SLOW_REQUEST_THRESHOLD_MS = 1000
+
+
+class Span:
+    def __init__(self, name, start=None):
+        self.name = name
+        self.start = perf_counter() if start is None else start
+        self.end = None
+        self.children = list()
+
+    @property
+    def duration(self):
+        return (perf_counter() if self.end is None else self.end) - self.start
+
+    def finish(self, end=None):
+        self.end = perf_counter() if end is None else end
+
+    def format(self):
+        """Compact single-line rendering, e.g. callback=2.210s [solver_construction=0.004s, iteration=2.101s]"""
+        s = f"{self.name}={self.duration:.3f}s"
+        if self.children:
+            s += " [" + ", ".join(c.format() for c in self.children) + "]"
+        return s
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = list()
+    return stack
+
+
+def current_trace():
+    """The root span of the trace active on this thread, or None."""
+    stack = _stack()
+    return stack[0] if stack else None
+
+
+@contextmanager
+def span(name):
+    """Record a nested span if a trace is active on this thread, otherwise do nothing."""
+    stack = _stack()
+    if not stack:
+        yield None
+        return
+    s = Span(name)
+    stack[-1].children.append(s)
+    stack.append(s)
+    try:
+        yield s
+    finally:
+        s.finish()
+        stack.pop()
+
+
+def traced(f):
+    """Decorator for Dash callback functions: records the callback as a span named after the function."""
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        with span(f.__name__):
+            return f(*args, **kwargs)
+    return wrapper
+
+
+def init_app(app):
+    """Add hooks to the Flask app to start and end traces around Dash callback requests."""
+    app.config.setdefault("SLOW_REQUEST_THRESHOLD_MS", DEFAULT_SLOW_REQUEST_THRESHOLD_MS)
+
+    @app.before_request
+    def start_trace():
+        _local.stack = list()
+        if request.path.endswith("/_dash-update-component"):
+            _local.stack.append(Span(request.path))
+
+    @app.after_request
+    def end_trace(response):
+        root = current_trace()
+        _local.stack = list()
+        if root is None:
+            return response
+
+        now = perf_counter()
+        if root.children:
+            # time between the callback returning and the response being built is Dash serialising the outputs
+            last_end = max(c.end for c in root.children if c.end is not None)
+            root.children.append(Span("serialisation", start=last_end))
+            root.children[-1].finish(now)
+        root.finish(now)
+
+        if root.duration * 1000 >= app.config["SLOW_REQUEST_THRESHOLD_MS"]:
+            payload = request.get_json(silent=True) or dict()
+            logging.warning("Slow request {} for output {} ({:.3f}s): {}".format(
+                request.path, payload.get("output", "?"), root.duration, ", ".join(c.format() for c in root.children)))
+        return response
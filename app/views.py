@@ -7,7 +7,8 @@ top_menus = [
     {"path": "/cop_curves", "title": "COP Curves"},
     {"path": "/room_temp", "title": "Room Temp"},
     {"path": "/cycling", "title": "Cycling"},
-    {"path": "/constant", "title": "Constant LWT"}
+    {"path": "/constant", "title": "Constant LWT"},
+    {"path": "/catalogue", "title": "Past Runs"}
 ]
 
 
@@ -0,0 +1,113 @@
+"""
+Step-count benchmark for the CyclingSolver integrators across the volumiser range.
+
+With a small system fluid volume and a large emitter, the water temp responds in seconds, so explicit Euler needs many steps per minute to
+stay stable: at coarse steps the water temp overshoots and the HP is switched off after a step or two. For each fluid volume, this finds
+the coarsest steps_per_minute from which each integrator (at that and all finer resolutions) reproduces a fine explicit reference, i.e.
+on-duration and electricity per cycle within TOLERANCE, and reports the steps needed for one cycle.
+
+The off-duration is not compared: with a large emitter it is well under a minute, so is limited by the step size whatever the integrator.
+
+Run from the repository root:
+    python -m benchmarks.cycling_stiffness
+"""
+from time import perf_counter
+
+from data.solver import CyclingSolver
+
+# "Whole" building default: large emitter relative to the system volume, so a stiff water node
+BUILDING = {
+    "heat_loss_factor": 215,
+    "emitter_std_power": 15500,
+    "tmp": 250,
+    "floor_area": 80
+}
+COP_OPTION = "WM112_AMB+7"
+LWT = 40
+HP_CAPACITY = 5000
+INITIAL_TEMP = 20
+
+# system fluid volumes (litres): a few radiators on microbore up to a whole system with the largest volumiser
+FLUID_VOLUMES = [2, 4, 8, 15, 22, 35, 50, 80]
+# candidate resolutions, coarsest first
+STEPS_PER_MINUTE = [0.1, 0.2, 0.25, 0.5, 1, 2, 3, 4, 6, 10, 15, 20, 30, 60]
+REFERENCE_STEPS_PER_MINUTE = 600
+TOLERANCE = 0.02  # fractional
+
+
+def run_cycle(fluid_volume, steps_per_minute, integrator):
+    """
+    :return: (on minutes, elec used in W.h, number of steps), or None if no cycle was found
+    """
+    building_parameters = dict(BUILDING, fluid_volume=fluid_volume)
+    solver = CyclingSolver(building_parameters, COP_OPTION, lwt=LWT, hp_capacity=HP_CAPACITY, initial_temp=INITIAL_TEMP,
+                           steps_per_minute=steps_per_minute, integrator=integrator)
+    solver.max_steps = int(240 * steps_per_minute) + 1  # 4 hours is plenty for one cycle
+    solver.iterate()
+    if solver.on_duration is None or solver.off_duration is None:
+        return None
+    return solver.on_duration, sum(solver.cycle_elec_used), len(solver.times_mins)
+
+
+def coarsest_acceptable(fluid_volume, integrator, reference):
+    """
+    :return: (steps_per_minute, steps for the cycle) for the coarsest resolution at which it, and every finer one, is within TOLERANCE
+    """
+    ref_on, ref_elec, _ = reference
+    coarsest = (None, None)
+    # from fine to coarse, stopping at the first failure so lucky alignments of the switch-off with a coarse step aren't counted
+    for steps_per_minute in reversed(STEPS_PER_MINUTE):
+        result = run_cycle(fluid_volume, steps_per_minute, integrator)
+        if result is None:
+            break
+        on_duration, elec, n_steps = result
+        if abs(on_duration - ref_on) > TOLERANCE * ref_on or abs(elec - ref_elec) > TOLERANCE * ref_elec:
+            break
+        coarsest = (steps_per_minute, n_steps)
+    return coarsest
+
+
+def coarsest_stable(fluid_volume, integrator, reference):
+    """
+    :return: coarsest steps_per_minute at which the water temp doesn't overshoot and switch the HP off early (on-duration at least half the
+        reference), i.e. the stability limit rather than the accuracy limit
+    """
+    for steps_per_minute in STEPS_PER_MINUTE:
+        result = run_cycle(fluid_volume, steps_per_minute, integrator)
+        if result is not None and result[0] >= reference[0] / 2:
+            return steps_per_minute
+    return None
+
+
+def main():
+    integrators = CyclingSolver.INTEGRATORS
+    print(f"Coarsest steps/minute (and steps per cycle) within {TOLERANCE:.0%} of a {REFERENCE_STEPS_PER_MINUTE} steps/minute Euler reference")
+    print(f"{'volume (l)':>10} {'on (min)':>11} " + " ".join(f"{i:>22}" for i in integrators) + f" {'step reduction':>15}")
+    start = perf_counter()
+    stable = list()
+    for fluid_volume in FLUID_VOLUMES:
+        reference = run_cycle(fluid_volume, REFERENCE_STEPS_PER_MINUTE, "euler")
+        if reference is None:
+            print(f"{fluid_volume:>10} no reference cycle")
+            continue
+        cells = list()
+        steps = dict()
+        for integrator in integrators:
+            steps_per_minute, n_steps = coarsest_acceptable(fluid_volume, integrator, reference)
+            steps[integrator] = n_steps
+            cells.append(f"{steps_per_minute:>9} ({n_steps:>5} steps)" if n_steps else f"{'-':>22}")
+        best_implicit = min((steps[i] for i in integrators if i != "euler" and steps[i]), default=None)
+        reduction = f"x{steps['euler'] / best_implicit:.1f}" if steps["euler"] and best_implicit else "-"
+        print(f"{fluid_volume:>10} {reference[0]:>11.1f} " + " ".join(cells) + f" {reduction:>15}")
+        stable.append((fluid_volume, [coarsest_stable(fluid_volume, i, reference) for i in integrators]))
+
+    print()
+    print("Coarsest stable steps/minute (no early switch-off from water temp overshoot)")
+    print(f"{'volume (l)':>10} " + " ".join(f"{i:>15}" for i in integrators))
+    for fluid_volume, limits in stable:
+        print(f"{fluid_volume:>10} " + " ".join(f"{'-' if x is None else x:>15}" for x in limits))
+    print(f"({perf_counter() - start:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
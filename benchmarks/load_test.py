@@ -0,0 +1,341 @@
+"""
+Load test for the Flask/Dash app: simulated users replay the Dash requests a browser makes for each page, at a chosen concurrency, and
+the throughput, latency percentiles and error rates are reported, to size workers and catch throughput regressions.
+
+Each user repeatedly runs a session on one of the pages:
+- page load: GET the Dash layout, then fire the page's initial callbacks in dependency order (as the browser does), so inputs such as
+  the building parameters get the values the page would show. Dropdowns in RANDOMISED are first set to a random option
+- the page's action (ACTIONS), e.g. clicking Compute
+- for pages which solve in a background job, polling the job (as the dcc.Interval does, every --poll-interval seconds) until it is done
+Payloads are built from each page's _dash-dependencies, so they follow changes to the callbacks.
+
+By default the app is created in this process and driven through the Flask test client, with its job and catalogue databases in a
+temporary directory. With --url, a running server is driven over HTTP instead, which includes the WSGI server in the measurement.
+
+Run from the repository root:
+    python -m benchmarks.load_test --users 8 --duration 60
+    python -m benchmarks.load_test --url http://127.0.0.1:5000 --users 16 --pages room_temp cycling
+"""
+import argparse
+import json
+import random
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+import numpy as np
+
+# page name -> Dash URL_BASE_PATHNAME
+PAGES = {
+    "room_temp": "/dash/room_temp/",
+    "constant": "/dash/constant/",
+    "cycling": "/dash/cycling/",
+    "cop_curves": "/dash/cop_curves/",
+    "ambient": "/dash/ambient/",
+    "catalogue": "/dash/catalogue/"
+}
+# the user action for each page after it has loaded: the input which is changed ("id.property"), or None for view-only pages
+ACTIONS = {
+    "room_temp": "compute.n_clicks",
+    "constant": "compute.n_clicks",
+    "cycling": "compute.n_clicks",
+    "cop_curves": "show_points.value",
+    "ambient": None,
+    "catalogue": "refresh.n_clicks"
+}
+# dropdowns set to a random option before the initial callbacks, so sessions vary (and aren't all cache hits)
+RANDOMISED = ("building_model", "cop_model", "ambient_model", "target_temp_profile", "lwt")
+POLL_INPUT = "job_poll.n_intervals"
+
+
+class TestClientTransport:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, payload=None):
+        """:return: (status code, decoded JSON or None)"""
+        response = self.client.open(path, method=method, json=payload)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpTransport:
+    def __init__(self, base_url, timeout=300):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def request(self, method, path, payload=None):
+        data = None if payload is None else json.dumps(payload).encode()
+        req = urllib.request.Request(self.base_url + path, data=data, method=method, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                body = response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            return e.code, None
+        try:
+            return status, json.loads(body)
+        except ValueError:
+            return status, None
+
+
+def _layout_values(node, values, options):
+    """Collect "id.property" -> value for every component with an id in a layout tree, and the options of those with options"""
+    if isinstance(node, list):
+        for child in node:
+            _layout_values(child, values, options)
+    elif isinstance(node, dict) and "props" in node:
+        props = node["props"]
+        if "id" in props:
+            for prop, value in props.items():
+                if prop not in ("id", "children"):
+                    values[f"{props['id']}.{prop}"] = value
+            if props.get("options") is not None:
+                options[props["id"]] = props["options"]
+        _layout_values(props.get("children"), values, options)
+
+
+def _option_values(options):
+    # dropdown options may be a list of values, a list of {"label", "value"} dicts or a value -> label dict
+    if isinstance(options, dict):
+        return list(options)
+    return [o["value"] if isinstance(o, dict) else o for o in options]
+
+
+def _outputs(output):
+    """(id, property) pairs from a dependency's output string, e.g. "..a.figure...b.children@abc.." """
+    if output.startswith(".."):
+        output = output[2:-2]
+    pairs = list()
+    for item in output.split("..."):
+        component_id, _, prop = item.rpartition(".")
+        pairs.append((component_id, prop.split("@")[0]))
+    return pairs
+
+
+class Page:
+    def __init__(self, transport, name):
+        """Dash dependencies of one page, as fetched by a browser"""
+        self.name = name
+        self.base = PAGES[name]
+        status, self.dependencies = transport.request("GET", self.base + "_dash-dependencies")
+        if status != 200:
+            raise RuntimeError(f"Could not get the Dash dependencies of page {name}: HTTP {status}")
+
+    def callback_for(self, trigger):
+        """The callback with trigger ("id.property") as an input"""
+        for dependency in self.dependencies:
+            if any(f"{i['id']}.{i['property']}" == trigger for i in dependency["inputs"]):
+                return dependency
+        raise ValueError(f"No callback on page {self.name} has input {trigger}")
+
+    def initial_callbacks(self):
+        """Callbacks fired on page load, in an order such that callbacks producing an input come before those consuming it"""
+        pending = [d for d in self.dependencies if d.get("prevent_initial_call") in (False, None, "initial_duplicate")]
+        ordered = list()
+        while pending:
+            outputs_pending = {f"{i}.{p}" for d in pending for i, p in _outputs(d["output"])}
+            ready = [d for d in pending if not any(f"{i['id']}.{i['property']}" in outputs_pending - {f"{o}.{p}" for o, p in _outputs(d["output"])}
+                                                   for i in d["inputs"])]
+            ready = ready or pending[:1]  # a cycle: the browser would fire in declaration order
+            ordered += ready
+            pending = [d for d in pending if d not in ready]
+        return ordered
+
+
+def _fire(transport, page, dependency, values, trigger):
+    """
+    Fire a callback with the session's current values, and apply the response to them.
+
+    :param trigger: the changed "id.property", or None for an initial call
+    :return: (status, response dict of id -> {property: value}, or None)
+    """
+    outputs = [{"id": i, "property": p} for i, p in _outputs(dependency["output"])]
+    payload = {
+        "output": dependency["output"],
+        "outputs": outputs if dependency["output"].startswith("..") else outputs[0],
+        "inputs": [{"id": i["id"], "property": i["property"], "value": values.get(f"{i['id']}.{i['property']}")} for i in dependency["inputs"]],
+        "state": [{"id": s["id"], "property": s["property"], "value": values.get(f"{s['id']}.{s['property']}")} for s in dependency["state"]],
+        "changedPropIds": [] if trigger is None else [trigger]
+    }
+    status, body = transport.request("POST", page.base + "_dash-update-component", payload)
+    if status == 204:  # PreventUpdate
+        return status, dict()
+    if status != 200 or body is None:
+        return status, None
+    response = body.get("response", dict())
+    for component_id, props in response.items():
+        for prop, value in props.items():
+            values[f"{component_id}.{prop}"] = value
+    return status, response
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)  # step name -> seconds
+        self.errors = defaultdict(int)
+        self.sessions = defaultdict(list)  # page -> seconds for the whole session
+        self.session_errors = defaultdict(int)
+
+    def request(self, name, seconds, ok):
+        with self._lock:
+            self.latencies[name].append(seconds)
+            if not ok:
+                self.errors[name] += 1
+
+    def session(self, page, seconds, ok):
+        with self._lock:
+            self.sessions[page].append(seconds)
+            if not ok:
+                self.session_errors[page] += 1
+
+
+def run_session(transport, page, recorder, rng, poll_interval, session_timeout):
+    """One user visit to a page: load, action and (for job pages) polling to the result. :return: True if there were no errors"""
+    session_start = time.perf_counter()
+    ok = True
+
+    def timed(step, method, *args):
+        nonlocal ok
+        start = time.perf_counter()
+        status, response = method(*args)
+        step_ok = status in (200, 204) and response is not None
+        recorder.request(f"{page.name}/{step}", time.perf_counter() - start, step_ok)
+        ok = ok and step_ok
+        return response
+
+    # page load
+    layout = timed("layout", transport.request, "GET", page.base + "_dash-layout")
+    if layout is None:
+        recorder.session(page.name, time.perf_counter() - session_start, False)
+        return False
+    values, options = dict(), dict()
+    _layout_values(layout, values, options)
+    for component_id in RANDOMISED:
+        if component_id in options and f"{component_id}.value" in values:
+            choices = _option_values(options[component_id])
+            if values.get(f"{component_id}.multi"):
+                values[f"{component_id}.value"] = rng.sample(choices, rng.randint(1, min(3, len(choices))))
+            else:
+                values[f"{component_id}.value"] = rng.choice(choices)
+    for dependency in page.initial_callbacks():
+        timed("initial", _fire, transport, page, dependency, values, None)
+
+    # action
+    trigger = ACTIONS[page.name]
+    if trigger is not None:
+        if trigger.endswith(".n_clicks"):
+            values[trigger] = (values.get(trigger) or 0) + 1
+        response = timed("action", _fire, transport, page, page.callback_for(trigger), values, trigger)
+        # background job: poll until the page stops polling
+        if response is not None and response.get("job_poll", dict()).get("disabled") is False:
+            poll = page.callback_for(POLL_INPUT)
+            while time.perf_counter() - session_start < session_timeout:
+                time.sleep(poll_interval)
+                values[POLL_INPUT] = (values.get(POLL_INPUT) or 0) + 1
+                response = timed("poll", _fire, transport, page, poll, values, POLL_INPUT)
+                if response is None:
+                    break
+                if response.get("job_poll", dict()).get("disabled"):
+                    # the job ended: check it didn't fail
+                    ok = ok and "Computation failed" not in json.dumps(response.get("compute_errors", ""))
+                    break
+            else:
+                ok = False  # timed out
+
+    recorder.session(page.name, time.perf_counter() - session_start, ok)
+    return ok
+
+
+def run_load(transport_factory, pages, users=4, sessions_per_user=3, duration=None, poll_interval=0.25, session_timeout=300, seed=None):
+    """
+    Run users concurrently, each a thread running sessions back to back on pages chosen at random.
+
+    :param transport_factory: function() -> transport, called once per user
+    :param pages: page names (keys of PAGES)
+    :param sessions_per_user: sessions each user runs, unless duration is given
+    :param duration: seconds; users start new sessions until this has elapsed
+    :return: (Recorder, wall seconds)
+    """
+    recorder = Recorder()
+    page_info = {name: Page(transport_factory(), name) for name in pages}
+    deadline = None if duration is None else time.perf_counter() + duration
+
+    def user(ix):
+        transport = transport_factory()
+        rng = random.Random(None if seed is None else seed + ix)
+        n = 0
+        while (deadline is None and n < sessions_per_user) or (deadline is not None and time.perf_counter() < deadline):
+            run_session(transport, page_info[rng.choice(pages)], recorder, rng, poll_interval, session_timeout)
+            n += 1
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(ix,), daemon=True) for ix in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, time.perf_counter() - start
+
+
+def _percentiles(seconds):
+    p50, p95, p99 = np.percentile(np.array(seconds) * 1000, [50, 95, 99])
+    return f"p50 {p50:8.1f}ms  p95 {p95:8.1f}ms  p99 {p99:8.1f}ms"
+
+
+def format_report(recorder, wall_seconds, users):
+    n_requests = sum(len(v) for v in recorder.latencies.values())
+    n_errors = sum(recorder.errors.values())
+    n_sessions = sum(len(v) for v in recorder.sessions.values())
+    lines = [
+        f"{users} users, {wall_seconds:.1f}s: {n_requests} requests ({n_requests / wall_seconds:.1f}/s), {n_sessions} sessions "
+        f"({n_sessions / wall_seconds * 60:.1f}/min), request error rate {n_errors / max(n_requests, 1):.2%}",
+        "Requests:"
+    ]
+    for name in sorted(recorder.latencies):
+        seconds = recorder.latencies[name]
+        lines.append(f"\t{name:24s} n {len(seconds):6d}  errors {recorder.errors[name] / len(seconds):6.2%}  {_percentiles(seconds)}")
+    lines.append("Sessions (page load to result):")
+    for name in sorted(recorder.sessions):
+        seconds = recorder.sessions[name]
+        lines.append(f"\t{name:24s} n {len(seconds):6d}  errors {recorder.session_errors[name] / len(seconds):6.2%}  {_percentiles(seconds)}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent load test of the Dash pages")
+    parser.add_argument("--url", help="base URL of a running server. Default: create the app here and use the Flask test client")
+    parser.add_argument("--users", type=int, default=4, help="concurrent simulated users")
+    parser.add_argument("--sessions", type=int, default=3, help="sessions per user (ignored with --duration)")
+    parser.add_argument("--duration", type=float, help="run for this many seconds instead of a fixed number of sessions")
+    parser.add_argument("--pages", nargs="+", default=list(PAGES), choices=list(PAGES))
+    parser.add_argument("--poll-interval", type=float, default=0.25, help="seconds between job polls")
+    parser.add_argument("--workers", type=int, help="JOB_WORKERS for the test client app")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    if args.url:
+        def make_transport():
+            return HttpTransport(args.url)
+    else:
+        from app import create_app, jobs
+        from config import Config
+
+        tmp_dir = tempfile.mkdtemp(prefix="load_test.")
+        test_config = {k: getattr(Config, k) for k in dir(Config) if k.isupper()}
+        test_config.update(CATALOGUE_DB=f"{tmp_dir}/catalogue.sqlite", JOBS_DB=f"{tmp_dir}/jobs.sqlite")
+        if args.workers:
+            test_config["JOB_WORKERS"] = args.workers
+        flask_app = create_app(test_config)
+
+        def make_transport():
+            return TestClientTransport(flask_app)
+
+    recorder, wall_seconds = run_load(make_transport, args.pages, users=args.users, sessions_per_user=args.sessions, duration=args.duration,
+                                      poll_interval=args.poll_interval, seed=args.seed)
+    print(format_report(recorder, wall_seconds, args.users))
+    if not args.url:
+        jobs.get_queue(flask_app).shutdown()
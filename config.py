@@ -10,6 +10,15 @@ basedir = path.abspath(path.dirname(__file__))
 class Config(object):
     """Base config class"""
     CSRF_ENABLED = True
+    # Dash callback requests taking longer than this are logged with a breakdown of where the time went. See app/tracing.py
+    SLOW_REQUEST_THRESHOLD_MS = 1000
+    # worker processes for background solver jobs, and how often pages poll them. See app/jobs.py
+    JOB_WORKERS = 2
+    JOB_POLL_INTERVAL_MS = 500
+    # finished jobs are deleted from the job table this many seconds after they finish
+    JOB_RETENTION_SECONDS = 3600
+    # solver engine used by the pages for each kind of solve, see data/engines.py. Kinds not listed use the reference engine
+    SOLVER_ENGINES = {"room_temp": "reference", "constant_lwt": "reference", "cycling": "reference"}
 
 
 # various bits of reference and config data. Done as functions to allow for migration to JSON if required.
@@ -368,6 +377,22 @@ def get_cop_point_options(vs="ambient"):
     return cops
 
 
+def get_cop_family(cop_option):
+    """
+    Keys of the ambient COP options for the same heat pump (and data source) as cop_option, at all the LWTs available.
+    e.g. "WM85_LWT40" -> ["WM85_LWT35", "WM85_LWT40", "WM85_LWT45", "WM85_LWT50"]; "EDLA09_LWT45 Cert" -> the other "EDLA09_LWT* Cert" keys.
+    Options whose COP and T_amb point lists don't pair up are left out.
+    """
+    prefix, _, rest = cop_option.partition("_LWT")
+    suffix = rest.lstrip("0123456789")
+    family = list()
+    for k, v in get_cop_point_options().items():
+        k_prefix, _, k_rest = k.partition("_LWT")
+        if k_prefix == prefix and k_rest.lstrip("0123456789") == suffix and len(v["T_amb"]) == len(v["COP"]):
+            family.append(k)
+    return family
+
+
 # These are made to start and end at the same temperature when the spline is generated, so that the iterative "solver" works OK
 # => make sure that there isn't a big interval from 21 to 00
 def get_ambient_hr_options():
@@ -464,6 +489,20 @@ def get_target_temp_options():
     return tt
 
 
+def get_emitter_type_options():
+    """
+    Exponent n in the emitter power law: output = power at dT50 * (dT / 50) ^ n. See PowerLawEmitter in utilities.py
+    None means use the value fitted to the Stelrad correction factor table (1.3).
+    Used by EmitterGroup.from_spec(); the solvers model a single Radiator and do not take an emitter type.
+    """
+    emitters = {
+        "Radiator": None,
+        "Fan Coil": 1.0,  # forced convection is close to linear in dT
+        "Underfloor": 1.1
+    }
+    return emitters
+
+
 def get_tmp_options():
     """Thermal mass parameter. Units kJ.m^-2.K^-1"""
     tmp = {
@@ -0,0 +1,276 @@
+"""Calibrate building parameters (heat_loss_factor, tmp, emitter_std_power) against logged room data.
+
+The model is the single-node room of RoomTempSolver:
+    C.dT/dt = heating_on * emitter_output(T, Tw) + passive_heat - heat_loss_factor * (T - T_amb),   C = tmp * floor_area / 3.6 (W.h/K)
+with emitter_output = emitter_std_power * g(Tw - T), g being the normalised power law fit to the Stelrad correction factors (see
+utilities.PowerLawEmitter).
+
+Room temps only determine the ratios heat_loss_factor/C and emitter_std_power/C: scaling all three parameters together gives an identical
+fit. One absolute measurement is needed to fix the scale, so emitter_std_power is only fitted if the log has the heat delivered by the
+emitters (e.g. from a heat meter); otherwise it is held at the given (datasheet) value and heat_loss_factor and tmp are fitted.
+
+Fitting is by equation error rather than by simulating: the logged series is cut into windows of step_minutes, and for each window the
+measured rate of change of room temp is compared with the model rate computed from the measured temps averaged over the window.
+Every window is evaluated at once with numpy, and so is the Jacobian, which is analytic, so weeks of 1-minute data (tens of thousands of
+windows) fit in well under a second. simulate() then runs the fitted model forward over the log as a check, since a good equation-error
+fit can still drift when simulated.
+
+CSV columns (names configurable, see load_csv()):
+    time: ISO date-time, or hours from any origin
+    room_temp, outside_temp: C
+    heating_on: 1 when the emitters were heated (any non-zero number is treated as on)
+    mean_water_temp: optional, C. If absent, a fixed mean water temp must be given
+    heat_output: optional, W delivered by the emitters. Needed to fit emitter_std_power
+"""
+import argparse
+import csv
+from datetime import datetime
+
+import numpy as np
+from scipy.optimize import least_squares
+
+from data.series_cache import cached_load
+from utilities import PowerLawEmitter
+
+PARAMETERS = ("heat_loss_factor", "tmp", "emitter_std_power")
+DEFAULT_INITIAL = {"heat_loss_factor": 100, "tmp": 150, "emitter_std_power": 5000}
+
+# a window containing a time step longer than this multiple of the median step spans a gap in the log, and is not used
+GAP_FACTOR = 1.5
+
+
+def _parse_time(value):
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp() / 3600
+
+
+def load_csv(path, time_column="time", room_column="room_temp", outside_column="outside_temp", heating_column="heating_on",
+             water_column="mean_water_temp", output_column="heat_output", use_cache=True):
+    """
+    Read a logged series. The parsed arrays are cached in binary next to the CSV, see data/series_cache.py.
+
+    :param use_cache: False to always parse the CSV
+    :return: dict of numpy arrays "hours" (from the first sample), "room_temp", "outside_temp", "heating_on" (0/1) and, if the columns
+        exist, "mean_water_temp" and "heat_output". Read-only if from the cache
+    """
+    columns = {"time": time_column, "room_temp": room_column, "outside_temp": outside_column, "heating_on": heating_column,
+               "mean_water_temp": water_column, "heat_output": output_column}
+    if not use_cache:
+        return _parse_csv(path, columns)
+    return cached_load(path, lambda p: _parse_csv(p, columns), options=columns)
+
+
+def _parse_csv(path, columns):
+    time_column, room_column, outside_column, heating_column, water_column, output_column = (
+        columns[k] for k in ("time", "room_temp", "outside_temp", "heating_on", "mean_water_temp", "heat_output"))
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    if not rows:
+        raise ValueError(f"No data in {path}")
+    has_water = water_column in rows[0]
+    has_output = output_column in rows[0]
+
+    hours = np.array([_parse_time(r[time_column]) for r in rows])
+    series = {
+        "hours": hours - hours[0],
+        "room_temp": np.array([float(r[room_column]) for r in rows]),
+        "outside_temp": np.array([float(r[outside_column]) for r in rows]),
+        "heating_on": np.array([float(r[heating_column]) != 0 for r in rows], dtype=float)
+    }
+    if has_water:
+        series["mean_water_temp"] = np.array([float(r[water_column]) for r in rows])
+    if has_output:
+        series["heat_output"] = np.array([float(r[output_column]) for r in rows])
+    return series
+
+
+def _windows(series, step_minutes, mean_water_temp):
+    """
+    Cut the series into windows and reduce each to the quantities the model needs.
+
+    :return: dict of per-window arrays: "rate" (measured dT/dt, K/h), "loss_dt" (mean T - T_amb), "emit" (mean heating_on * g(Tw - T))
+        and, if the series has it, "heat_output" (mean W)
+    """
+    hours = np.asarray(series["hours"], dtype=float)
+    room = np.asarray(series["room_temp"], dtype=float)
+    dt = np.diff(hours)
+    if np.any(dt <= 0):
+        raise ValueError("Times must be strictly increasing")
+    median_dt = np.median(dt)
+    samples_per_window = max(int(round(step_minutes / 60 / median_dt)), 1)
+
+    starts = np.arange(0, len(hours) - samples_per_window, samples_per_window)
+    ends = starts + samples_per_window
+
+    # exclude windows spanning a gap in the log
+    gap = np.concatenate(([0], np.cumsum(dt > GAP_FACTOR * median_dt)))
+    keep = gap[ends] == gap[starts]
+    starts, ends = starts[keep], ends[keep]
+
+    water = series.get("mean_water_temp")
+    if water is None:
+        if mean_water_temp is None and np.any(series["heating_on"]):
+            raise ValueError("The log has no mean_water_temp column, so a fixed mean_water_temp must be given")
+        water = np.full_like(room, mean_water_temp if mean_water_temp is not None else 0.0)
+    # normalised emitter output, zero while not heating
+    emit = series["heating_on"] * PowerLawEmitter(1.0).output(room, np.asarray(water, dtype=float))
+
+    # time-weighted window means, via cumulative trapezoidal integrals
+    def window_mean(values):
+        integral = np.concatenate(([0], np.cumsum((values[1:] + values[:-1]) / 2 * dt)))
+        return (integral[ends] - integral[starts]) / (hours[ends] - hours[starts])
+
+    windows = {
+        "rate": (room[ends] - room[starts]) / (hours[ends] - hours[starts]),
+        "loss_dt": window_mean(room - series["outside_temp"]),
+        "emit": window_mean(emit)
+    }
+    if "heat_output" in series:
+        windows["heat_output"] = window_mean(np.asarray(series["heat_output"], dtype=float))
+    return windows
+
+
+def model_rate(params, loss_dt, emit, floor_area, passive_heat=0):
+    """
+    Model dT/dt (K/h) for arrays of window means.
+
+    :param params: (heat_loss_factor, tmp, emitter_std_power)
+    """
+    heat_loss_factor, tmp, emitter_std_power = params
+    heat_capacity = tmp * floor_area / 3.6  # W.h/K
+    return (emitter_std_power * emit + passive_heat - heat_loss_factor * loss_dt) / heat_capacity
+
+
+def model_jacobian(params, loss_dt, emit, floor_area, passive_heat=0):
+    """Analytic d(model_rate)/d(params) for all windows at once: array of shape (n windows, 3)"""
+    heat_loss_factor, tmp, emitter_std_power = params
+    heat_capacity = tmp * floor_area / 3.6
+    rate = model_rate(params, loss_dt, emit, floor_area, passive_heat)
+    return np.column_stack((-loss_dt / heat_capacity, -rate / tmp, emit / heat_capacity))
+
+
+def simulate(params, series, floor_area, mean_water_temp=None, passive_heat=0):
+    """
+    Run the model forward over the logged inputs from the first measured room temp, with exact steps for the (linear, with the emitter
+    frozen over the step) model between samples.
+
+    :return: array of simulated room temps at the sample times
+    """
+    heat_loss_factor, tmp, emitter_std_power = params
+    heat_capacity = tmp * floor_area / 3.6
+    hours = series["hours"]
+    water = series.get("mean_water_temp")
+    if water is None:
+        water = np.full_like(hours, mean_water_temp if mean_water_temp is not None else 0.0)
+    emitter = PowerLawEmitter(emitter_std_power)
+
+    simulated = np.empty_like(hours)
+    simulated[0] = temp = series["room_temp"][0]
+    for k in range(len(hours) - 1):
+        gain = series["heating_on"][k] * emitter.output(temp, water[k]) + passive_heat
+        equilibrium = series["outside_temp"][k] + gain / heat_loss_factor
+        temp = equilibrium + (temp - equilibrium) * np.exp(-heat_loss_factor / heat_capacity * (hours[k + 1] - hours[k]))
+        simulated[k + 1] = temp
+    return simulated
+
+
+def calibrate(series, floor_area, mean_water_temp=None, passive_heat=0, step_minutes=15, initial=None, fit=None, check_simulation=True):
+    """
+    Fit building parameters to a logged series by least squares on the window rates of change.
+
+    :param series: dict as returned by load_csv()
+    :param floor_area: m^2. tmp is per m^2, so this fixes the scale of the heat capacity
+    :param mean_water_temp: used if the series has no mean_water_temp
+    :param passive_heat: constant incidental gains (W)
+    :param step_minutes: window length. Longer windows average out sensor quantisation (rates from 0.1C steps over 1 minute are very
+        noisy) but blur the response to heating switching on and off
+    :param initial: dict of starting values, defaulting to DEFAULT_INITIAL. Also gives the fixed values of parameters not in fit
+    :param fit: which of PARAMETERS to fit. Default is all three if the series has heat_output, else heat_loss_factor and tmp (see the
+        module docstring). emitter_std_power is dropped if the heating was never on
+    :param check_simulation: also report the RMS error of simulate() with the fitted parameters
+    :return: dict with the fitted "heat_loss_factor", "tmp" and "emitter_std_power", "std_errors" (dict, for fitted parameters),
+        "rms_rate_error" (K/h), "rms_simulation_error" (K, or None), "n_windows", "success" and "message"
+    """
+    values = dict(DEFAULT_INITIAL, **(initial or dict()))
+    windows = _windows(series, step_minutes, mean_water_temp)
+    if len(windows["rate"]) < len(PARAMETERS):
+        raise ValueError("Not enough data for the fit")
+    has_output = "heat_output" in windows
+    if fit is None:
+        fit = PARAMETERS if has_output else ("heat_loss_factor", "tmp")
+    elif set(PARAMETERS) <= set(fit) and not has_output:
+        raise ValueError("All three parameters can only be fitted with a heat_output series; room temps alone only determine their ratios")
+    fit = [p for p in fit if p != "emitter_std_power" or np.any(windows["emit"] > 0)]
+    fit_ix = [PARAMETERS.index(p) for p in fit]
+    n_windows = len(windows["rate"])
+    # measured heat output residuals are converted to K/h with the initial heat capacity, to be commensurate with the rate residuals
+    output_scale = 1 / (values["tmp"] * floor_area / 3.6)
+
+    def full_params(x):
+        params = np.array([values[p] for p in PARAMETERS], dtype=float)
+        params[fit_ix] = x
+        return params
+
+    def residuals(x):
+        params = full_params(x)
+        rate_residuals = model_rate(params, windows["loss_dt"], windows["emit"], floor_area, passive_heat) - windows["rate"]
+        if not has_output:
+            return rate_residuals
+        output_residuals = (params[2] * windows["emit"] - windows["heat_output"]) * output_scale
+        return np.concatenate((rate_residuals, output_residuals))
+
+    def jacobian(x):
+        rate_jacobian = model_jacobian(full_params(x), windows["loss_dt"], windows["emit"], floor_area, passive_heat)
+        if has_output:
+            output_jacobian = np.zeros((n_windows, len(PARAMETERS)))
+            output_jacobian[:, 2] = windows["emit"] * output_scale
+            rate_jacobian = np.vstack((rate_jacobian, output_jacobian))
+        return rate_jacobian[:, fit_ix]
+
+    x0 = np.array([values[p] for p in fit], dtype=float)
+    solution = least_squares(residuals, x0, jac=jacobian, bounds=(np.full(len(fit), 1e-3), np.inf), x_scale=x0)
+
+    params = full_params(solution.x)
+    result = {p: float(v) for p, v in zip(PARAMETERS, params)}
+
+    # standard errors from the Gauss-Newton covariance estimate
+    dof = max(len(solution.fun) - len(fit), 1)
+    residual_variance = 2 * solution.cost / dof
+    try:
+        covariance = np.linalg.inv(solution.jac.T @ solution.jac) * residual_variance
+        result["std_errors"] = {p: float(np.sqrt(covariance[i, i])) if covariance[i, i] >= 0 else None for i, p in enumerate(fit)}
+    except np.linalg.LinAlgError:
+        result["std_errors"] = {p: None for p in fit}
+
+    result["rms_rate_error"] = float(np.sqrt(np.mean(solution.fun[:n_windows] ** 2)))
+    result["rms_simulation_error"] = None
+    if check_simulation:
+        simulated = simulate(params, series, floor_area, mean_water_temp=mean_water_temp, passive_heat=passive_heat)
+        result["rms_simulation_error"] = float(np.sqrt(np.mean((simulated - series["room_temp"]) ** 2)))
+    result["n_windows"] = n_windows
+    result["success"] = bool(solution.success)
+    result["message"] = solution.message
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit heat_loss_factor, tmp and emitter_std_power to logged room data")
+    parser.add_argument("csv", help="see module docstring for the columns")
+    parser.add_argument("--floor-area", type=float, required=True)
+    parser.add_argument("--mean-water-temp", type=float, help="if the log has no mean_water_temp column")
+    parser.add_argument("--passive-heat", type=float, default=0)
+    parser.add_argument("--step-minutes", type=float, default=15)
+    parser.add_argument("--emitter-std-power", type=float, default=DEFAULT_INITIAL["emitter_std_power"],
+                        help="W @ dT50. Held fixed unless the log has heat_output")
+    args = parser.parse_args()
+
+    fitted = calibrate(load_csv(args.csv), args.floor_area, mean_water_temp=args.mean_water_temp, passive_heat=args.passive_heat,
+                       step_minutes=args.step_minutes, initial={"emitter_std_power": args.emitter_std_power})
+    for p in PARAMETERS:
+        std_error = fitted["std_errors"].get(p)
+        print(f"{p}: {fitted[p]:.1f}" + (" (fixed)" if p not in fitted["std_errors"] else "" if std_error is None else f" +/- {std_error:.1f}"))
+    rms_simulation_error = "n/a" if fitted["rms_simulation_error"] is None else f"{fitted['rms_simulation_error']:.2f}K"
+    print(f"RMS rate error {fitted['rms_rate_error']:.3f}K/h, RMS simulation error {rms_simulation_error} "
+          f"over {fitted['n_windows']} windows. {fitted['message']}")
@@ -0,0 +1,165 @@
+import json
+import sqlite3
+import time
+from contextlib import closing
+
+# Columns which are broken out of the params JSON so they can be filtered on with an index. Everything else stays in the JSON.
+PARAM_COLUMNS = ("cop_option", "amb_option", "heat_loss_factor", "emitter_std_power", "tmp", "floor_area", "lwt", "steps_per_hour")
+SUMMARY_COLUMNS = ("energy_kwh", "mean_cop", "comfort_shortfall", "starts_per_hour", "n_iterations", "converged")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL NOT NULL,
+    page TEXT NOT NULL,
+    cop_option TEXT,
+    amb_option TEXT,
+    heat_loss_factor REAL,
+    emitter_std_power REAL,
+    tmp REAL,
+    floor_area REAL,
+    lwt REAL,
+    steps_per_hour REAL,
+    params TEXT NOT NULL,
+    energy_kwh REAL,
+    mean_cop REAL,
+    comfort_shortfall REAL,
+    starts_per_hour REAL,
+    n_iterations INTEGER,
+    converged INTEGER
+);
+CREATE INDEX IF NOT EXISTS ix_runs_page_created ON runs (page, created);
+CREATE INDEX IF NOT EXISTS ix_runs_page_options ON runs (page, cop_option, amb_option);
+CREATE INDEX IF NOT EXISTS ix_runs_amb_option ON runs (amb_option);
+CREATE INDEX IF NOT EXISTS ix_runs_heat_loss_factor ON runs (heat_loss_factor);
+"""
+
+# filters accepted by RunCatalogue.query(): keyword -> SQL fragment
+_FILTERS = {
+    "page": "page = ?",
+    "cop_option": "cop_option = ?",
+    "amb_option": "amb_option = ?",
+    "lwt": "lwt = ?",
+    "min_heat_loss_factor": "heat_loss_factor >= ?",
+    "max_heat_loss_factor": "heat_loss_factor <= ?",
+    "max_energy_kwh": "energy_kwh <= ?",
+    "min_mean_cop": "mean_cop >= ?",
+    "since": "created >= ?",
+}
+
+
+def summarise_room_temp(solver, converged):
+    """Summary metrics dict for a RoomTempSolver after iteration."""
+    return {
+        "energy_kwh": solver.full_day_energy,
+        "mean_cop": solver.mean_cop(),
+        "comfort_shortfall": solver.comfort_shortfall(),
+        "starts_per_hour": solver.n_starts() / 24,
+        "n_iterations": solver.n_iterations,
+        "converged": converged
+    }
+
+
+def summarise_constant_lwt(solver, converged):
+    """Summary metrics dict for a RoomTempSolver2 after iteration. Energy is heat lost (= emitted at equilibrium), not electricity"""
+    return {
+        "energy_kwh": solver.full_day_loss,
+        "mean_cop": None,
+        "comfort_shortfall": None,
+        "starts_per_hour": None,
+        "n_iterations": solver.n_iterations,
+        "converged": converged
+    }
+
+
+def summarise_cycling(solver, converged):
+    """Summary metrics dict for a CyclingSolver after iteration. Energy is for one cycle"""
+    cycle_mins = (solver.on_duration or 0) + (solver.off_duration or 0)
+    return {
+        "energy_kwh": solver.elec_used_total / 1000,
+        "mean_cop": solver.mean_cop(),
+        "comfort_shortfall": None,
+        "starts_per_hour": 60 / cycle_mins if converged and cycle_mins > 0 else None,
+        "n_iterations": solver.n_iterations,
+        "converged": converged
+    }
+
+
+class RunCatalogue:
+    def __init__(self, db_path):
+        """
+        Local SQLite catalogue of simulation runs: scenario parameters plus summary metrics, indexed on the common filter columns.
+        A connection is opened per operation so that one instance can be shared between Flask worker threads.
+
+        :param db_path: sqlite file, created (with the schema) if it doesn't exist
+        """
+        self.db_path = db_path
+        with closing(self._connect()) as conn, conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _row_to_dict(row):
+        d = dict(row)
+        d["params"] = json.loads(d["params"])
+        d["converged"] = None if d["converged"] is None else bool(d["converged"])
+        return d
+
+    def record(self, page, params, summary):
+        """
+        Add a run.
+
+        :param page: which simulation produced it, e.g. "room_temp"
+        :param params: dict of scenario parameters. Keys in PARAM_COLUMNS are also stored in indexed columns
+        :param summary: dict with (some of) the keys in SUMMARY_COLUMNS, see summarise_*()
+        :return: the new run id
+        """
+        columns = ("created", "page") + PARAM_COLUMNS + ("params",) + SUMMARY_COLUMNS
+        values = [time.time(), page] + [params.get(c) for c in PARAM_COLUMNS] + [json.dumps(params)] + [summary.get(c) for c in SUMMARY_COLUMNS]
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.execute(f"INSERT INTO runs ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", values)
+            return cursor.lastrowid
+
+    def query(self, limit=100, order_by="created", descending=True, **filters):
+        """
+        Find runs matching all of the filters, e.g. query(page="room_temp", amb_option="Winter", max_energy_kwh=10)
+
+        :param limit: max rows returned
+        :param order_by: a column name
+        :param filters: see _FILTERS for the allowed keywords
+        :return: list of dicts, one per run, with params decoded from JSON
+        """
+        unknown = set(filters) - set(_FILTERS)
+        if unknown:
+            raise ValueError(f"Unknown filters {sorted(unknown)}. Allowed: {sorted(_FILTERS)}")
+        if order_by not in ("id", "created", "page") + PARAM_COLUMNS + SUMMARY_COLUMNS:
+            raise ValueError(f"Cannot order by {order_by}")
+
+        clauses = [_FILTERS[k] for k, v in filters.items() if v is not None]
+        values = [v for v in filters.values() if v is not None]
+        sql = "SELECT * FROM runs"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += f" ORDER BY {order_by} {'DESC' if descending else 'ASC'} LIMIT ?"
+        with closing(self._connect()) as conn:
+            return [self._row_to_dict(r) for r in conn.execute(sql, values + [limit])]
+
+    def get(self, run_ids):
+        """Runs by id, in the order given. Unknown ids are skipped"""
+        run_ids = list(run_ids)
+        if not run_ids:
+            return list()
+        with closing(self._connect()) as conn:
+            rows = {r["id"]: self._row_to_dict(r) for r in conn.execute(f"SELECT * FROM runs WHERE id IN ({', '.join('?' * len(run_ids))})", run_ids)}
+        return [rows[i] for i in run_ids if i in rows]
+
+    def distinct(self, column):
+        """Distinct values of an indexed column, for filter dropdowns"""
+        if column not in ("page",) + PARAM_COLUMNS:
+            raise ValueError(f"Cannot list values of {column}")
+        with closing(self._connect()) as conn:
+            return [r[0] for r in conn.execute(f"SELECT DISTINCT {column} FROM runs WHERE {column} IS NOT NULL ORDER BY {column}")]
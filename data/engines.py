@@ -0,0 +1,454 @@
+"""
+Solver engines: a common entry point, engine.solve(config) -> Result, over the solver classes, so that callers (the Dash apps, background
+jobs, the equivalence harness) don't drive each solver's convergence loop and read its differently named attributes themselves.
+
+config is a dict with "kind" (one of KINDS) and the scenario, with the same keys as the equivalence corpus scenarios:
+- room_temp: "building", "cop_option", "amb_option", "target_temps_hourly" and optionally "passive_heat", "initial_temp" and "lwt"
+- constant_lwt: "building", "amb_option", "lwt" and optionally "initial_temp"
+- cycling: "building" (with "fluid_volume"), "cop_option", "lwt", "hp_capacity", "initial_temp" and optionally "lwt_overshoot",
+  "steps_per_minute", "integrator" and "limit_cycle" (see CyclingSolver.solve_limit_cycle())
+"building" is a building parameters dict as for RoomTempSolver, i.e. with "tmp" rather than "tmp_category".
+room_temp and constant_lwt take "steps_per_hour", or "resolutions" (and optionally "resolution_tolerance") to solve progressively:
+the solver is converged at each resolution (steps per hour, coarse to fine) in turn, each pass warm-started from the previous one's
+periodic state, so it typically needs only one or two iterations, until the day's energy changes by no more than the tolerance.
+Or they take "energy_tolerance" (kWh) to choose the resolution automatically: after two passes at AUTO_RESOLUTIONS, the time step
+error is estimated by Richardson extrapolation (see richardson_error()) and further passes are made at the coarsest resolution predicted
+to meet the tolerance, until the estimate for the last pass does. Only passes which converged are compared, and the Result is
+converged only if every pass was. cycling takes "energy_tolerance" too, choosing steps_per_minute.
+The estimate is reported in Result.energy_error.
+
+Engines are registered by name, see register() and get_engine(), so that callers can choose one per request and a faster engine can be
+added without changing them. The equivalence harness (data/equivalence.py) checks a registered engine against the reference.
+"""
+import logging
+from dataclasses import dataclass
+from types import MappingProxyType
+
+import numpy as np
+
+from config import get_ambient_hr_options
+from utilities import AmbientTemps
+from data.catalogue import SUMMARY_COLUMNS, summarise_room_temp, summarise_constant_lwt, summarise_cycling
+from data.rc_model import TwoNodeRoomTempSolver
+from data.response_kernel import get_kernel
+from data.solver import RoomTempSolver, RoomTempSolver2, CyclingSolver
+
+KINDS = ("room_temp", "constant_lwt", "cycling")
+DEFAULT_ENGINE = "reference"
+
+# convergence loop as used by the Dash apps
+MAX_ITERS = 20
+CONV_THRESHOLD = 0.05
+
+# progressive solving: steps per hour for each pass, and stop refining when the day's energy changes by no more than this (kWh).
+# At 4 steps per hour a pass takes a few ms; the change to 12 is usually within the tolerance, i.e. the result is as accurate as a
+# single solve at 12 steps per hour but the coarse result is available almost at once
+PROGRESSIVE_RESOLUTIONS = (4, 12, 48)
+RESOLUTION_TOLERANCE = 0.05
+
+# automatic resolution ("energy_tolerance"): the first two passes, and the limit, in steps per hour (steps per minute for cycling).
+# Explicit Euler is first order, i.e. the energy error is proportional to the step. Switching on/off at whole steps makes the error
+# somewhat jagged, so the resolution is chosen with a margin (AUTO_MARGIN) on the extrapolated error
+AUTO_RESOLUTIONS = (4, 8)
+MAX_STEPS_PER_HOUR = 240
+AUTO_STEPS_PER_MINUTE = (5, 10)
+MAX_STEPS_PER_MINUTE = 60
+AUTO_MARGIN = 1.25
+AUTO_CONV_FRACTION = 0.5  # convergence threshold for each pass, as a fraction of the tolerance
+ENERGY_TOLERANCE = 0.05  # kWh per day, as used by the Dash apps
+CYCLING_ENERGY_TOLERANCE = 0.001  # kWh per cycle, which is typically 0.05-0.2kWh
+
+# trajectories passed to progress() are for display only, so are thinned for very fine time steps
+MAX_TRAJECTORY_POINTS = 1440
+
+# Result fields which are per-step series, stored as read-only float arrays. NaN marks a missing value, e.g. the COP when off
+_SERIES = ("times", "room_temp", "ambient_temp", "elec_used", "heat_emitted", "cop", "heat_lost", "mean_water_temp")
+
+
+@dataclass(frozen=True, slots=True, eq=False)
+class Result:
+    """
+    Outcome of engine.solve(). Immutable: the series are read-only numpy arrays and summary a read-only mapping.
+
+    Series are per time step, for the day (room_temp, constant_lwt) or one heating cycle (cycling). Room temps are at the END of each step
+    for room_temp and constant_lwt, as RoomTempSolver.iter_room_temp, and at the start for cycling, as CyclingSolver.cycle_room_temp.
+    """
+    kind: str
+    engine: str
+    times: np.ndarray  # hours since the start of the day or cycle
+    step_hours: float  # time step duration
+    room_temp: np.ndarray
+    ambient_temp: np.ndarray
+    elec_used: np.ndarray  # W.h per step; NaN for constant_lwt, which has no heat pump model
+    heat_emitted: np.ndarray  # W.h per step
+    cop: np.ndarray  # NaN for steps with the heat pump off
+    energy_kwh: float  # the quantity converged on: electricity for room_temp and cycling, heat lost for constant_lwt
+    energy_delta: float  # change in energy_kwh over the last iteration
+    converged: bool  # for a progressive solve, every pass converged
+    n_iterations: int  # over all passes of a progressive solve; cycles simulated for cycling
+    n_steps: int  # time steps computed, over all iterations
+    summary: MappingProxyType  # as summarise_*() in data/catalogue.py, for the run catalogue
+    heat_lost: np.ndarray = None  # W.h per step. constant_lwt only
+    mean_water_temp: np.ndarray = None  # cycling only
+    on_duration: float = None  # minutes. cycling only; None if the cycle didn't end within the solver's step limit
+    off_duration: float = None
+    room_temp_delta: float = None  # |end - start| room temp over the cycle. cycling only
+    passes: tuple = ()  # (steps_per_hour, n_iterations, energy_kwh) for each pass of a progressive solve (steps_per_minute for cycling)
+    energy_error: float = None  # estimated time step error in energy_kwh (kWh), from the last two passes which converged. None if there weren't two
+    n_rhs_evaluations: int = None  # evaluations of the room temp's rate of change, over all iterations. room_temp and constant_lwt only
+
+    def __post_init__(self):
+        for name in _SERIES:
+            value = getattr(self, name)
+            if value is not None:
+                array = np.array([np.nan if v is None else v for v in value], dtype=float)
+                array.flags.writeable = False
+                object.__setattr__(self, name, array)
+        object.__setattr__(self, "summary", MappingProxyType(dict(self.summary)))
+        object.__setattr__(self, "passes", tuple(tuple(p) for p in self.passes))
+
+    @property
+    def steps_per_hour(self):
+        return int(round(1 / self.step_hours))
+
+    @property
+    def mean_cop(self):
+        """Mean COP over the steps with the heat pump on, as the Dash apps report it. None if it was never on"""
+        on = ~np.isnan(self.cop)
+        return float(np.mean(self.cop[on])) if on.any() else None
+
+    def to_dict(self):
+        """JSON-safe dict of the fields (NaN as None), plus steps_per_hour"""
+        d = dict()
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if name in _SERIES and value is not None:
+                value = [None if np.isnan(v) else float(v) for v in value]
+            elif name == "summary":
+                value = dict(value)
+            elif name == "passes":
+                value = [list(p) for p in value]
+            elif isinstance(value, (np.floating, np.integer, np.bool_)):
+                value = value.item()
+            d[name] = value
+        d["steps_per_hour"] = self.steps_per_hour
+        return d
+
+
+def richardson_error(resolution_0, energy_0, resolution_1, energy_1, order=1):
+    """
+    Estimate the time step (discretisation) error of a solve from the same solve at another resolution, assuming the error is
+    proportional to step^order, i.e. energy(n) = exact + c / n^order for n steps per unit time.
+
+    :return: (|error| of energy_1, c)
+    """
+    c = (energy_0 - energy_1) / (resolution_0 ** -order - resolution_1 ** -order)
+    return abs(c) * resolution_1 ** -order, c
+
+
+def _next_resolution(passes, tolerance, maximum):
+    """
+    :param passes: (resolution, n_iterations, energy) of the passes so far
+    :return: (time step error estimate of the last pass, or None for a single pass; the resolution for another pass, or None if the last
+        pass meets tolerance or is at maximum)
+    """
+    if len(passes) < 2 or passes[-2][0] == passes[-1][0]:  # nothing to extrapolate from, e.g. a resolution repeated in "resolutions"
+        return None, None
+    (resolution_0, _, energy_0), (resolution_1, _, energy_1) = passes[-2:]
+    error, c = richardson_error(resolution_0, energy_0, resolution_1, energy_1)
+    if tolerance is None or error <= tolerance or resolution_1 >= maximum:
+        return error, None
+    # error(n) = |c| / n, so the coarsest n meeting the tolerance is |c| / tolerance
+    return error, min(max(int(np.ceil(AUTO_MARGIN * abs(c) / tolerance)), resolution_1 + 1), maximum)
+
+
+def _no_progress(iteration, trajectory=None, partial=None, **deltas):
+    pass
+
+
+def _trajectory(solver):
+    """Room and ambient temps of the latest iteration for progress(), thinned to at most MAX_TRAJECTORY_POINTS"""
+    stride = -(-len(solver.times) // MAX_TRAJECTORY_POINTS)
+    return {
+        "times": [float(t) for t in solver.times[::stride]],
+        "room_temp": [float(t) for t in solver.iter_room_temp[::stride]],
+        "ambient_temps": [float(t) for t in solver.ambient_temps[::stride]]
+    }
+
+
+def converge(solver, energy_attr, progress=_no_progress, iteration_offset=0, threshold=CONV_THRESHOLD):
+    """
+    Iterate a solver until the change in its day's energy (attribute energy_attr, with delta in energy_attr + "_delta") is within
+    threshold, or MAX_ITERS.
+
+    :param progress: called after each iteration, see Engine.solve()
+    :param iteration_offset: progress() iteration numbers continue from this, e.g. to count across the passes of a progressive solve
+    :return: True if converged
+    """
+    delta_attr = energy_attr + "_delta"
+    while (getattr(solver, delta_attr) > threshold) and (solver.n_iterations < MAX_ITERS):
+        solver.iterate()
+        energy, delta = getattr(solver, energy_attr), getattr(solver, delta_attr)
+        # lazy %-formatting, so nothing is formatted unless DEBUG is enabled
+        logging.debug("%s iteration %d at %s steps/hour: %s=%.3f, %s=%.4f, max_t_iter_delta=%.4f, mean_t_iter_delta=%.4f", type(solver).__name__,
+                      solver.n_iterations, solver.steps_per_hour, energy_attr, energy, delta_attr, delta, solver.max_t_iter_delta,
+                      solver.mean_t_iter_delta)
+        if progress is not _no_progress:
+            progress(iteration_offset + solver.n_iterations, energy_kwh=energy, energy_delta=delta, max_t_iter_delta=solver.max_t_iter_delta,
+                     mean_t_iter_delta=solver.mean_t_iter_delta, steps_per_hour=solver.steps_per_hour, trajectory=_trajectory(solver))
+    return getattr(solver, delta_attr) <= threshold
+
+
+class Engine:
+    """
+    Base for engines. Subclasses set name and kinds and implement _solve_<kind>(config, progress) for each of their kinds.
+    """
+    name = None
+    kinds = ()
+
+    def solve(self, config, progress=None):
+        """
+        :param config: dict with "kind" and the scenario, see the module docstring
+        :param progress: optional function(iteration, trajectory=None, partial=None, **deltas), called after each solver iteration with
+            the convergence deltas ("energy_kwh", "energy_delta", ...) and a trajectory dict of the room temps, and with partial=Result
+            (and no deltas) after each pass of a progressive solve but the last. It may raise to abandon the solve, e.g. on cancellation
+        :return: Result
+        """
+        kind = config["kind"]
+        if kind not in self.kinds:
+            raise ValueError(f"Engine {self.name} can't solve {kind}. Allowed: {self.kinds}")
+        return getattr(self, f"_solve_{kind}")(config, progress or _no_progress)
+
+
+class ReferenceEngine(Engine):
+    """The solvers in data/solver.py, converged as the Dash apps always have"""
+    name = "reference"
+    kinds = KINDS
+    room_temp_solver = RoomTempSolver
+    room_temp_options = dict()  # extra constructor arguments for room_temp_solver
+    constant_lwt_options = dict()  # and for RoomTempSolver2
+
+    @staticmethod
+    def _solve_progressively(config, progress, make_solver, warm_start, energy_attr, make_result):
+        """
+        Converge at each of the config's resolutions in turn (see module docstring).
+
+        :param make_solver: function(steps_per_hour) -> solver
+        :param warm_start: function(solver, previous_solver) to start solver from the previous pass
+        :param energy_attr: name of the solver's day energy attribute, e.g. "full_day_energy"
+        :param make_result: function(solver, converged, n_iterations, n_steps, passes, energy_error, n_rhs_evaluations) -> Result for the pass
+        """
+        tolerance = config.get("resolution_tolerance", RESOLUTION_TOLERANCE)
+        energy_tolerance = config.get("energy_tolerance")
+        threshold = CONV_THRESHOLD
+        if energy_tolerance is not None:
+            resolutions = list(AUTO_RESOLUTIONS)  # extended as the error estimates require
+            # the energy is converged to well within the tolerance, so the differences between passes are time step error, not iteration noise
+            threshold = min(CONV_THRESHOLD, energy_tolerance * AUTO_CONV_FRACTION)
+        else:
+            resolutions = config.get("resolutions") or [config.get("steps_per_hour", 12)]
+        passes = list()
+        converged_passes = list()  # those which met the threshold; only these are compared, so iteration error isn't taken for time step error
+        all_converged = True
+        n_iterations = 0
+        n_steps = 0
+        n_rhs_evaluations = 0
+        solver = None
+        previous_converged = False
+        for ix, steps_per_hour in enumerate(resolutions):  # resolutions may be extended during the loop
+            previous = solver
+            solver = make_solver(steps_per_hour)
+            if previous is not None:
+                warm_start(solver, previous)
+            converged = converge(solver, energy_attr, progress, n_iterations, threshold)
+            all_converged = all_converged and converged
+            n_iterations += solver.n_iterations
+            n_steps += solver.n_iterations * len(solver.times)
+            n_rhs_evaluations += solver.n_rhs_evaluations
+            passes.append((steps_per_hour, solver.n_iterations, float(getattr(solver, energy_attr))))
+            if converged:
+                converged_passes.append(passes[-1])
+
+            energy_error, next_resolution = _next_resolution(converged_passes, energy_tolerance, MAX_STEPS_PER_HOUR)
+            if next_resolution is not None and converged:
+                resolutions.append(next_resolution)
+            elif energy_tolerance is not None and converged and len(converged_passes) == 1 and ix == len(resolutions) - 1 and \
+                    steps_per_hour < MAX_STEPS_PER_HOUR:
+                resolutions.append(min(2 * steps_per_hour, MAX_STEPS_PER_HOUR))  # an earlier pass didn't converge: one more for an estimate
+            if ix == len(resolutions) - 1 or \
+                    (energy_tolerance is None and converged and previous_converged and
+                     abs(getattr(solver, energy_attr) - getattr(previous, energy_attr)) <= tolerance):
+                break
+            previous_converged = converged
+            if progress is not _no_progress:  # a partial Result is only built for a caller who will see it
+                progress(n_iterations, partial=make_result(solver, all_converged, n_iterations, n_steps, passes, energy_error, n_rhs_evaluations))
+        return make_result(solver, all_converged, n_iterations, n_steps, passes, energy_error, n_rhs_evaluations)
+
+    def _solve_room_temp(self, config, progress):
+        def make_solver(steps_per_hour):
+            return self.room_temp_solver(config["building"], config["cop_option"], config["amb_option"], config["target_temps_hourly"],
+                                         passive_heat=config.get("passive_heat", 0), initial_temp=config.get("initial_temp", 16),
+                                         steps_per_hour=steps_per_hour, lwt=config.get("lwt"), **self.room_temp_options)
+
+        def warm_start(solver, previous):
+            solver.warm_start(previous.times, previous.iter_room_temp, heating_on=previous.heating_on, full_day_energy=previous.full_day_energy)
+
+        def make_result(solver, converged, n_iterations, n_steps, passes, energy_error, n_rhs_evaluations):
+            return Result(kind="room_temp", engine=self.name, times=solver.times, step_hours=solver.time_step_duration,
+                          room_temp=solver.iter_room_temp, ambient_temp=solver.ambient_temps, elec_used=solver.iter_elec_used,
+                          heat_emitted=[0 if c is None else e * c for e, c in zip(solver.iter_elec_used, solver.cops)], cop=solver.cops,
+                          energy_kwh=solver.full_day_energy, energy_delta=solver.full_day_energy_delta, converged=converged,
+                          n_iterations=n_iterations, n_steps=n_steps, summary=dict(summarise_room_temp(solver, converged), n_iterations=n_iterations),
+                          passes=passes, energy_error=energy_error, n_rhs_evaluations=n_rhs_evaluations)
+
+        return self._solve_progressively(config, progress, make_solver, warm_start, "full_day_energy", make_result)
+
+    def _solve_constant_lwt(self, config, progress):
+        def make_solver(steps_per_hour):
+            return RoomTempSolver2(config["building"], config["amb_option"], lwt=config["lwt"], initial_temp=config.get("initial_temp", 16),
+                                   steps_per_hour=steps_per_hour, **self.constant_lwt_options)
+
+        def warm_start(solver, previous):
+            solver.warm_start(previous.times, previous.iter_room_temp, full_day_loss=previous.full_day_loss)
+
+        def make_result(solver, converged, n_iterations, n_steps, passes, energy_error, n_rhs_evaluations):
+            n = len(solver.times)
+            return Result(kind="constant_lwt", engine=self.name, times=solver.times, step_hours=solver.time_step_duration,
+                          room_temp=solver.iter_room_temp, ambient_temp=solver.ambient_temps, elec_used=[np.nan] * n,
+                          heat_emitted=solver.energy_emitted, cop=[np.nan] * n, energy_kwh=solver.full_day_loss,
+                          energy_delta=solver.full_day_loss_delta, converged=converged, n_iterations=n_iterations, n_steps=n_steps,
+                          summary=dict(summarise_constant_lwt(solver, converged), n_iterations=n_iterations), heat_lost=solver.energy_lost,
+                          passes=passes, energy_error=energy_error, n_rhs_evaluations=n_rhs_evaluations)
+
+        return self._solve_progressively(config, progress, make_solver, warm_start, "full_day_loss", make_result)
+
+    def _solve_cycling(self, config, progress):
+        energy_tolerance = config.get("energy_tolerance")
+        resolutions = list(AUTO_STEPS_PER_MINUTE) if energy_tolerance is not None else [config.get("steps_per_minute", 5)]
+        passes = list()
+        n_iterations = 0
+        n_steps = 0
+        initial_temp = config["initial_temp"]
+        energy_error = None
+        complete = None  # (solver, converged) of the last pass which found a complete cycle
+        for steps_per_minute in resolutions:
+            solver = CyclingSolver(config["building"], config["cop_option"], lwt=config["lwt"], hp_capacity=config["hp_capacity"],
+                                   initial_temp=initial_temp, lwt_overshoot=config.get("lwt_overshoot", 4), steps_per_minute=steps_per_minute,
+                                   integrator=config.get("integrator", "euler"))
+            if config.get("limit_cycle"):
+                converged = solver.solve_limit_cycle()
+                initial_temp = solver.cycle_start_room_temp  # start the next pass's search from this pass's limit cycle
+            else:
+                solver.iterate()
+                converged = solver.off_duration is not None  # i.e. a complete cycle was found
+            n_iterations += solver.n_iterations
+            n_steps += solver.n_iterations * solver.n_steps
+            progress(n_iterations, energy_kwh=solver.elec_used_total / 1000, energy_delta=0.0, max_t_iter_delta=solver.iter_room_temp_delta,
+                     mean_t_iter_delta=solver.iter_room_temp_delta)
+            if solver.off_duration is None:  # no complete cycle, so nothing to compare between resolutions
+                if complete is not None:
+                    solver, converged = complete  # the finer steps took the cycle beyond the solver's step limit
+                break
+            complete = (solver, converged)
+            passes.append((steps_per_minute, solver.n_iterations, solver.elec_used_total / 1000))
+            # finer steps mustn't take the cycle beyond the solver's step limit
+            cycle_mins = solver.on_duration + solver.off_duration
+            maximum = max(min(MAX_STEPS_PER_MINUTE, int(solver.max_steps / (1.2 * cycle_mins))), steps_per_minute)
+            energy_error, next_resolution = _next_resolution(passes, energy_tolerance, maximum)
+            if next_resolution is not None:
+                resolutions.append(next_resolution)
+
+        step_hours = solver.time_step_secs / 3600
+        cycle_found = solver.on_duration is not None and solver.off_duration is not None
+        return Result(kind="cycling", engine=self.name, times=[t / 60 for t in solver.times_mins], step_hours=step_hours,
+                      room_temp=solver.cycle_room_temp, ambient_temp=[solver.ambient_temp] * len(solver.times_mins),
+                      elec_used=solver.cycle_elec_used, heat_emitted=[p * step_hours for p in solver.cycle_emitter_output], cop=solver.cycle_cop,
+                      energy_kwh=solver.elec_used_total / 1000, energy_delta=0.0, converged=converged, n_iterations=n_iterations,
+                      n_steps=n_steps, summary=summarise_cycling(solver, cycle_found), mean_water_temp=solver.mean_water_temp,
+                      on_duration=solver.on_duration, off_duration=solver.off_duration, room_temp_delta=solver.iter_room_temp_delta,
+                      passes=passes, energy_error=energy_error)
+
+
+class TwoNodeEngine(ReferenceEngine):
+    """room_temp with TwoNodeRoomTempSolver (data/rc_model.py): separate air and fabric nodes, stepped exactly"""
+    name = "two_node"
+    kinds = ("room_temp",)
+    room_temp_solver = TwoNodeRoomTempSolver
+
+
+class EventEngine(ReferenceEngine):
+    """room_temp with thermostat switching located within time steps (RoomTempSolver event_location), so coarse steps are as good as fine"""
+    name = "event"
+    kinds = ("room_temp",)
+    room_temp_options = {"event_location": True}
+
+
+class AdaptiveEngine(ReferenceEngine):
+    """
+    room_temp and constant_lwt integrated with adaptive steps and error control (integrator="rk45" in data/solver.py): long steps where
+    little changes and short ones at switching, for far fewer rate evaluations than explicit Euler at the same accuracy. For room_temp the
+    cost is about 7 evaluations per thermostat switch, so it is no cheaper than the reference at its coarsest resolutions, i.e. the gain
+    is accuracy rather than speed. Checked with ENGINE_TOLERANCES in data/equivalence.py
+    """
+    name = "rk45"
+    kinds = ("room_temp", "constant_lwt")
+    room_temp_options = {"integrator": "rk45"}
+    constant_lwt_options = {"integrator": "rk45"}
+
+
+class KernelEngine(Engine):
+    """
+    constant_lwt by convolving the day's ambient temps with the building's impulse response (data/response_kernel.py): the periodic day
+    directly, with no iteration. The emitter is linearised at the steady state for the day's mean ambient temp
+    """
+    name = "kernel"
+    kinds = ("constant_lwt",)
+
+    def _solve_constant_lwt(self, config, progress):
+        # a single pass, at the finest resolution asked for
+        steps_per_hour = config["resolutions"][-1] if config.get("resolutions") else config.get("steps_per_hour", 12)
+        times = np.arange(0, 24, 1 / steps_per_hour)
+        ambient = AmbientTemps(get_ambient_hr_options()[config["amb_option"]]).temps(times)
+        kernel = get_kernel(config["building"], config["lwt"], steps_per_hour=steps_per_hour, operating_ambient=float(ambient.mean()))
+        room_temp = kernel.predict_periodic(ambient)
+
+        # energies as RoomTempSolver2 computes them, from the temp at the start of each step
+        start_temps = np.roll(room_temp, 1)
+        heat_lost = kernel.heat_loss_factor * (start_temps - ambient) * kernel.time_step_duration
+        heat_emitted = kernel.emitted(start_temps) * kernel.time_step_duration
+        energy_kwh = float(heat_lost.sum()) / 1000
+        progress(1, energy_kwh=energy_kwh, energy_delta=0.0, max_t_iter_delta=0.0, mean_t_iter_delta=0.0, steps_per_hour=steps_per_hour)
+
+        summary = dict.fromkeys(SUMMARY_COLUMNS)
+        summary.update(energy_kwh=energy_kwh, n_iterations=1, converged=True)
+        n = len(times)
+        return Result(kind="constant_lwt", engine=self.name, times=times, step_hours=kernel.time_step_duration, room_temp=room_temp,
+                      ambient_temp=ambient, elec_used=[np.nan] * n, heat_emitted=heat_emitted, cop=[np.nan] * n, energy_kwh=energy_kwh,
+                      energy_delta=0.0, converged=True, n_iterations=1, n_steps=n, summary=summary, heat_lost=heat_lost)
+
+
+ENGINES = dict()  # name -> engine instance
+
+
+def register(engine):
+    """Make an engine instance available to get_engine() under engine.name. Returns it, so can be used as engine = register(MyEngine())"""
+    ENGINES[engine.name] = engine
+    return engine
+
+
+def get_engine(name=DEFAULT_ENGINE):
+    if name not in ENGINES:
+        raise ValueError(f"Unknown solver engine {name}. Allowed: {sorted(ENGINES)}")
+    return ENGINES[name]
+
+
+def solve(config, engine=DEFAULT_ENGINE, progress=None):
+    """Solve with a registered engine. See Engine.solve()"""
+    return get_engine(engine).solve(config, progress)
+
+
+register(ReferenceEngine())
+register(TwoNodeEngine())
+register(EventEngine())
+register(AdaptiveEngine())
+register(KernelEngine())
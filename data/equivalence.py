@@ -0,0 +1,347 @@
+"""
+Equivalence harness: checks that an alternative (faster) solver engine reproduces the reference solvers in data/solver.py.
+
+A golden corpus of reference results is generated across the config options and several resolutions and saved as one compressed .npz
+per solver kind. An engine is then run over the same scenarios and each metric compared against the corpus with an explicit tolerance.
+
+The engines checked are those registered in data/engines.py, e.g. "two_node"; see registered_engine(). Internally an engine is any
+callable engine(kind, scenario) -> dict of metrics, where kind is one of KINDS and scenario is the dict stored in the corpus, so ad hoc
+functions can be checked too. The returned dict must have (at least) the keys in METRIC_TOLERANCES[kind]; see result_metrics() for the
+meaning of each. A registered engine whose differences from the reference are by design (more accurate switching) is checked with its
+ENGINE_TOLERANCES.
+
+Usage:
+    python -m data.equivalence generate [--out data/golden]
+    python -m data.equivalence check engine_name|package.module:engine_function [--corpus data/golden] [--retime-reference]
+"""
+import argparse
+import importlib
+import json
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+
+from config import get_building_default_options, get_tmp_options, get_cop_point_options, get_ambient_hr_options, get_target_temp_options
+from data.engines import KINDS, get_engine
+
+DEFAULT_CORPUS_DIR = os.path.join(os.path.dirname(__file__), "golden")
+
+# per-metric tolerances: (absolute, relative). A metric passes if |engine - reference| <= absolute + relative * |reference|
+# For per-step series the maximum deviation over the series is tested, after resampling the engine series onto the reference times.
+METRIC_TOLERANCES = {
+    "room_temp": {
+        "energy_kwh": (0.05, 0.01),
+        "mean_cop": (0.02, 0.0),
+        "room_temp": (0.25, 0.0),
+    },
+    "constant_lwt": {
+        "loss_kwh": (0.05, 0.01),
+        "room_temp": (0.1, 0.0),
+    },
+    "cycling": {
+        "on_duration": (0.5, 0.02),
+        "off_duration": (0.5, 0.02),
+        "energy_kwh": (0.0, 0.02),
+        "room_temp_delta": (0.01, 0.05),
+        "mean_water_temp": (0.25, 0.0),
+    }
+}
+SERIES_METRICS = ("room_temp", "mean_water_temp")
+
+# overrides of METRIC_TOLERANCES for registered engines which locate thermostat switching within a step (see data/engines.py), which the
+# reference does only at the start of the next step. The reference's switching lags by up to a step, so its on/off cycles drift out of
+# phase with the engine's: room temps then differ by up to the hysteresis band (0.5K) plus the reference's overshoot, and at its coarsest
+# resolution (6 steps per hour) its energy and mean COP by its own step error, up to about 2% and 0.03. The corpus measures that
+# difference, so these bound it rather than the engines' accuracy
+ENGINE_TOLERANCES = {
+    "event": {
+        "room_temp": {
+            "energy_kwh": (0.05, 0.025),
+            "mean_cop": (0.04, 0.0),
+            "room_temp": (0.75, 0.0),
+        }
+    }
+}
+ENGINE_TOLERANCES["rk45"] = ENGINE_TOLERANCES["event"]
+
+# with --retime-reference the check fails if the reference engine is slower than the corpus's reference times by more than this factor,
+# after scaling them to this machine (see machine_seconds())
+REFERENCE_SLOWDOWN_TOLERANCE = 1.4
+
+
+def _building(name="Kitchen FC"):
+    b = dict(get_building_default_options()[name])
+    b["tmp"] = get_tmp_options()[b.pop("tmp_category")]
+    return b
+
+
+def _valid_cop_options(vs):
+    # an option whose point lists don't pair up can't be made into a spline by any engine
+    return [k for k, v in get_cop_point_options(vs).items() if len(v["T_amb" if vs == "ambient" else "LWT"]) == len(v["COP"])]
+
+
+def default_scenarios():
+    """
+    Scenarios for the corpus: every COP option, ambient option and target profile (varied one at a time from a default) at several resolutions.
+
+    :return: dict of kind -> list of scenario dicts
+    """
+    building = _building()
+    ambient_options = list(get_ambient_hr_options())
+    target_options = get_target_temp_options()
+
+    room_temp = list()
+    for steps_per_hour in (6, 12, 30):
+        combos = [(c, "Winter", "Moderate Burst") for c in _valid_cop_options("ambient")]
+        combos += [("WM85_LWT35", a, "Moderate Burst") for a in ambient_options if a != "Winter"]
+        combos += [("WM85_LWT35", "Winter", t) for t in target_options if t != "Moderate Burst"]
+        room_temp += [{"building": building, "cop_option": c, "amb_option": a, "target_temps_hourly": list(target_options[t]), "steps_per_hour": steps_per_hour}
+                      for c, a, t in combos]
+
+    constant_lwt = [{"building": building, "amb_option": a, "lwt": lwt, "steps_per_hour": steps_per_hour}
+                    for steps_per_hour in (6, 12, 30) for a in ambient_options for lwt in (30, 40, 50)]
+
+    cycling = list()
+    for steps_per_minute in (5, 10, 20):
+        for cop_option in _valid_cop_options("lwt"):
+            capacity = get_cop_point_options("lwt")[cop_option]["capacity"]
+            for fluid_volume in (22, 57):  # without and with a 35l volumiser
+                cycling.append({"building": dict(building, fluid_volume=fluid_volume), "cop_option": cop_option, "lwt": 35, "lwt_overshoot": 4,
+                                "hp_capacity": capacity, "initial_temp": 18, "steps_per_minute": steps_per_minute})
+
+    return {"room_temp": room_temp, "constant_lwt": constant_lwt, "cycling": cycling}
+
+
+def result_metrics(result):
+    """
+    Metrics compared by the harness, from an engine Result.
+
+    :return: dict of metrics. Series are numpy arrays; "times" is hours (room_temp, constant_lwt) or minutes (cycling) for the series
+    """
+    if result.kind == "room_temp":
+        return {
+            "times": np.array(result.times),
+            "energy_kwh": result.energy_kwh,
+            "mean_cop": 0.0 if result.mean_cop is None else result.mean_cop,
+            "room_temp": np.array(result.room_temp),
+            "n_iterations": result.n_iterations
+        }
+    if result.kind == "constant_lwt":
+        return {
+            "times": np.array(result.times),
+            "loss_kwh": result.energy_kwh,
+            "room_temp": np.array(result.room_temp),
+            "n_iterations": result.n_iterations
+        }
+    if result.kind == "cycling":
+        return {
+            "times": np.array(result.times) * 60,
+            "on_duration": np.nan if result.on_duration is None else result.on_duration,
+            "off_duration": np.nan if result.off_duration is None else result.off_duration,
+            "energy_kwh": result.energy_kwh,
+            "room_temp_delta": result.room_temp_delta,
+            "mean_water_temp": np.array(result.mean_water_temp),
+            "n_iterations": result.n_iterations
+        }
+    raise ValueError(f"Unknown kind {result.kind}")
+
+
+def registered_engine(name):
+    """:return: callable(kind, scenario) -> dict of metrics, running the engine registered as name in data/engines.py"""
+    engine = get_engine(name)
+
+    def run(kind, scenario):
+        return result_metrics(engine.solve(dict(scenario, kind=kind)))
+    return run
+
+
+def reference_engine(kind, scenario):
+    """The reference solvers from data/solver.py, converged as the Dash apps do. Generates the corpus"""
+    return registered_engine("reference")(kind, scenario)
+
+
+def machine_seconds(repeats=5):
+    """
+    Best-of-repeats time of a fixed pure Python float loop, like the solvers' inner loops. Stored with the corpus, so that its reference
+    times can be scaled to the machine (and load) of a later check.
+    """
+    best = np.inf
+    for _ in range(repeats):
+        start = perf_counter()
+        t = 16.0
+        for _ in range(1000000):
+            t += (0.5 * (20.0 - t) - 0.01 * (t - 5.0)) * 0.001
+        best = min(best, perf_counter() - start)
+    return best
+
+
+def generate_corpus(out_dir=DEFAULT_CORPUS_DIR, scenarios=None):
+    """
+    Run the reference engine over the scenarios and write <out_dir>/<kind>.npz for each kind.
+    Each file holds the scenarios (as JSON), the reference wall time per scenario, machine_seconds() at the time, and arrays named
+    "<scenario index>/<metric>".
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    scenarios = default_scenarios() if scenarios is None else scenarios
+    for kind, kind_scenarios in scenarios.items():
+        arrays = dict()
+        timings = list()
+        machine = machine_seconds()
+        for ix, scenario in enumerate(kind_scenarios):
+            start = perf_counter()
+            result = reference_engine(kind, scenario)
+            timings.append(perf_counter() - start)
+            for metric, value in result.items():
+                arrays[f"{ix}/{metric}"] = np.asarray(value)
+        np.savez_compressed(os.path.join(out_dir, f"{kind}.npz"), scenarios=np.array(json.dumps(kind_scenarios)), reference_seconds=np.array(timings),
+                            machine_seconds=np.array(min(machine, machine_seconds())), **arrays)
+        print(f"{kind}: {len(kind_scenarios)} scenarios, reference time {sum(timings):.1f}s")
+
+
+def load_corpus(kind, corpus_dir=DEFAULT_CORPUS_DIR):
+    """
+    :return: (list of scenarios, list of reference result dicts, array of reference seconds per scenario, machine_seconds() when the
+        corpus was generated or None for a corpus from before it was recorded)
+    """
+    with np.load(os.path.join(corpus_dir, f"{kind}.npz")) as npz:
+        machine = float(npz["machine_seconds"]) if "machine_seconds" in npz.files else None
+        scenarios = json.loads(str(npz["scenarios"]))
+        results = [dict() for _ in scenarios]
+        for name in npz.files:
+            if "/" in name:
+                ix, metric = name.split("/", 1)
+                value = npz[name]
+                results[int(ix)][metric] = value if value.ndim else value.item()
+        return scenarios, results, npz["reference_seconds"], machine
+
+
+def metric_tolerances(kind, engine_name=None):
+    """:return: dict of metric -> (absolute, relative) tolerance: METRIC_TOLERANCES[kind] with any ENGINE_TOLERANCES for the engine"""
+    return dict(METRIC_TOLERANCES[kind], **ENGINE_TOLERANCES.get(engine_name, dict()).get(kind, dict()))
+
+
+def compare_metric(kind, metric, reference, candidate, ref_times=None, candidate_times=None, tolerance=None):
+    """
+    :param tolerance: (absolute, relative). Default is METRIC_TOLERANCES[kind][metric]
+    :return: (deviation, passed). Series are compared by max absolute deviation after resampling the candidate onto the reference times.
+    """
+    abs_tol, rel_tol = METRIC_TOLERANCES[kind][metric] if tolerance is None else tolerance
+    if metric in SERIES_METRICS:
+        reference = np.asarray(reference, dtype=float)
+        candidate = np.asarray(candidate, dtype=float)
+        if candidate_times is not None and ref_times is not None and (len(candidate) != len(reference) or not np.allclose(candidate_times, ref_times)):
+            candidate = np.interp(ref_times, candidate_times, candidate)
+        if len(candidate) != len(reference):
+            return np.inf, False
+        deviation = float(np.max(np.abs(candidate - reference))) if len(reference) else 0.0
+        return deviation, deviation <= abs_tol + rel_tol * float(np.max(np.abs(reference), initial=0))
+    if np.isnan(reference) and np.isnan(candidate):  # e.g. no cycle found by either
+        return 0.0, True
+    deviation = abs(float(candidate) - float(reference))
+    return deviation, deviation <= abs_tol + rel_tol * abs(float(reference))
+
+
+def check_engine(engine, corpus_dir=DEFAULT_CORPUS_DIR, kinds=KINDS, retime_reference=False, engine_name=None):
+    """
+    Run an engine over the corpus and compare it with the reference results.
+
+    :param engine: callable(kind, scenario) -> dict of metrics
+    :param engine_name: name of the registered engine, for its ENGINE_TOLERANCES if any
+    :param kinds: which solver kinds to check. Kinds the engine doesn't support should be left out
+    :param retime_reference: re-run the reference engine for timing rather than using the times stored with the corpus (which came from
+        whichever machine generated it). The re-timed reference is also checked against the stored times, scaled to this machine: a
+        slowdown beyond REFERENCE_SLOWDOWN_TOLERANCE is a failure, with metric "reference_seconds" and the slowdown as the deviation
+    :return: dict of kind -> report dict with "failures" (list of (scenario index, metric, deviation); index None for the timing check),
+        "max_deviation" and "tolerances" per metric, "engine_seconds", "reference_seconds", "speed_up" and "reference_slowdown" (None unless re-timed
+        against a corpus with machine_seconds)
+    """
+    machine = machine_seconds() if retime_reference else None
+    reports = dict()
+    for kind in kinds:
+        scenarios, references, reference_seconds, corpus_machine = load_corpus(kind, corpus_dir)
+        failures = list()
+        tolerances = metric_tolerances(kind, engine_name)
+        max_deviation = {m: 0.0 for m in tolerances}
+        engine_seconds = 0.0
+        ref_seconds = 0.0 if retime_reference else float(np.sum(reference_seconds))
+        for ix, (scenario, reference) in enumerate(zip(scenarios, references)):
+            start = perf_counter()
+            candidate = engine(kind, scenario)
+            engine_seconds += perf_counter() - start
+            if retime_reference:
+                start = perf_counter()
+                reference_engine(kind, scenario)
+                ref_seconds += perf_counter() - start
+            for metric, tolerance in tolerances.items():
+                deviation, passed = compare_metric(kind, metric, reference[metric], candidate[metric], reference.get("times"), candidate.get("times"),
+                                                   tolerance)
+                max_deviation[metric] = max(max_deviation[metric], deviation)
+                if not passed:
+                    failures.append((ix, metric, deviation))
+        reference_slowdown = None
+        if retime_reference and corpus_machine is not None:
+            machine = min(machine, machine_seconds())  # again, as the machine's load may have changed during the kind's runs
+            reference_slowdown = ref_seconds / (float(np.sum(reference_seconds)) * machine / corpus_machine)
+            if reference_slowdown > REFERENCE_SLOWDOWN_TOLERANCE:
+                failures.append((None, "reference_seconds", reference_slowdown))
+        reports[kind] = {
+            "n_scenarios": len(scenarios),
+            "failures": failures,
+            "max_deviation": max_deviation,
+            "tolerances": tolerances,
+            "engine_seconds": engine_seconds,
+            "reference_seconds": ref_seconds,
+            "speed_up": ref_seconds / engine_seconds if engine_seconds > 0 else np.inf,
+            "reference_slowdown": reference_slowdown
+        }
+    return reports
+
+
+def format_report(reports):
+    lines = list()
+    for kind, report in reports.items():
+        status = "PASS" if not report["failures"] else f"FAIL ({len(report['failures'])} metric failures)"
+        lines.append(f"{kind}: {status} over {report['n_scenarios']} scenarios; speed-up x{report['speed_up']:.2f} "
+                     f"({report['reference_seconds']:.2f}s reference vs {report['engine_seconds']:.2f}s engine)")
+        if report["reference_slowdown"] is not None:
+            lines.append(f"\treference time: x{report['reference_slowdown']:.2f} the corpus's, scaled to this machine "
+                         f"(tolerance x{REFERENCE_SLOWDOWN_TOLERANCE})")
+        for metric, deviation in report["max_deviation"].items():
+            abs_tol, rel_tol = report["tolerances"][metric]
+            lines.append(f"\t{metric}: max deviation {deviation:.4g} (tolerance {abs_tol} + {rel_tol} x reference)")
+        for ix, metric, deviation in report["failures"][:10]:
+            lines.append(f"\t\t{metric}: x{deviation:.2f} slower" if ix is None else f"\t\tscenario {ix} {metric}: {deviation:.4g}")
+    return "\n".join(lines)
+
+
+def _load_engine(spec):
+    """:param spec: name of a registered engine, or module:function"""
+    if ":" not in spec:
+        return registered_engine(spec)
+    module_name, _, function_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the golden corpus or check an engine against it")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    generate_parser = subparsers.add_parser("generate")
+    generate_parser.add_argument("--out", default=DEFAULT_CORPUS_DIR)
+    check_parser = subparsers.add_parser("check")
+    check_parser.add_argument("engine", help="registered engine name, e.g. two_node, or module:function")
+    check_parser.add_argument("--corpus", default=DEFAULT_CORPUS_DIR)
+    check_parser.add_argument("--kinds", nargs="+", default=None, choices=KINDS, help="default: all the engine's kinds")
+    check_parser.add_argument("--retime-reference", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        generate_corpus(args.out)
+    else:
+        kinds = args.kinds or (get_engine(args.engine).kinds if ":" not in args.engine else KINDS)
+        reports = check_engine(_load_engine(args.engine), args.corpus, kinds, args.retime_reference,
+                               engine_name=args.engine if ":" not in args.engine else None)
+        print(format_report(reports))
+        if any(report["failures"] for report in reports.values()):
+            sys.exit(1)
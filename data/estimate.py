@@ -0,0 +1,45 @@
+from functools import lru_cache
+
+import numpy as np
+
+from config import get_cop_point_options, get_ambient_hr_options
+from utilities import COP, AmbientTemps
+
+
+@lru_cache(maxsize=64)
+def _ambient_model(amb_option):
+    return AmbientTemps(get_ambient_hr_options()[amb_option])
+
+
+@lru_cache(maxsize=64)
+def _cop_model(cop_option):
+    cop_defn = get_cop_point_options()[cop_option]
+    return COP(cop_defn["T_amb"], cop_defn["COP"])
+
+
+def degree_day_estimate(building_parameters, cop_option, amb_option, target_temps_hourly, passive_heat=0, steps_per_hour=12):
+    """
+    Instant steady-state estimate of a day's energy, for display while RoomTempSolver runs.
+
+    Each time step's heat demand is heat_loss_factor * (target - ambient) - passive_heat (or zero), i.e. the room is assumed to be at its
+    target throughout. Electricity is demand / COP at the step's ambient temp.
+    Thermal mass, thermostat hysteresis and emitter capacity are ignored. For a constant target it is typically within a few % of the
+    solver; with setbacks the heat lost while cooling and the reheat (often at colder, lower COP times) shift the result by 5-15%.
+
+    Parameters are as for RoomTempSolver.
+    :return: dict with "energy_kwh" (electricity), "heat_kwh" and "mean_cop" (heat / electricity, None if there is no demand)
+    """
+    hours = np.arange(24 * steps_per_hour) / steps_per_hour
+    ambient = _ambient_model(amb_option).temps(hours)
+    targets = np.repeat(np.asarray(target_temps_hourly, dtype=float), steps_per_hour)
+
+    demand = np.maximum(building_parameters["heat_loss_factor"] * (targets - ambient) - passive_heat, 0)  # W
+    elec = demand / _cop_model(cop_option).cops(ambient)
+
+    heat_kwh = float(demand.sum()) / steps_per_hour / 1000
+    energy_kwh = float(elec.sum()) / steps_per_hour / 1000
+    return {
+        "energy_kwh": energy_kwh,
+        "heat_kwh": heat_kwh,
+        "mean_cop": heat_kwh / energy_kwh if energy_kwh > 0 else None
+    }
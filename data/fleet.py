@@ -0,0 +1,201 @@
+"""
+Fleet Solver: a building stock run through the Room Temp Solver physics as one vectorised ensemble, for aggregated grid-demand profiles.
+
+Usage:
+    python -m data.fleet --homes 1000 --amb-option Winter [--seed 1] [--steps-per-hour 6] [--cop-options ...] [--targets ...]
+"""
+import argparse
+
+import numpy as np
+from scipy.interpolate import CubicSpline
+
+from utilities import Radiator, COP, AmbientTemps
+from config import get_building_default_options, get_cop_point_options, get_ambient_hr_options, get_target_temp_options, get_tmp_options
+from data.engines import CONV_THRESHOLD, MAX_ITERS
+
+
+def sample_homes(n, seed=None, building_options=None, cop_options=None, target_temp_options=None, spread=0.15):
+    """
+    Draw a building stock by perturbing the default building models. Each home gets its own heat loss factor, emitter power, floor area,
+    thermal mass category, COP option and target temperature schedule.
+
+    :param n: number of homes
+    :param seed: for the numpy random Generator, for repeatable fleets
+    :param building_options: keys into get_building_default_options() to draw base buildings from. Default is all.
+    :param cop_options: keys into get_cop_point_options() to draw from. Default is all the heat pump (not "Direct") options
+    :param target_temp_options: keys into get_target_temp_options() to draw from. Default is all.
+    :param spread: relative standard deviation of the (log-normal) multipliers applied to heat loss factor, emitter power and floor area
+    :return: list of dicts suitable for FleetSolver
+    """
+    rng = np.random.default_rng(seed)
+    buildings = get_building_default_options()
+    tmp_values = get_tmp_options()
+    targets = get_target_temp_options()
+    building_options = list(buildings) if building_options is None else list(building_options)
+    if cop_options is None:
+        # skip any option whose point lists don't pair up, as a spline can't be built from it
+        cop_options = [k for k, v in get_cop_point_options().items() if not k.startswith("Direct") and len(v["T_amb"]) == len(v["COP"])]
+    target_temp_options = list(targets) if target_temp_options is None else list(target_temp_options)
+    tmp_categories = list(tmp_values)
+
+    homes = list()
+    for _ in range(n):
+        base = buildings[building_options[rng.integers(len(building_options))]]
+        multipliers = rng.lognormal(0, spread, 3)
+        # mostly the building's own thermal mass category, sometimes a neighbouring one
+        tmp_ix = int(np.clip(tmp_categories.index(base["tmp_category"]) + rng.choice([-1, 0, 0, 1]), 0, len(tmp_categories) - 1))
+        homes.append({
+            "heat_loss_factor": base["heat_loss_factor"] * multipliers[0],
+            "emitter_std_power": base["emitter_std_power"] * multipliers[1],
+            "floor_area": base["floor_area"] * multipliers[2],
+            "tmp": tmp_values[tmp_categories[tmp_ix]],
+            "cop_option": cop_options[rng.integers(len(cop_options))],
+            "target_temps_hourly": list(targets[target_temp_options[rng.integers(len(target_temp_options))]])
+        })
+    return homes
+
+
+class FleetSolver:
+    def __init__(self, homes, amb_option, passive_heat=0, initial_temp=16, steps_per_hour=6, percentiles=(5, 25, 50, 75, 95)):
+        """
+        Runs many homes as a vectorised ensemble through the same physics as RoomTempSolver (explicit Euler steps, thermostat with hysteresis,
+        emitter at the cop option's mean water temp) against a shared ambient temperature profile.
+
+        Only per-home state (room temp, heating on/off, energy accumulator) is held for each home. Electricity use is aggregated across the fleet
+        at each step as it is computed, so memory is O(homes + steps), not O(homes x steps).
+
+        :param homes: list of dicts, one per home, each with keys heat_loss_factor, emitter_std_power, tmp, floor_area, cop_option
+            (key into get_cop_point_options()) and target_temps_hourly (list of 24 target temps). See sample_homes()
+        :param amb_option: key into return from get_ambient_hr_options()
+        :param passive_heat: passive heating (people, computers, etc) in W, for every home
+        :param initial_temp: starting temp for every home
+        :param steps_per_hour: number of steps per hour in the solver and for the fleet_* variables.
+        :param percentiles: percentiles of per-home electrical demand to record at each step
+        """
+        if len(homes) == 0:
+            raise ValueError("A fleet needs at least one home")
+        cop_defns = get_cop_point_options()
+        amb_defn = get_ambient_hr_options()[amb_option]
+        n_homes = len(homes)
+
+        # building setup, as arrays over homes
+        self.n_homes = n_homes
+        self.heat_loss_factor = np.array([h["heat_loss_factor"] for h in homes], dtype=float)
+        self.emitter_std_power = np.array([h["emitter_std_power"] for h in homes], dtype=float)
+        self.heat_capacity = np.array([h["tmp"] * h["floor_area"] / 3.6 for h in homes], dtype=float)  # Watt.hours per Kelvin
+        self.mean_water_temp = np.array([cop_defns[h["cop_option"]]["LWT"] - cop_defns[h["cop_option"]]["dT"] / 2 for h in homes], dtype=float)
+        # the Stelrad curve for a 1W emitter; scaled by emitter_std_power per home. Same spline as Radiator so results match RoomTempSolver
+        self._emitter_factor = CubicSpline([p[0] for p in Radiator.stelrad_correction_factor_points],
+                                           [p[1] for p in Radiator.stelrad_correction_factor_points])
+
+        # other setup
+        self.steps_per_hour = steps_per_hour
+        self.time_step_duration = 1 / steps_per_hour
+        self.hysteresis = 0.5  # interval between on and off temps for a given target
+        self.passive_heat = passive_heat
+        self.percentiles = tuple(percentiles)
+
+        # Convenient to get a list of ambient temperatures etc to match the fleet_* data. Used internally and useful for plotting
+        amb_model = AmbientTemps(amb_defn)
+        self.times = list(np.arange(0, 24, 1 / steps_per_hour))
+        self.ambient_temps = [amb_model.temp(hr) for hr in self.times]
+
+        # COPs are only a function of ambient temp for a given option, so tabulate once per option: shape (n_options, steps)
+        cop_option_keys = sorted({h["cop_option"] for h in homes})
+        self._cop_option_ix = np.array([cop_option_keys.index(h["cop_option"]) for h in homes])
+        self._cop_table = np.array([[COP(cop_defns[k]["T_amb"], cop_defns[k]["COP"]).cop(amb) for amb in self.ambient_temps] for k in cop_option_keys])
+        # target temps, shape (homes, 24); indexed by hour at each step
+        self._targets = np.array([h["target_temps_hourly"] for h in homes], dtype=float)
+        self._step_hours = np.array([int(hr) for hr in self.times])
+
+        # current state
+        self.heating_on = np.zeros(n_homes, dtype=bool)
+        self.current_temp = np.full(n_homes, initial_temp, dtype=float)
+
+        # fleet aggregates after last iteration. Arrays of length 24 * steps_per_hour
+        self.fleet_demand = np.zeros(len(self.times))  # kW, summed over all homes
+        self.fleet_demand_percentiles = np.zeros((len(self.percentiles), len(self.times)))  # kW per home, rows in order of percentiles
+        self.fleet_heating_on = np.zeros(len(self.times), dtype=int)  # number of homes with heating on
+
+        # use as a "result" and to assess convergence
+        self.full_day_energy = np.zeros(n_homes)  # kWh per home
+        self.fleet_day_energy = 0  # kWh for whole fleet
+        # Use to assess convergence. Individual homes can jitter between iterations as switch on/off events land in different time slices
+        # (see RoomTempSolver), so for large fleets the fleet-level delta is usually the more useful convergence test.
+        self.full_day_energy_delta = 99  # max over homes of absolute change
+        self.fleet_day_energy_delta = 99  # absolute change in fleet_day_energy
+
+        # and an iteration counter for non-convergence exit
+        self.n_iterations = 0
+
+    def iterate(self):
+        self.n_iterations += 1
+        half_hysteresis = self.hysteresis / 2
+        energy = np.zeros(self.n_homes)  # Watt.hours
+
+        for ix, hr in enumerate(self.times):
+            amb = self.ambient_temps[ix]
+            cop = self._cop_table[self._cop_option_ix, ix]
+            target = self._targets[:, self._step_hours[ix]]
+            t = self.current_temp
+
+            # same rule as RoomTempSolver: off above target + h/2; switch on only when below target - h/2
+            self.heating_on = np.where(t >= target + half_hysteresis, False, self.heating_on | (target - t > half_hysteresis))
+
+            # heat loss and supplied by emitter
+            lost = self.heat_loss_factor * (t - amb) * self.time_step_duration
+            emitted = np.where(self.heating_on, self.emitter_std_power * self._emitter_factor(self.mean_water_temp - t), 0) * self.time_step_duration
+            elec_used = emitted / cop  # Watt.hours
+
+            self.current_temp = t + (emitted - lost + self.passive_heat * self.time_step_duration) / self.heat_capacity
+            energy += elec_used
+
+            # aggregate across the fleet now rather than keeping per-home trajectories
+            power = elec_used / self.time_step_duration / 1000  # kW
+            self.fleet_demand[ix] = power.sum()
+            self.fleet_demand_percentiles[:, ix] = np.percentile(power, self.percentiles)
+            self.fleet_heating_on[ix] = np.count_nonzero(self.heating_on)
+
+        energy_kwh = energy / 1000
+        self.full_day_energy_delta = float(np.max(np.abs(self.full_day_energy - energy_kwh)))
+        self.full_day_energy = energy_kwh
+        self.fleet_day_energy_delta = abs(self.fleet_day_energy - float(energy_kwh.sum()))
+        self.fleet_day_energy = float(energy_kwh.sum())
+
+
+def converge_fleet(solver, threshold=CONV_THRESHOLD):
+    """
+    Iterate a FleetSolver until the change in the fleet's day energy is within threshold per home, i.e. the mean home's energy has
+    converged as RoomTempSolver's would, or MAX_ITERS. Individual homes may still jitter, see FleetSolver.
+
+    :return: True if converged
+    """
+    while solver.fleet_day_energy_delta > threshold * solver.n_homes and solver.n_iterations < MAX_ITERS:
+        solver.iterate()
+    return solver.fleet_day_energy_delta <= threshold * solver.n_homes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hourly electricity demand of a sampled building stock, for planning grid capacity")
+    parser.add_argument("--homes", type=int, default=1000)
+    parser.add_argument("--amb-option", default="Winter", choices=list(get_ambient_hr_options()))
+    parser.add_argument("--seed", type=int, help="for a repeatable fleet")
+    parser.add_argument("--steps-per-hour", type=int, default=6)
+    parser.add_argument("--buildings", nargs="+", help="default: all")
+    parser.add_argument("--cop-options", nargs="+", help="default: all the heat pump options")
+    parser.add_argument("--targets", nargs="+", help="default: all")
+    args = parser.parse_args()
+    if args.homes < 1:
+        parser.error("--homes must be at least 1")
+
+    fleet = FleetSolver(sample_homes(args.homes, args.seed, args.buildings, args.cop_options, args.targets), args.amb_option,
+                        steps_per_hour=args.steps_per_hour)
+    converged = converge_fleet(fleet)
+    peak_ix = int(np.argmax(fleet.fleet_demand))
+    print(f"{fleet.n_homes} homes, {args.amb_option}: {fleet.fleet_day_energy:.0f}kWh for the day, peak {fleet.fleet_demand[peak_ix]:.0f}kW "
+          f"at {fleet.times[peak_ix]:.2f}h. {'Converged' if converged else 'NOT converged'} after {fleet.n_iterations} iterations")
+    print("hour\tfleet kW\thomes on\tper-home kW at percentiles " + " / ".join(str(p) for p in fleet.percentiles))
+    for hour in range(24):
+        ix = hour * args.steps_per_hour
+        print(f"{hour:02d}:00\t{fleet.fleet_demand[ix]:.0f}\t{fleet.fleet_heating_on[ix]}\t"
+              + " / ".join(f"{v:.2f}" for v in fleet.fleet_demand_percentiles[:, ix]))
@@ -0,0 +1,168 @@
+import numpy as np
+
+from config import get_cop_point_options, get_cop_family, get_ambient_hr_options
+from data.engines import converge
+from data.solver import RoomTempSolver
+from utilities import AmbientTemps, PowerLawEmitter, required_lwt
+
+# the search first tries a bracket of +/- this (C) around the steady-state estimate of the LWT, see estimate_lwt()
+SEED_MARGIN = 2.5
+
+
+def estimate_lwt(building_parameters, cop_option, amb_option, target_temps_hourly):
+    """
+    Steady-state LWT which holds the highest target temp at the day's coldest ambient temp, with no thermal mass: a quick estimate of the
+    minimum LWT, from utilities.required_lwt() for a radiator of emitter_std_power and the COP option's flow-return difference. Thermal mass
+    carries the room over the coldest hours, but recovering to a raised target needs more, so the simulated minimum is usually within a
+    few degrees either side.
+    """
+    cop_defn = get_cop_point_options()[cop_option]
+    amb_model = AmbientTemps(get_ambient_hr_options()[amb_option])
+    coldest = float(np.min(amb_model.temps(np.arange(0, 24, 0.25))))
+    return float(required_lwt(PowerLawEmitter(building_parameters["emitter_std_power"]), building_parameters["heat_loss_factor"],
+                              max(target_temps_hourly), coldest, dT=cop_defn["dT"]))
+
+
+def _evaluate_lwt(building_parameters, cop_option, amb_option, target_temps_hourly, lwt, steps_per_hour, recovery_hours, warm=None):
+    """
+    Converge a RoomTempSolver at one candidate LWT. Module-level so it can run in a worker process. Thermostat switching is located
+    within steps (event_location), as with step-snapped switching many candidates jitter between iterations and never converge.
+
+    :param warm: dict from a previous evaluation (see below) to warm-start from, or None
+    :return: dict of results, including the periodic end state for warm-starting other candidates
+    """
+    solver = RoomTempSolver(building_parameters, cop_option, amb_option, target_temps_hourly, steps_per_hour=steps_per_hour, lwt=lwt,
+                            recording="summary", event_location=True)
+    if warm is not None:
+        solver.warm_start(warm["times"], warm["iter_room_temp"], heating_on=warm["heating_on"])
+    converged = converge(solver, "full_day_energy")
+
+    return {
+        "lwt": lwt,
+        "energy_kwh": solver.full_day_energy,
+        "mean_cop": solver.mean_cop(),
+        "comfort_shortfall": solver.comfort_shortfall(recovery_hours),
+        "n_iterations": solver.n_iterations,
+        "converged": converged,
+        # state for warm starts
+        "times": solver.times,
+        "iter_room_temp": list(solver.iter_room_temp),
+        "heating_on": solver.heating_on
+    }
+
+
+def find_min_lwt(building_parameters, cop_option, amb_option, target_temps_hourly, max_shortfall=0.5, recovery_hours=1, lwt_range=None,
+                 lwt_tolerance=0.25, n_parallel=1, executor=None, steps_per_hour=12, progress=None):
+    """
+    Find the lowest LWT which still meets the target temperature schedule, by a bisection (k-section) search.
+
+    The first round tries a bracket of +/- SEED_MARGIN around the steady-state estimate (estimate_lwt()): if its upper end passes the
+    search continues within it (or below it, if the lower end passes too), and if not, from the upper end to the max LWT. Each later round evaluates n_parallel candidate LWTs spread across the current bracket and narrows the bracket to between the highest
+    failing and lowest passing candidates. Each candidate is warm-started from the periodic state of the nearest LWT already evaluated,
+    so typically needs only a couple of solver iterations. A candidate which doesn't converge (usually the on/off jitter between
+    iterations noted in RoomTempSolver) neither passes nor fails, as its energy and shortfall are those of an arbitrary iteration; if no
+    candidate in a round converges the search stops with the bracket it has. See _evaluate_lwt() for how they are made to converge.
+
+    :param building_parameters: as for RoomTempSolver
+    :param cop_option: key into get_cop_point_options(). COPs at other LWTs are interpolated from its family (see get_cop_family())
+    :param amb_option: key into return from get_ambient_hr_options()
+    :param target_temps_hourly: list of target temps for each hour
+    :param max_shortfall: comfort criterion. The LWT passes if RoomTempSolver.comfort_shortfall() is no more than this (K.h)
+    :param recovery_hours: hours after each increase in target temp which are excluded from the comfort shortfall
+    :param lwt_range: (min, max) LWT to search. Default is the COP family's LWT range, +/- 5C
+    :param lwt_tolerance: stop when the bracket is narrower than this (C)
+    :param n_parallel: number of candidates per round. 1 is plain bisection
+    :param executor: concurrent.futures executor to evaluate each round's candidates in parallel, e.g. a ProcessPoolExecutor owned by the
+        caller. None evaluates them in this process, as in a background job (app/jobs.py), which already has a worker process of its own
+    :param steps_per_hour: solver resolution
+    :param progress: optional function called after each round, as progress(n_rounds, lwt_low=, lwt_high=, n_evaluations=), e.g. a job's
+        progress function (see app/jobs.py)
+    :return: dict with "lwt" (the lowest passing LWT found; None if the max LWT fails or didn't converge), "energy_kwh", "mean_cop" and
+        "comfort_shortfall" at that LWT, "lwt_low" and "lwt_high" (the final bracket), "n_evaluations", "n_unconverged", "n_rounds", and
+        "evaluations" (list of (lwt, energy_kwh, mean_cop, comfort_shortfall, converged) for every candidate)
+    """
+    if lwt_range is None:
+        family_lwts = [get_cop_point_options()[k]["LWT"] for k in get_cop_family(cop_option)]
+        lwt_range = (min(family_lwts) - 5, max(family_lwts) + 5)
+    args = (building_parameters, cop_option, amb_option, list(target_temps_hourly))
+    evaluations = dict()  # lwt -> result
+
+    def passes(result):
+        return result["converged"] and result["comfort_shortfall"] <= max_shortfall
+
+    def fails(result):
+        return result["converged"] and result["comfort_shortfall"] > max_shortfall
+
+    def nearest_warm(lwt):
+        if not evaluations:
+            return None
+        return evaluations[min(evaluations, key=lambda x: abs(x - lwt))]
+
+    def evaluate(lwts):
+        warms = [nearest_warm(lwt) for lwt in lwts]
+        if executor is None:
+            results = [_evaluate_lwt(*args, lwt, steps_per_hour, recovery_hours, warm) for lwt, warm in zip(lwts, warms)]
+        else:
+            futures = [executor.submit(_evaluate_lwt, *args, lwt, steps_per_hour, recovery_hours, warm) for lwt, warm in zip(lwts, warms)]
+            results = [f.result() for f in futures]
+        for result in results:
+            evaluations[result["lwt"]] = result
+        return results
+
+    def report(lo, hi):
+        if progress is not None:
+            progress(n_rounds, lwt_low=lo, lwt_high=hi, n_evaluations=len(evaluations))
+
+    lo, hi = lwt_range
+    guess = min(max(estimate_lwt(*args), lo), hi)
+    seed_lo, seed_hi = max(guess - SEED_MARGIN, lo), min(guess + SEED_MARGIN, hi)
+    if executor is not None:
+        seed_lo_result, seed_hi_result = evaluate([seed_lo, seed_hi])
+    else:
+        seed_hi_result = evaluate([seed_hi])[0]
+        seed_lo_result = evaluate([seed_lo])[0] if passes(seed_hi_result) and seed_lo < seed_hi else None
+    n_rounds = 1
+    if passes(seed_hi_result):
+        hi_result = seed_hi_result
+        hi = seed_hi
+        if seed_lo_result is not None and passes(seed_lo_result):
+            hi_result = seed_lo_result
+            hi = seed_lo
+        elif seed_lo_result is not None and fails(seed_lo_result):
+            lo = seed_lo
+    else:
+        # the estimate was too low (or didn't converge): fall back to the max LWT
+        if fails(seed_hi_result):
+            lo = seed_hi
+        hi_result = evaluations[hi] if hi in evaluations else evaluate([hi])[0]
+    report(lo, hi)
+    if not passes(hi_result):
+        best = None
+    else:
+        best = hi_result
+        while hi - lo > lwt_tolerance:
+            n_rounds += 1
+            candidates = [float(lwt) for lwt in np.linspace(lo, hi, n_parallel + 2)[1:-1]]
+            results = evaluate(candidates)
+            if not any(r["converged"] for r in results):
+                break
+            passing = [r for r in results if passes(r)]
+            if passing:
+                best = passing[0]  # candidates are in increasing LWT
+                hi = best["lwt"]
+            # highest failing candidate below the (new) upper bracket
+            lo = max([r["lwt"] for r in results if fails(r) and r["lwt"] < hi], default=lo)
+            report(lo, hi)
+
+    return {
+        "lwt": None if best is None else best["lwt"],
+        "energy_kwh": None if best is None else best["energy_kwh"],
+        "mean_cop": None if best is None else best["mean_cop"],
+        "comfort_shortfall": None if best is None else best["comfort_shortfall"],
+        "lwt_low": lo,
+        "lwt_high": hi,
+        "n_evaluations": len(evaluations),
+        "n_unconverged": sum(not r["converged"] for r in evaluations.values()),
+        "n_rounds": n_rounds,
+        "evaluations": sorted((r["lwt"], r["energy_kwh"], r["mean_cop"], r["comfort_shortfall"], r["converged"]) for r in evaluations.values())
+    }
@@ -0,0 +1,262 @@
+from functools import lru_cache
+from math import exp
+
+import numpy as np
+from scipy.linalg import expm
+from scipy.optimize import brentq
+
+from utilities import PowerLawEmitter
+from data.solver import RoomTempSolver
+
+# room temp at which the emitter is linearised, see TwoNodeRoomTempSolver
+EMITTER_LINEARISATION_ROOM_TEMP = 20
+
+
+@lru_cache(maxsize=256)
+def transition_matrices(air_capacity, fabric_capacity, air_loss, fabric_loss, air_fabric_conductance, emitter_conductance, mean_water_temp,
+                        passive_heat, step_hours):
+    """
+    Exact discretisation of the two-node model for one time step, for heating off and heating on.
+
+    State x = [air temp, fabric temp, emitted energy (W.h)]; input u = [ambient temp, 1]. The ambient temp is taken as varying linearly
+    across the step (first-order hold), so for the linear model the step is exact at any step size:
+        x[k+1] = phi @ x[k] + gamma_0 @ u[k] + gamma_1 @ u[k+1]
+    Cached, so each building/step size combination costs one pair of matrix exponentials.
+
+    :return: dict of heating_on (bool) -> (phi, gamma_0, gamma_1)
+    """
+    matrices = dict()
+    for heating_on in (False, True):
+        ua_e = emitter_conductance if heating_on else 0
+        node_a, node_b = _node_system(air_capacity, fabric_capacity, air_loss, fabric_loss, air_fabric_conductance, ua_e, mean_water_temp,
+                                      passive_heat)
+        # emitted power integrated into the energy state
+        a = np.zeros((3, 3))
+        a[:2, :2] = node_a
+        a[2, 0] = -ua_e
+        b = np.vstack([node_b, [0, ua_e * mean_water_temp]])
+        n, m = b.shape
+        # first-order hold: expm of [[A, B, 0], [0, 0, I/h], [0, 0, 0]] * h
+        block = np.zeros((n + 2 * m, n + 2 * m))
+        block[:n, :n] = a
+        block[:n, n:n + m] = b
+        block[n:n + m, n + m:] = np.eye(m) / step_hours
+        phi_block = expm(block * step_hours)
+        phi = phi_block[:n, :n]
+        gamma_1 = phi_block[:n, n + m:]
+        gamma_0 = phi_block[:n, n:n + m] - gamma_1
+        matrices[heating_on] = (phi, gamma_0, gamma_1)
+    return matrices
+
+
+def _node_system(air_capacity, fabric_capacity, air_loss, fabric_loss, air_fabric_conductance, ua_e, mean_water_temp, passive_heat):
+    """d[air, fabric]/dt = a @ [air, fabric] + b @ [ambient temp, 1] for one heating regime (ua_e = 0 for off)"""
+    a = np.array([
+        [-(air_loss + air_fabric_conductance + ua_e) / air_capacity, air_fabric_conductance / air_capacity],
+        [air_fabric_conductance / fabric_capacity, -(air_fabric_conductance + fabric_loss) / fabric_capacity]
+    ])
+    b = np.array([
+        [air_loss / air_capacity, (ua_e * mean_water_temp + passive_heat) / air_capacity],
+        [fabric_loss / fabric_capacity, 0]
+    ])
+    return a, b
+
+
+class _Segment:
+    """
+    Closed-form solution of one heating regime from a given state, with the ambient temp varying linearly, for locating thermostat switches
+    within a step. The system is an RC network, so its eigenvalues are real and negative: air(s) = p0 + p1 * s + sum(w * exp(lam * s))
+    """
+    def __init__(self, modes, ua_e, mean_water_temp, state, ambient, ambient_slope):
+        """
+        :param modes: (a, b, a_inv, eigenvalues, eigenvectors, inverse eigenvectors) for the regime
+        :param state: [air temp, fabric temp] at the start of the segment
+        :param ambient: ambient temp at the start of the segment
+        :param ambient_slope: K per hour
+        """
+        a, b, a_inv, self.lam, vectors, vectors_inv = modes
+        b_0 = b @ np.array([ambient, 1.0])
+        b_1 = b[:, 0] * ambient_slope
+        self.p1 = -a_inv @ b_1
+        self.p0 = a_inv @ (self.p1 - b_0)
+        self.vectors = vectors
+        self.c = vectors_inv @ (np.asarray(state) - self.p0)
+        self.w = vectors[0] * self.c  # air temp weight of each mode
+        self.ua_e = ua_e
+        self.mean_water_temp = mean_water_temp
+        # floats for air(), which the root finding calls many times
+        self._air_terms = (float(self.p0[0]), float(self.p1[0]), float(self.w[0]), float(self.lam[0]), float(self.w[1]), float(self.lam[1]))
+
+    def air(self, s):
+        p0, p1, w0, lam0, w1, lam1 = self._air_terms
+        return p0 + p1 * s + w0 * exp(lam0 * s) + w1 * exp(lam1 * s)
+
+    def state(self, s):
+        return self.p0 + self.p1 * s + self.vectors @ (self.c * np.exp(self.lam * s))
+
+    def emitted(self, s):
+        """W.h emitted over the first s hours"""
+        if self.ua_e == 0:
+            return 0.0
+        air_integral = self.p0[0] * s + self.p1[0] * s ** 2 / 2 + self.w @ (np.expm1(self.lam * s) / self.lam)
+        return float(self.ua_e * (self.mean_water_temp * s - air_integral))
+
+
+class TwoNodeRoomTempSolver(RoomTempSolver):
+    def __init__(self, building_parameters, cop_option, amb_option, target_temps_hourly, passive_heat=0, initial_temp=16, steps_per_hour=6, lwt=None,
+                 air_capacity_fraction=0.1, air_loss_fraction=0.4, air_fabric_conductance_per_m2=20, recording="full"):
+        """
+        RoomTempSolver with the building split into an air node (air + furnishings; fast) and a fabric node (walls, floors; slow), stepped exactly
+        using precomputed state-transition matrices rather than explicit Euler. Thermostat switching is located within the step, as
+        RoomTempSolver's event_location, from the closed-form solution of each regime, so switch times don't snap to the step grid. The air
+        node responds in minutes, so with switching only at step boundaries each "on" step would overshoot the hysteresis band and the
+        iterations wouldn't settle at coarse steps.
+
+        Heat flows: emitter -> air; air <-> fabric; air -> ambient (ventilation, windows); fabric -> ambient. The split of heat_loss_factor is
+        chosen so that the steady state loss is unchanged, i.e. air_loss + (series fabric path) = heat_loss_factor.
+
+        The emitter is linearised to a conductance from its output at EMITTER_LINEARISATION_ROOM_TEMP, so that each regime is a linear
+        time-invariant system. Output is therefore slightly over-estimated for warmer rooms and under-estimated for cooler ones.
+
+        Parameters are as for RoomTempSolver, plus:
+        :param air_capacity_fraction: fraction of the thermal mass (tmp * floor_area) in the air node
+        :param air_loss_fraction: fraction of heat_loss_factor lost directly from the air
+        :param air_fabric_conductance_per_m2: air-fabric conductance in W/K per m^2 of floor area (about 3m^2 of internal surface at 7W/m^2K)
+        """
+        super().__init__(building_parameters, cop_option, amb_option, target_temps_hourly, passive_heat=passive_heat, initial_temp=initial_temp,
+                         steps_per_hour=steps_per_hour, lwt=lwt, recording=recording)
+
+        # two node building setup
+        self.air_capacity = self.heat_capacity * air_capacity_fraction  # Watt.hours per Kelvin
+        self.fabric_capacity = self.heat_capacity - self.air_capacity
+        self.air_fabric_conductance = air_fabric_conductance_per_m2 * building_parameters["floor_area"]  # W/K
+        self.air_loss = self.heat_loss_factor * air_loss_fraction
+        fabric_path = self.heat_loss_factor - self.air_loss  # series conductance of air->fabric->ambient
+        if fabric_path >= self.air_fabric_conductance:
+            raise ValueError("air_fabric_conductance must exceed the fabric share of heat_loss_factor")
+        self.fabric_loss = 1 / (1 / fabric_path - 1 / self.air_fabric_conductance)
+
+        # linearised emitter
+        mean_water_temp = self.emitter.mean_water_temp
+        dt_ref = mean_water_temp - EMITTER_LINEARISATION_ROOM_TEMP
+        self.emitter_conductance = PowerLawEmitter(building_parameters["emitter_std_power"]).output(EMITTER_LINEARISATION_ROOM_TEMP, mean_water_temp) / dt_ref \
+            if dt_ref > 0 else 0
+
+        self._matrices = transition_matrices(self.air_capacity, self.fabric_capacity, self.air_loss, self.fabric_loss, self.air_fabric_conductance,
+                                             self.emitter_conductance, mean_water_temp, passive_heat, self.time_step_duration)
+        # ambient at the start and end of each step, for the first-order hold
+        amb_ends = self.ambient_temps[1:] + self.ambient_temps[:1]  # periodic
+        self._inputs = [(np.array([a0, 1.0]), np.array([a1, 1.0])) for a0, a1 in zip(self.ambient_temps, amb_ends)]
+        self._ambient_slopes = [(a1 - a0) / self.time_step_duration for a0, a1 in zip(self.ambient_temps, amb_ends)]
+
+        # closed-form solution of each regime, for locating thermostat switches within a step (see _Segment)
+        self._modes = dict()
+        for heating_on in (False, True):
+            a, b = _node_system(self.air_capacity, self.fabric_capacity, self.air_loss, self.fabric_loss, self.air_fabric_conductance,
+                                self.emitter_conductance if heating_on else 0, mean_water_temp, passive_heat)
+            eigenvalues, vectors = np.linalg.eig(a)
+            vectors = vectors.real
+            self._modes[heating_on] = (a, b, np.linalg.inv(a), eigenvalues.real, vectors, np.linalg.inv(vectors))
+        self._mean_water_temp = mean_water_temp
+
+        # current state: fabric starts at the same temp as the air
+        self.current_fabric_temp = initial_temp
+        self.iter_fabric_temp = [initial_temp] * len(self.times)
+
+    def warm_start(self, times, room_temps, heating_on=None, full_day_energy=None):
+        super().warm_start(times, room_temps, heating_on=heating_on, full_day_energy=full_day_energy)
+        # the fabric lags the air; its mean is a reasonable start
+        self.current_fabric_temp = float(np.mean(self.iter_room_temp))
+
+    def iterate(self):
+        max_t_iter_delta = 0
+        sum_t_iter_delta = 0
+        self.n_iterations += 1
+        self.n_rhs_evaluations += len(self.times)  # one transition-matrix step per step; _located_step() counts its own
+        self._start_recording()
+        x = np.array([self.current_temp, self.current_fabric_temp, 0.0])  # energy state is W.h emitted since the start of the step
+
+        for ix, hr in enumerate(self.times):
+            amb = self.ambient_temps[ix]
+            target = self.target_temps[ix]
+            t = x[0]
+
+            # same thermostat as RoomTempSolver, on the air temp at the start of the step
+            if t >= target + self.hysteresis / 2:
+                self.heating_on = False
+            else:
+                if not self.heating_on:
+                    self.heating_on = target - t > self.hysteresis / 2
+
+            phi, gamma_0, gamma_1 = self._matrices[self.heating_on]
+            u_0, u_1 = self._inputs[ix]
+            x[2] = 0  # energy emitted within this step
+            x_start = x
+            x = phi @ x + gamma_0 @ u_0 + gamma_1 @ u_1
+            heating_was_on = self.heating_on
+            emitted = float(x[2])
+            if (x[0] >= target + self.hysteresis / 2) if self.heating_on else (x[0] < target - self.hysteresis / 2):
+                x, emitted, heating_was_on = self._located_step(ix, x_start, target)
+
+            if heating_was_on:
+                cop = self.step_cops[ix]
+                elec_used = emitted / cop
+            else:
+                cop = None
+                emitted = 0
+                elec_used = 0
+
+            room_temp_iter_delta = abs(self.iter_room_temp[ix] - x[0])
+            max_t_iter_delta = max(max_t_iter_delta, room_temp_iter_delta)
+            sum_t_iter_delta += room_temp_iter_delta
+
+            self.iter_room_temp[ix] = float(x[0])
+            self.iter_fabric_temp[ix] = float(x[1])
+            self._record_step(ix, hr, cop, elec_used, emitted)
+
+        self.current_temp = float(x[0])
+        self.current_fabric_temp = float(x[1])
+        self.max_t_iter_delta = max_t_iter_delta
+        self.mean_t_iter_delta = sum_t_iter_delta / len(self.times)
+
+        energy_kwh = self.elec_used_total / 1000
+        self.full_day_energy_delta = abs(self.full_day_energy - energy_kwh)
+        self.full_day_energy = energy_kwh
+
+    def _located_step(self, ix, x, target):
+        """
+        Step ix, split where the air temp crosses the thermostat switch off (heating on) or switch on (heating off) temp, as
+        RoomTempSolver._located_step(). Updates heating_on.
+
+        :param x: state at the start of the step
+        :return: (state at the end of the step, W.h emitted, True if the heating was on for any of the step)
+        """
+        state = x[:2]
+        elapsed = 0
+        emitted = 0
+        was_on = self.heating_on
+        for _ in range(self.MAX_EVENTS_PER_STEP + 1):
+            remaining = self.time_step_duration - elapsed
+            ua_e = self.emitter_conductance if self.heating_on else 0
+            segment = _Segment(self._modes[self.heating_on], ua_e, self._mean_water_temp, state,
+                               self.ambient_temps[ix] + self._ambient_slopes[ix] * elapsed, self._ambient_slopes[ix])
+            self.n_rhs_evaluations += 1
+            end_temp = segment.air(remaining)
+            if self.heating_on:
+                switch_temp = target + self.hysteresis / 2
+                crossed = end_temp >= switch_temp
+            else:
+                switch_temp = target - self.hysteresis / 2
+                crossed = end_temp < switch_temp
+            if not crossed or _ == self.MAX_EVENTS_PER_STEP:  # or chattering: finish the step without further switching
+                emitted += segment.emitted(remaining)
+                return np.append(segment.state(remaining), 0.0), emitted, was_on
+            # the switch is part way through the step
+            duration, root = brentq(lambda s: segment.air(s) - switch_temp, 0, remaining, xtol=1e-6, full_output=True)
+            self.n_rhs_evaluations += root.function_calls
+            emitted += segment.emitted(duration)
+            state = segment.state(duration)
+            state[0] = switch_temp
+            elapsed += duration
+            self.heating_on = not self.heating_on
+            was_on = was_on or self.heating_on
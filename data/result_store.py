@@ -0,0 +1,168 @@
+import json
+import os
+
+import numpy as np
+
+
+def scenario_key(**params):
+    """Canonical string key for a scenario, independent of the order the parameters are given in. e.g. scenario_key(cop_option="WM85_LWT35", steps_per_hour=12)"""
+    return "|".join(f"{k}={params[k]}" for k in sorted(params))
+
+
+class TrajectoryStore:
+    """
+    On-disk store for per-step solver trajectories from large sweeps.
+
+    Each field (e.g. "iter_room_temp", "iter_elec_used", "cops") is a preallocated numpy.memmap of shape (n_rows, n_steps) in its own .dat file.
+    A small JSON index maps scenario keys to row numbers, the number of steps actually used (CyclingSolver cycles vary in length) and any
+    scenario metadata. Reads return views onto the memmap, so slicing a scenario doesn't load (or copy) anything else.
+
+    Missing values (None in solver lists, e.g. COP when the heating is off, and the unused tail of short rows) are stored as NaN.
+    """
+    INDEX_FILE = "index.json"
+
+    def __init__(self, directory, mode="r"):
+        """
+        Open an existing store. Use TrajectoryStore.create() to make a new one.
+
+        :param directory: store directory, as passed to create()
+        :param mode: "r" for read-only or "r+" to add/overwrite scenarios
+        """
+        self.directory = directory
+        self.mode = mode
+        with open(os.path.join(directory, self.INDEX_FILE), "r") as f:
+            self._index = json.load(f)
+        self.n_rows = self._index["n_rows"]
+        self.n_steps = self._index["n_steps"]
+        self.dtype = np.dtype(self._index["dtype"])
+        self.fields = list(self._index["fields"])
+        self._maps = {field: np.memmap(self._field_path(field), dtype=self.dtype, mode=mode, shape=(self.n_rows, self.n_steps))
+                      for field in self.fields}
+        self._dirty = False
+
+    @classmethod
+    def create(cls, directory, n_rows, n_steps, fields, dtype="float32"):
+        """
+        Make a new store, preallocating the memmap files. Any existing store in the directory is replaced.
+
+        :param directory: created if it doesn't exist
+        :param n_rows: maximum number of scenarios
+        :param n_steps: maximum number of steps in a trajectory, e.g. 24 * steps_per_hour or CyclingSolver.max_steps
+        :param fields: names of the per-step series to store
+        :param dtype: float32 halves the disk footprint and is ample for temperatures and energies
+        :return: store opened for writing
+        """
+        os.makedirs(directory, exist_ok=True)
+        index = {"n_rows": n_rows, "n_steps": n_steps, "dtype": np.dtype(dtype).str, "fields": list(fields), "rows": dict()}
+        for field in fields:
+            m = np.memmap(os.path.join(directory, f"{field}.dat"), dtype=dtype, mode="w+", shape=(n_rows, n_steps))
+            m[:] = np.nan
+            m.flush()
+            del m
+        with open(os.path.join(directory, cls.INDEX_FILE), "w") as f:
+            json.dump(index, f)
+        return cls(directory, mode="r+")
+
+    def _field_path(self, field):
+        return os.path.join(self.directory, f"{field}.dat")
+
+    def __len__(self):
+        return len(self._index["rows"])
+
+    def __contains__(self, key):
+        return key in self._index["rows"]
+
+    def keys(self):
+        return list(self._index["rows"])
+
+    def metadata(self, key):
+        return self._index["rows"][key]["meta"]
+
+    def length(self, key):
+        return self._index["rows"][key]["length"]
+
+    def write(self, key, meta=None, **series):
+        """
+        Write (or overwrite) one scenario.
+
+        :param key: scenario key, see scenario_key()
+        :param meta: optional JSON-serialisable dict saved in the index, e.g. summary results
+        :param series: field name = list/array of per-step values. Fields not given are left as NaN
+        """
+        if self.mode == "r":
+            raise ValueError("Store was opened read-only")
+        rows = self._index["rows"]
+        if key in rows:
+            row = rows[key]["row"]
+        else:
+            row = len(rows)
+            if row >= self.n_rows:
+                raise ValueError(f"Store is full ({self.n_rows} rows)")
+
+        arrays = dict()
+        for field, values in series.items():
+            if field not in self._maps:
+                raise KeyError(f"Unknown field {field}. Store fields are {self.fields}")
+            arrays[field] = np.array([np.nan if v is None else v for v in values], dtype=self.dtype)
+            if len(arrays[field]) > self.n_steps:
+                raise ValueError(f"{field} has {len(arrays[field])} steps but the store only allows {self.n_steps}")
+
+        # clear the whole row, so an overwrite doesn't leave the previous scenario's values in fields not given
+        for m in self._maps.values():
+            m[row, :] = np.nan
+        length = 0
+        for field, values in arrays.items():
+            self._maps[field][row, :len(values)] = values
+            length = max(length, len(values))
+
+        rows[key] = {"row": row, "length": length, "meta": meta or dict()}
+        self._dirty = True
+
+    def write_solver(self, key, solver, meta=None):
+        """
+        Write the store's fields from the solver attributes of the same name, e.g. a store with fields ["iter_room_temp", "cops"].
+        The solver must have been run with recording="full", as the series are None otherwise.
+        """
+        series = {field: getattr(solver, field) for field in self.fields if hasattr(solver, field)}
+        missing = [field for field, values in series.items() if values is None]
+        if missing:
+            raise ValueError(f"The solver has no {', '.join(missing)} series (recording={getattr(solver, 'recording', None)!r}). "
+                             f"Use recording=\"full\" to store it")
+        self.write(key, meta=meta, **series)
+
+    def read(self, key, field):
+        """
+        Zero-copy view of one scenario's series. Read-only if the store was opened with mode="r".
+
+        :return: 1-d array of the scenario's length
+        """
+        entry = self._index["rows"][key]
+        return self._maps[field][entry["row"], :entry["length"]]
+
+    def read_rows(self, keys, field):
+        """Series for several scenarios as a 2-d array (copied: numpy fancy indexing can't be a view). Short rows are NaN-padded"""
+        rows = [self._index["rows"][k]["row"] for k in keys]
+        return np.asarray(self._maps[field][rows, :])
+
+    def flush(self):
+        """Flush memmaps and write the index. Called by close() and on exiting a with block"""
+        for m in self._maps.values():
+            if self.mode != "r":
+                m.flush()
+        if self._dirty:
+            # write-then-rename so readers never see a half-written index
+            index_path = os.path.join(self.directory, self.INDEX_FILE)
+            with open(index_path + ".tmp", "w") as f:
+                json.dump(self._index, f)
+            os.replace(index_path + ".tmp", index_path)
+            self._dirty = False
+
+    def close(self):
+        self.flush()
+        self._maps = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
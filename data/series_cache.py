@@ -0,0 +1,98 @@
+"""Binary cache for imported series (measurement logs, weather), so that large CSVs are only parsed once.
+
+The parsed arrays are saved as .npy files in a directory next to the source, "<source>.npcache", along with a meta.json recording the
+source's size, modification time and SHA-256. Later loads memory-map the .npy files instead of parsing:
+- if the source's size and mtime match, the cache is used without reading the source at all
+- if only the mtime has changed (e.g. the file was touched or copied), the source is hashed, and if the content is unchanged the cache
+  is used and its recorded mtime updated
+- otherwise, or if the parse options differ, the cache is rebuilt
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+CACHE_SUFFIX = ".npcache"
+# bump if the cache layout changes, to invalidate existing caches
+CACHE_VERSION = 1
+
+
+def _file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def cache_dir(source_path):
+    return source_path + CACHE_SUFFIX
+
+
+def _read_meta(directory):
+    try:
+        with open(os.path.join(directory, "meta.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(directory, meta):
+    tmp_path = os.path.join(directory, "meta.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, os.path.join(directory, "meta.json"))
+
+
+def _load_arrays(directory, names):
+    return {name: np.load(os.path.join(directory, name + ".npy"), mmap_mode="r") for name in names}
+
+
+def cached_load(source_path, parse, options=None):
+    """
+    Load series from a source file through the binary cache.
+
+    :param source_path: e.g. a CSV
+    :param parse: function(source_path) -> dict of name -> 1D numpy array (numeric). Only called on a cache miss
+    :param options: JSON-serialisable description of how parse interprets the file (e.g. column names). A cache built with different
+        options is rebuilt
+    :return: dict of name -> read-only array, memory-mapped from the cache
+    """
+    directory = cache_dir(source_path)
+    stat = os.stat(source_path)
+    meta = _read_meta(directory)
+
+    if meta is not None and meta["version"] == CACHE_VERSION and meta["options"] == options and meta["size"] == stat.st_size:
+        if meta["mtime_ns"] == stat.st_mtime_ns:
+            return _load_arrays(directory, meta["names"])
+        # touched or copied, maybe unchanged
+        if meta["sha256"] == _file_hash(source_path):
+            meta["mtime_ns"] = stat.st_mtime_ns
+            _write_meta(directory, meta)
+            return _load_arrays(directory, meta["names"])
+
+    # (re)build. Written to a temporary directory then swapped in, so a concurrent reader never sees a partial cache
+    source_hash = _file_hash(source_path)
+    arrays = parse(source_path)
+    build_dir = tempfile.mkdtemp(prefix=os.path.basename(directory) + ".", dir=os.path.dirname(os.path.abspath(source_path)))
+    try:
+        for name, values in arrays.items():
+            np.save(os.path.join(build_dir, name + ".npy"), np.ascontiguousarray(values))
+        _write_meta(build_dir, {
+            "version": CACHE_VERSION,
+            "options": options,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": source_hash,
+            "names": list(arrays)
+        })
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+        os.replace(build_dir, directory)
+    except Exception:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+    return _load_arrays(directory, list(arrays))
@@ -1,12 +1,142 @@
+import logging
+
 import numpy as np
 from math import fabs
-
-from utilities import Radiator, COP, AmbientTemps, TargetTemp
-from config import get_cop_point_options, get_ambient_hr_options
+from scipy.optimize import brentq
+
+from utilities import Radiator, COP, COPSurface, AmbientTemps, TargetTemp
+from config import get_cop_point_options, get_ambient_hr_options, get_cop_family
+
+# What the solvers keep of each iteration, see the recording parameter of each solver:
+# - "full": every per-step series (cops, iter_elec_used, energy_lost, cycle_* etc), as needed for plotting
+# - "events": running totals plus switch_events, a list of (time, heating_on) for the first step and each time the heating switched
+# - "summary": running totals only (e.g. elec_used_total, heat_emitted_total, mean_cop(), n_starts()), for sweeps and optimisation
+# The room temps of each step (iter_room_temp) are kept at every level, as they are the state which is iterated to convergence.
+RECORDING_LEVELS = ("full", "events", "summary")
+
+# error control for integrator="rk45": relative, and absolute in K (room temp) and W.h (the cumulative energies integrated alongside it)
+RK_RTOL = 1e-5
+RK_ATOL = 1e-3
+# first step (hours) tried by integrator="rk45"; later segments and iterations start from the last step size
+RK_FIRST_STEP = 0.05
+
+# Dormand-Prince 4(5) pair with its continuous extension, as scipy's RK45. The 7th stage is the rate at the end of the step (FSAL)
+_DP_C = (0.0, 1 / 5, 3 / 10, 4 / 5, 8 / 9, 1.0)
+_DP_A = ((),
+         (1 / 5,),
+         (3 / 40, 9 / 40),
+         (44 / 45, -56 / 15, 32 / 9),
+         (19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729),
+         (9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656))
+_DP_B = (35 / 384, 0.0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84)
+_DP_E = (-71 / 57600, 0.0, 71 / 16695, -71 / 1920, 17253 / 339200, -22 / 525, 1 / 40)
+_DP_P = ((1.0, -8048581381 / 2820520608, 8663915743 / 2820520608, -12715105075 / 11282082432),
+         (0.0, 0.0, 0.0, 0.0),
+         (0.0, 131558114200 / 32700410799, -68118460800 / 10900136933, 87487479700 / 32700410799),
+         (0.0, -1754552775 / 470086768, 14199869525 / 1410260304, -10690763975 / 1880347072),
+         (0.0, 127303824393 / 49829197408, -318862633887 / 49829197408, 701980252875 / 199316789632),
+         (0.0, -282668133 / 205662961, 2019193451 / 616988883, -1453857185 / 822651844),
+         (0.0, 40617522 / 29380423, -110615467 / 29380423, 69997945 / 29380423))
+
+
+def _dp45(rates, start, end, state, h, switch_temp=None, direction=0, rate=None):
+    """
+    Adaptive integration for integrator="rk45" of a room temp with quantities accumulated alongside it (e.g. energy), whose rates depend
+    only on the time and room temp. This is scipy's RK45 method and error control, but stepped here rather than by solve_ivp(), whose
+    setup for each call would otherwise dominate: RoomTempSolver integrates a segment per thermostat switch.
+
+    :param rates: function(hr, room_temp) -> tuple of rates: the room temp's first, then the accumulated quantities'
+    :param state: list of the room temp and accumulated quantities at start
+    :param h: first step to try (hours)
+    :param switch_temp: if set, stop where the room temp crosses this, rising (direction 1) or falling (-1)
+    :param rate: rates() at start, if already known, e.g. the rate returned by the previous call when the rates are unchanged
+    :return: (end time, state there, step size to try next, True if stopped at switch_temp, number of rates() calls, list of steps for
+        _dense_values(), rates() at the end time or None if stopped at switch_temp)
+    """
+    n = len(state)
+    t = start
+    y = list(state)
+    if rate is None:
+        f = rates(t, y[0])
+        n_evaluations = 1
+    else:
+        f = rate
+        n_evaluations = 0
+    steps = list()
+    while t < end:
+        last = h >= end - t
+        if last:
+            h = end - t
+        rejected = False
+        while True:
+            k = [f]
+            for stage in range(1, 6):
+                a = _DP_A[stage]
+                temp = y[0] + h * sum(a[m] * k[m][0] for m in range(stage))
+                k.append(rates(t + _DP_C[stage] * h, temp))
+            y_new = [y[j] + h * sum(_DP_B[m] * k[m][j] for m in range(6)) for j in range(n)]
+            f_new = rates(t + h, y_new[0])
+            k.append(f_new)
+            n_evaluations += 6
+            error = (sum((h * sum(_DP_E[m] * k[m][j] for m in range(7)) / (RK_ATOL + max(abs(y[j]), abs(y_new[j])) * RK_RTOL)) ** 2
+                         for j in range(n)) / n) ** 0.5
+            if error < 1:
+                factor = 10 if error == 0 else min(10, 0.9 * error ** -0.2)
+                if rejected:
+                    factor = min(1, factor)
+                break
+            h *= max(0.2, 0.9 * error ** -0.2)
+            rejected = True
+            last = False
+        q = [[sum(k[m][j] * _DP_P[m][c] for m in range(7)) for c in range(4)] for j in range(n)]
+
+        if switch_temp is not None and ((direction > 0 and y[0] < switch_temp <= y_new[0]) or
+                                        (direction < 0 and y[0] > switch_temp >= y_new[0])):
+            # locate the crossing on the step's continuous extension
+            q_0, y_0 = q[0], y[0]
+            x = brentq(lambda x: y_0 + h * x * (q_0[0] + x * (q_0[1] + x * (q_0[2] + x * q_0[3]))) - switch_temp, 0, 1, xtol=1e-12)
+            t_switch = t + x * h
+            steps.append((t, t_switch, h, y, q))
+            y = [y[j] + h * x * (q[j][0] + x * (q[j][1] + x * (q[j][2] + x * q[j][3]))) for j in range(n)]
+            y[0] = switch_temp
+            return t_switch, y, h, True, n_evaluations, steps, None
+
+        steps.append((t, end if last else t + h, h, y, q))
+        t = end if last else t + h
+        y = y_new
+        f = f_new
+        h *= factor
+    return t, y, h, False, n_evaluations, steps, f
+
+
+def _dense_values(steps, times):
+    """
+    Values of an adaptive solution from _dp45() at the given times.
+
+    :param steps: steps from one or more consecutive _dp45() calls, covering the times
+    :param times: increasing times (hours)
+    :return: list for each time of the state there
+    """
+    values = list()
+    ix = 0
+    for time in times:
+        # a time at the end of a step is taken from the start of the next, so that energies don't pick up rounding noise across a segment
+        # boundary, e.g. a heating off step appearing to use a tiny amount of electricity
+        while ix < len(steps) - 1 and time >= steps[ix][1]:
+            ix += 1
+        start, _, h, y, q = steps[ix]
+        x = (time - start) / h
+        values.append([y[j] + h * x * (q[j][0] + x * (q[j][1] + x * (q[j][2] + x * q[j][3]))) for j in range(len(y))])
+    return values
 
 
 class RoomTempSolver:
-    def __init__(self, building_parameters, cop_option, amb_option, target_temps_hourly, passive_heat=0, initial_temp=16, steps_per_hour=6):
+    INTEGRATORS = ("euler", "rk45")
+    # limit on thermostat switches located within one time step, against chattering with very coarse steps
+    MAX_EVENTS_PER_STEP = 4
+
+    def __init__(self, building_parameters, cop_option, amb_option, target_temps_hourly, passive_heat=0, initial_temp=16, steps_per_hour=6, lwt=None,
+                 recording="full", event_location=False, integrator="euler"):
         """
         Computes room temperature against time and associated performance statistics for a target set of room temperatures, given
         building, ambient outside temperatures (varying with time), and heat pump properties.
@@ -18,21 +148,43 @@ class RoomTempSolver:
         :param passive_heat: passive heating (people, computers, etc) in W
         :param initial_temp: starting temp
         :param steps_per_hour: number of steps per hour in the solver and for the iter_* variables.
+        :param lwt: if set, overrides the LWT of the cop_option. COPs are then interpolated between the options for the same heat pump at
+            different LWTs (see get_cop_family())
+        :param recording: one of RECORDING_LEVELS. Below "full", cops and iter_elec_used are None, and the results are in the running totals
+        :param event_location: if True, thermostat switching is located within a time step: the step is split where the room temp crosses
+            the switch on/off temp, rather than the switch waiting for the next step. Switch times then don't snap to the step grid, so coarse
+            steps give nearly the same answer as fine ones. A step with the heating on for any part of it has a COP in cops
+        :param integrator: "euler" steps at 1/steps_per_hour. "rk45" integrates the day with adaptive steps (the Dormand-Prince Runge-Kutta 4(5)
+            pair, with error control, as scipy's RK45; see _dp45()), with thermostat switching located as events and the ambient temp varying within steps; the results are
+            then resampled onto times. steps_per_hour only sets that output grid. The electricity and heat emitted are integrated alongside
+            the room temp, so the totals aren't limited by the grid. A step's COP is its mean, i.e. heat emitted / electricity used
         """
+        if integrator not in self.INTEGRATORS:
+            raise ValueError(f"integrator must be one of {self.INTEGRATORS}")
+        self.integrator = integrator
+        if recording not in RECORDING_LEVELS:
+            raise ValueError(f"recording must be one of {RECORDING_LEVELS}")
+        self.recording = recording
         cop_defn = get_cop_point_options()[cop_option]
         amb_defn = get_ambient_hr_options()[amb_option]
+        self.lwt = cop_defn["LWT"] if lwt is None else lwt
 
         # building setup
         self.heat_loss_factor = building_parameters["heat_loss_factor"]
-        self.emitter = Radiator(building_parameters["emitter_std_power"], cop_defn["LWT"] - cop_defn["dT"] / 2)
+        self.emitter = Radiator(building_parameters["emitter_std_power"], self.lwt - cop_defn["dT"] / 2)
         self.heat_capacity = building_parameters["tmp"] * building_parameters["floor_area"] / 3.6  # Watt.hours per Kelvin
 
         # other setup
         self.steps_per_hour = steps_per_hour
         self.time_step_duration = 1 / steps_per_hour
         self.hysteresis = 0.5  # interval between on and off temps for a given target
-        self.cop_model = COP(cop_defn["T_amb"], cop_defn["COP"])
+        if lwt is None:
+            self.cop_model = COP(cop_defn["T_amb"], cop_defn["COP"])
+        else:
+            cop_defns = get_cop_point_options()
+            self.cop_model = COPSurface([cop_defns[k] for k in get_cop_family(cop_option)]).at_lwt(lwt)
         self.passive_heat = passive_heat
+        self.event_location = event_location
 
         # current state
         self.heating_on = False
@@ -41,15 +193,30 @@ class RoomTempSolver:
         # time series after last iteration. lists of length 24 * steps_per_hour
         iter_steps = 24 * steps_per_hour
         self.iter_room_temp = [initial_temp] * iter_steps  # used to record temps at each iteration to check for convergence
-        self.iter_elec_used = [0] * iter_steps
+        self.iter_elec_used = [0] * iter_steps if recording == "full" else None
 
         # Convenient to get a list of ambient temperatures etc to match the iter_* data. Used internally and useful for plotting
         amb_model = AmbientTemps(amb_defn)
         target_temp_lookup = TargetTemp(target_temps_hourly)
+        self.amb_model = amb_model  # for integrator="rk45"
+        self._rk_functions = None  # plain functions for rk45's rates, made on first use
+        self._rk_step = RK_FIRST_STEP
+        self.target_temps_hourly = list(target_temps_hourly)
         self.times = list(np.arange(0, 24, 1 / steps_per_hour))
         self.ambient_temps = [amb_model.temp(hr) for hr in self.times]
-        self.cops = list()  # this gets updated each iteration so that NAs are applied when the heating is not on. THIS IS RELIED ON in Dash app
+        self.step_cops = [self.cop_model.cop(amb) for amb in self.ambient_temps]  # COP at each step's ambient temp, the same every iteration
+        self.cops = list() if recording == "full" else None  # this gets updated each iteration so that NAs are applied when the heating is not on. THIS IS RELIED ON in Dash app
         self.target_temps = [target_temp_lookup.temp(hr) for hr in self.times]
+        self.switch_events = list()  # recording="events" only
+
+        # running totals for the last iteration, at every recording level
+        self.elec_used_total = 0  # Watt.hours
+        self.heat_emitted_total = 0  # Watt.hours
+        self.cop_total = 0  # sum of the COPs of the steps with the heating on, for mean_cop()
+        self.on_steps = 0
+        self._starts = 0  # off -> on switches within the day, see n_starts()
+        self._first_step_on = False
+        self._last_step_on = False
 
         # use as a "result" and to assess convergence
         self.full_day_energy = 0  # kWh
@@ -62,16 +229,23 @@ class RoomTempSolver:
         self.mean_t_iter_delta = 99
         # and an iteration counter for non-convergence exit
         self.n_iterations = 0
+        # evaluations of the room temp's rate of change, over all iterations: one per step for euler (more with event_location)
+        self.n_rhs_evaluations = 0
 
     def iterate(self):
+        if self.integrator == "rk45":
+            self._iterate_adaptive()
+            return
         max_t_iter_delta = 0
         sum_t_iter_delta = 0
         self.n_iterations += 1
-        self.cops = list()
+        if not self.event_location:  # _located_step() counts its own
+            self.n_rhs_evaluations += len(self.times)
+        self._start_recording()
 
         for ix, hr in enumerate(self.times):
             amb = self.ambient_temps[ix]
-            cop = self.cop_model.cop(amb)
+            cop = self.step_cops[ix]
             target = self.target_temps[ix]
             t = self.current_temp
 
@@ -81,36 +255,243 @@ class RoomTempSolver:
                 if not self.heating_on:
                     self.heating_on = target - t > self.hysteresis / 2
 
-            # heat loss and supplied by emitter
-            lost = self.heat_loss_factor * (self.current_temp - amb) * self.time_step_duration
-            if self.heating_on:
-                self.cops.append(cop)
-                emitted = self.emitter.output(t) * self.time_step_duration  # Watt.hours
-                elec_used = emitted / cop
+            if self.event_location:
+                # target changes are on the hour, so always at a step boundary, where they are handled above
+                self.current_temp, emitted, heating_was_on = self._located_step(t, amb, target)
+                if heating_was_on:
+                    elec_used = emitted / cop
+                else:
+                    cop = None
+                    elec_used = 0
             else:
-                self.cops.append(None)
-                emitted = 0
-                elec_used = 0
-
-            room_temp_change = (emitted - lost + self.passive_heat * self.time_step_duration) / self.heat_capacity
-            self.current_temp += room_temp_change
+                # heat loss and supplied by emitter
+                lost = self.heat_loss_factor * (self.current_temp - amb) * self.time_step_duration
+                if self.heating_on:
+                    emitted = self.emitter.output(t) * self.time_step_duration  # Watt.hours
+                    elec_used = emitted / cop
+                else:
+                    cop = None
+                    emitted = 0
+                    elec_used = 0
+
+                room_temp_change = (emitted - lost + self.passive_heat * self.time_step_duration) / self.heat_capacity
+                self.current_temp += room_temp_change
             room_temp_iter_delta = fabs(self.iter_room_temp[ix] - self.current_temp)
             max_t_iter_delta = max(max_t_iter_delta, room_temp_iter_delta)
             sum_t_iter_delta += room_temp_iter_delta
 
             self.iter_room_temp[ix] = self.current_temp
-            self.iter_elec_used[ix] = elec_used
+            self._record_step(ix, hr, cop, elec_used, emitted)
+
+        self.max_t_iter_delta = max_t_iter_delta
+        self.mean_t_iter_delta = sum_t_iter_delta / len(self.times)
+
+        energy_kwh = self.elec_used_total / 1000
+        self.full_day_energy_delta = fabs(self.full_day_energy - energy_kwh)
+        self.full_day_energy = energy_kwh
+
+    def _located_step(self, t, amb, target):
+        """
+        One Euler step, split where the room temp crosses the thermostat switch off (heating on) or switch on (heating off) temp. The room
+        temp is linear within each part, so the crossing time is exact for the step; the rest of the step is then stepped with the
+        heating switched, from the switch temp. Updates heating_on.
+
+        :return: (room temp at the end of the step, W.h emitted, True if the heating was on for any of the step)
+        """
+        remaining = self.time_step_duration
+        emitted = 0
+        was_on = self.heating_on
+        for _ in range(self.MAX_EVENTS_PER_STEP):
+            self.n_rhs_evaluations += 1
+            power = self.emitter.output(t) if self.heating_on else 0
+            rate = (power - self.heat_loss_factor * (t - amb) + self.passive_heat) / self.heat_capacity  # K per hour
+            t_end = t + rate * remaining
+            if self.heating_on:
+                switch_temp = target + self.hysteresis / 2
+                crossed = t_end >= switch_temp
+            else:
+                switch_temp = target - self.hysteresis / 2
+                crossed = t_end < switch_temp
+            if not crossed or rate == 0:
+                return t_end, emitted + power * remaining, was_on
+            # the switch is part way through the step
+            duration = (switch_temp - t) / rate
+            emitted += power * duration
+            remaining -= duration
+            t = switch_temp
+            self.heating_on = not self.heating_on
+            was_on = was_on or self.heating_on
+
+        # chattering: finish the step without further switching
+        power = self.emitter.output(t) if self.heating_on else 0
+        rate = (power - self.heat_loss_factor * (t - amb) + self.passive_heat) / self.heat_capacity
+        return t + rate * remaining, emitted + power * remaining, was_on
+
+    def _iterate_adaptive(self):
+        """
+        iterate() for integrator="rk45". The day is integrated in segments with the heating on or off throughout: each segment ends at the
+        next change of target temp or when the room temp reaches the switch temp (an event), after which the thermostat is applied as at
+        the start of a step. The state is the room temp with the cumulative heat emitted and electricity used (W.h). The cost is about
+        7 rate evaluations per segment, i.e. per thermostat switch, whatever steps_per_hour is: a segment is mostly a single step.
+
+        switch_events (recording="events") are at the located switch times rather than the start of the step they fall in.
+        """
+        max_t_iter_delta = 0
+        sum_t_iter_delta = 0
+        self.n_iterations += 1
+        self._start_recording()
+
+        if self._rk_functions is None:
+            self._rk_functions = (self.amb_model.temp_function(), self.cop_model.cop_function(), self.emitter.output)
+        amb_temp, cop, output = self._rk_functions
+        heat_loss_factor, heat_capacity, passive_heat = self.heat_loss_factor, self.heat_capacity, self.passive_heat
+
+        def rates_on(hr, room_temp):
+            amb = amb_temp(hr)
+            power = output(room_temp)
+            return (power - heat_loss_factor * (room_temp - amb) + passive_heat) / heat_capacity, power, power / cop(amb)
+
+        def rates_off(hr, room_temp):
+            return (passive_heat - heat_loss_factor * (room_temp - amb_temp(hr))) / heat_capacity, 0.0, 0.0
+
+        hourly = self.target_temps_hourly
+        target_changes = [hr for hr in range(1, 24) if hourly[hr] != hourly[hr - 1]] + [24]
+        steps = list()
+        events = list()
+        state = [self.current_temp, 0.0, 0.0]
+        start = 0.0
+        rate = None  # at the end of the last segment, reused for the next if the heating stays the same (FSAL)
+        while start < 24:
+            target = hourly[int(start)]
+            t = state[0]
+            if t >= target + self.hysteresis / 2:
+                self.heating_on = False
+            else:
+                if not self.heating_on:
+                    self.heating_on = target - t > self.hysteresis / 2
+            heating_on = self.heating_on
+            switch_temp = target + self.hysteresis / 2 if heating_on else target - self.hysteresis / 2
+            if not events or events[-1][1] != heating_on:
+                events.append((float(start), heating_on))
+                rate = None
+
+            # to the next change of target temp, or until the room temp rises to the switch off temp, or falls to the switch on temp
+            end = next(hr for hr in target_changes if hr > start)
+            start, state, self._rk_step, switched, n_evaluations, segment_steps, rate = _dp45(
+                rates_on if heating_on else rates_off, start, end, state, self._rk_step, switch_temp, 1 if heating_on else -1, rate)
+            self.n_rhs_evaluations += n_evaluations
+            steps.extend(segment_steps)
+            if switched:
+                self.heating_on = not heating_on
+        self.current_temp = float(state[0])
+
+        # resample onto the step grid: room temps at the END of each step, as for euler, and energies within each step
+        step_ends = [(ix + 1) / self.steps_per_hour for ix in range(len(self.times))]  # exact at the hours, where targets change
+        emitted_to = elec_to = 0.0
+        for ix, (hr, (room_temp, emitted, elec)) in enumerate(zip(self.times, _dense_values(steps, step_ends))):
+            room_temp_iter_delta = fabs(self.iter_room_temp[ix] - room_temp)
+            max_t_iter_delta = max(max_t_iter_delta, room_temp_iter_delta)
+            sum_t_iter_delta += room_temp_iter_delta
+            self.iter_room_temp[ix] = room_temp
+            emitted_step, elec_step = emitted - emitted_to, elec - elec_to
+            emitted_to, elec_to = emitted, elec
+            self._record_step(ix, hr, emitted_step / elec_step if elec_step > 0 else None, elec_step, emitted_step)
+        if self.recording == "events":
+            self.switch_events = events
 
         self.max_t_iter_delta = max_t_iter_delta
         self.mean_t_iter_delta = sum_t_iter_delta / len(self.times)
 
-        energy_kwh = sum(self.iter_elec_used) / 1000
+        energy_kwh = self.elec_used_total / 1000
         self.full_day_energy_delta = fabs(self.full_day_energy - energy_kwh)
         self.full_day_energy = energy_kwh
 
+    def _start_recording(self):
+        """Reset the per-iteration series and running totals at the start of an iteration"""
+        if self.recording == "full":
+            self.cops = list()
+        self.switch_events = list()
+        self.elec_used_total = 0
+        self.heat_emitted_total = 0
+        self.cop_total = 0
+        self.on_steps = 0
+        self._starts = 0
+
+    def _record_step(self, ix, hr, cop, elec_used, emitted):
+        """
+        Add a step to the running totals and, depending on the recording level, to the series or switch events.
+
+        :param cop: None if the heating was off
+        :param elec_used: W.h
+        :param emitted: W.h
+        """
+        on = cop is not None
+        self.elec_used_total += elec_used
+        self.heat_emitted_total += emitted
+        if on:
+            self.cop_total += cop
+            self.on_steps += 1
+        if ix == 0:
+            self._first_step_on = on
+        elif on and not self._last_step_on:
+            self._starts += 1
+        if self.recording == "full":
+            self.cops.append(cop)
+            self.iter_elec_used[ix] = elec_used
+        elif self.recording == "events" and (ix == 0 or on != self._last_step_on):
+            self.switch_events.append((hr, on))
+        self._last_step_on = on
+
+    def warm_start(self, times, room_temps, heating_on=None, full_day_energy=None):
+        """
+        Start from a (nearly) periodic state from another run, e.g. at a different resolution or LWT, rather than from initial_temp.
+        The temps are interpolated onto this solver's time steps.
+
+        :param times: times (hours) of the other run's steps
+        :param room_temps: the other run's iter_room_temp, i.e. temps at the END of each step
+        :param heating_on: heating state at the end of the other run's day
+        :param full_day_energy: the other run's result. If given, the first iteration's full_day_energy_delta is relative to this, so a good
+            warm start can converge in a single iteration
+        """
+        other_step = times[1] - times[0] if len(times) > 1 else 24
+        step_end_times = [t + self.time_step_duration for t in self.times]
+        self.iter_room_temp = list(np.interp(step_end_times, [t + other_step for t in times], room_temps, period=24))
+        self.current_temp = self.iter_room_temp[-1]
+        if heating_on is not None:
+            self.heating_on = heating_on
+        if full_day_energy is not None:
+            self.full_day_energy = full_day_energy
+
+    def comfort_shortfall(self, recovery_hours=0):
+        """
+        Degree-hours (K.h) by which the room temp was below the thermostat switch-on point (target - hysteresis/2) over the last iteration.
+        0 means the target schedule was held throughout.
+
+        :param recovery_hours: ignore this many hours after each increase in target temp, to allow for warming up
+        """
+        recovery_steps = int(round(recovery_hours * self.steps_per_hour))
+        shortfall = 0
+        steps_since_increase = recovery_steps
+        for ix, (target, t) in enumerate(zip(self.target_temps, self.iter_room_temp)):
+            steps_since_increase = 0 if target > self.target_temps[ix - 1] else steps_since_increase + 1
+            if steps_since_increase >= recovery_steps:
+                shortfall += max(target - self.hysteresis / 2 - t, 0)
+        return shortfall * self.time_step_duration
+
+    def n_starts(self):
+        """Number of times the heating switched on in the last iteration, treating the day as periodic."""
+        return self._starts + (1 if self._first_step_on and not self._last_step_on else 0)
+
+    def mean_cop(self):
+        """Mean COP over the steps with the heating on in the last iteration. None if it was never on"""
+        return self.cop_total / self.on_steps if self.on_steps else None
+
 
 class CyclingSolver:
-    def __init__(self, building_parameters, cop_option, lwt, hp_capacity, initial_temp, lwt_overshoot=4, steps_per_minute=5):
+    INTEGRATORS = ("euler", "backward_euler", "trapezoidal")
+
+    def __init__(self, building_parameters, cop_option, lwt, hp_capacity, initial_temp, lwt_overshoot=4, steps_per_minute=5, integrator="euler",
+                 recording="full"):
         """
         Computes HP on/off cycles and system fluid temp (actual LWT) against time and associated performance statistics for a variable HP capacity and max LWT,
         given building, fixed ambient outside temperatures, and heat pump properties.
@@ -124,7 +505,17 @@ class CyclingSolver:
         :param hp_capacity: output power in Watts of the HP
         :param initial_temp: starting room temp
         :param steps_per_minute: number of steps per minute in the solver and for the iter_* variables.
+        :param integrator: how the coupled water and room temps are stepped. "euler" is explicit (original behaviour); with a small fluid volume
+            and a large emitter the water temp is stiff and needs small steps to stay stable. "backward_euler" and "trapezoidal" are linearly
+            implicit (one Newton step on the emitter output per time step) and stay stable with much larger steps.
+        :param recording: one of RECORDING_LEVELS. Below "full", the times_mins, mean_water_temp and cycle_* series stay empty, and the
+            results are in the running totals, on_duration and off_duration
         """
+        if integrator not in self.INTEGRATORS:
+            raise ValueError(f"integrator must be one of {self.INTEGRATORS}")
+        if recording not in RECORDING_LEVELS:
+            raise ValueError(f"recording must be one of {RECORDING_LEVELS}")
+        self.recording = recording
         cop_defn = get_cop_point_options(vs="lwt")[cop_option]
         self.cop_model = COP(cop_defn["LWT"], cop_defn["COP"])
         self.ambient_temp = cop_defn["T_amb"]
@@ -141,6 +532,7 @@ class CyclingSolver:
         self.lwt = lwt  # this is the desired, not necessarily the actual lwt
         self.hp_capacity = hp_capacity
         self.lwt_overshoot = lwt_overshoot  # difference above max_lwt at which the HP will switch off.
+        self.integrator = integrator
 
         # current state
         self.cycle_start_room_temp = initial_temp  # this is a chosen parameter. Preserved across iterations
@@ -153,14 +545,23 @@ class CyclingSolver:
         self.cycle_cop = list()  # COP based on the flow temp at the start of the step
         self.cycle_room_temp = list()
         self.cycle_emitter_output = list()
+        self.switch_events = list()  # (mins into cycle, heating_on). recording="events" only
         # aggregate for cycle
         self.on_duration = None
         self.off_duration = None
+        self.n_steps = 0
+        self.elec_used_total = 0  # W.h
+        self.heat_emitted_total = 0  # W.h
+        self.cop_total = 0  # sum of the COPs of the steps with the HP on, for mean_cop()
+        self.on_steps = 0
 
         # use to test for convergence. These are ABSOLUTE changes, i.e. |delta|
         self.iter_room_temp_delta = 99
         # and an iteration counter for non-convergence exit
         self.n_iterations = 0
+        # set by solve_limit_cycle()
+        self.n_cycle_simulations = 0
+        self.limit_cycle_converged = False
 
     def iterate(self):
         """
@@ -175,9 +576,15 @@ class CyclingSolver:
         self.cycle_cop = list()
         self.cycle_room_temp = list()
         self.cycle_emitter_output = list()
+        self.switch_events = [(0, True)] if self.recording == "events" else list()
         # reset to None so they can be used to detect exceeding max steps
         self.on_duration = None  # minutes
         self.off_duration = None
+        self.elec_used_total = 0
+        self.heat_emitted_total = 0
+        self.cop_total = 0
+        self.on_steps = 0
+        full = self.recording == "full"
 
         room_temp = self.cycle_start_room_temp
         mean_water_temp = self.lwt - self.ht_dT / 2
@@ -186,55 +593,138 @@ class CyclingSolver:
         step = 0
         # NB unit of time in steps is seconds self.time_step_secs
         while step < self.max_steps:
-            self.times_mins.append(step * self.time_step_secs / 60)
+            if full:
+                self.times_mins.append(step * self.time_step_secs / 60)
+                self.mean_water_temp.append(mean_water_temp)
+                self.cycle_room_temp.append(room_temp)
             step += 1
-            self.mean_water_temp.append(mean_water_temp)
-            self.cycle_room_temp.append(room_temp)
             # HP input
             if heating_on:
                 cop = self.cop_model.cop(mean_water_temp + self.ht_dT / 2)
                 energy_to_fluid = self.time_step_secs * self.hp_capacity  # Joules
-                self.cycle_cop.append(cop)
-                self.cycle_elec_used.append(energy_to_fluid / 3600 / cop)
+                elec_used = energy_to_fluid / 3600 / cop
+                self.cop_total += cop
+                self.on_steps += 1
             else:
                 energy_to_fluid = 0
-                self.cycle_cop.append(None)
-                self.cycle_elec_used.append(0)  # to Watt.hours
+                cop = None
+                elec_used = 0  # to Watt.hours
+            self.elec_used_total += elec_used
             # Emitter to room. Use of flow temp from start should be OK if time steps small enough
             emitter_output = self.emitter.output(room_temp, mean_water_temp)
-            energy_from_fluid = self.time_step_secs * emitter_output
-            self.cycle_emitter_output.append(emitter_output)
+            self.heat_emitted_total += emitter_output * self.time_step_secs / 3600
+            if full:
+                self.cycle_cop.append(cop)
+                self.cycle_elec_used.append(elec_used)
+                self.cycle_emitter_output.append(emitter_output)
 
-            # update flow temp
-            mean_water_temp += (energy_to_fluid - energy_from_fluid) / (4.2 * self.fluid_volume * 1000)
+            if self.integrator == "euler":
+                energy_from_fluid = self.time_step_secs * emitter_output
 
-            # update room temperature. NB these are in Watt.hours
-            room_lost = self.heat_loss_factor * (room_temp - self.ambient_temp) * self.time_step_secs / 3600
-            room_gained = energy_from_fluid / 3600
-            room_temp_change = (room_gained - room_lost) / self.heat_capacity
-            room_temp += room_temp_change
+                # update flow temp
+                mean_water_temp += (energy_to_fluid - energy_from_fluid) / (4.2 * self.fluid_volume * 1000)
+
+                # update room temperature. NB these are in Watt.hours
+                room_lost = self.heat_loss_factor * (room_temp - self.ambient_temp) * self.time_step_secs / 3600
+                room_gained = energy_from_fluid / 3600
+                room_temp_change = (room_gained - room_lost) / self.heat_capacity
+                room_temp += room_temp_change
+            else:
+                mean_water_temp, room_temp = self._implicit_step(mean_water_temp, room_temp, emitter_output, energy_to_fluid)
 
             # check if the max LWT was reached => turn compressor off
             if mean_water_temp + self.ht_dT / 2 > self.lwt + self.lwt_overshoot:
                 heating_on = False
                 self.on_duration = step * self.time_step_secs / 60
+                if self.recording == "events":
+                    self.switch_events.append((self.on_duration, False))
             # if the heating is off and we've got below the desired, the cycle has ended
             elif (mean_water_temp + self.ht_dT / 2 < self.lwt) and not heating_on:
-                print(f"Cycle ended after {step} steps")
+                logging.debug(f"Cycle ended after {step} steps")
                 self.off_duration = step * self.time_step_secs / 60 - self.on_duration
                 break
 
         if step == self.max_steps:
-            print("Reached MAX STEPS!")
+            logging.warning("CyclingSolver reached MAX STEPS without completing a cycle")
+        self.n_steps = step
 
         # these will be bad if exit was due to max steps being reached
         self.iter_room_temp_delta = fabs(self.cycle_start_room_temp - room_temp)
         self.cycle_start_room_temp = room_temp
 
+    def mean_cop(self):
+        """Mean COP over the steps with the HP on in the last cycle. None if it was never on"""
+        return self.cop_total / self.on_steps if self.on_steps else None
+
+    def solve_limit_cycle(self, tolerance=0.001, max_cycles=20):
+        """
+        Find the self-consistent (periodic) cycle, where the room temp at the end of the cycle equals that at the start, so the result no
+        longer depends on initial_temp. The water state needs no search: every cycle starts, and ends, with the mean water temp at the
+        restart point for the LWT. So this is shooting on the start room temp alone, r(T) = end temp - T = 0, using secant updates.
+
+        As the room's time constant is hours and a cycle is minutes, r is almost linear in T and plain repetition of iterate() would take
+        very many cycles; the secant method typically needs 5 or 6. r is slightly jagged, as the switching times are whole steps, so the
+        limit cycle room temp is only as precise as steps_per_minute allows (a few hundredths of a K at 10). After return, the cycle_* series etc are those of the last cycle
+        simulated, i.e. of the limit cycle if it converged.
+
+        :param tolerance: |end - start| room temp (K) for convergence
+        :param max_cycles: limit on the number of cycle simulations
+        :return: True if converged. Also in self.limit_cycle_converged, with the number of cycles simulated in self.n_cycle_simulations
+        """
+        self.n_cycle_simulations = 0
+        self.limit_cycle_converged = False
+        previous = None  # (start temp, residual) of the previous cycle
+        while self.n_cycle_simulations < max_cycles:
+            start_temp = self.cycle_start_room_temp
+            self.iterate()
+            self.n_cycle_simulations += 1
+            if self.off_duration is None:  # no complete cycle (max_steps reached), so no meaningful residual
+                break
+            residual = self.cycle_start_room_temp - start_temp  # iterate() leaves the end temp in cycle_start_room_temp
+            if fabs(residual) <= tolerance:
+                # leave the start temp of the cycle which was simulated, i.e. the limit cycle
+                self.cycle_start_room_temp = start_temp
+                self.limit_cycle_converged = True
+                break
+            if previous is None or residual == previous[1]:
+                next_temp = start_temp + residual  # i.e. carry on from the end of the cycle
+            else:
+                next_temp = start_temp - residual * (start_temp - previous[0]) / (residual - previous[1])
+            previous = (start_temp, residual)
+            self.cycle_start_room_temp = next_temp
+        return self.limit_cycle_converged
+
+    def _implicit_step(self, mean_water_temp, room_temp, emitter_output, energy_to_fluid):
+        """
+        One linearly implicit step of the coupled water + room temps: y1 = y0 + (I - theta.h.J)^-1 . h.f(y0), with J the Jacobian of f.
+        theta = 1 is backward Euler (L-stable, first order), theta = 0.5 is the trapezoidal rule (A-stable, second order).
+        Units are seconds and Joules.
+
+        :return: (mean water temp, room temp) at the end of the step
+        """
+        theta = 1 if self.integrator == "backward_euler" else 0.5
+        h = self.time_step_secs
+        water_capacity = 4.2 * self.fluid_volume * 1000  # J/K
+        room_capacity = self.heat_capacity * 3600  # J/K
+        gradient = self.emitter.output_gradient(room_temp, mean_water_temp)  # W/K
+
+        f = np.array([
+            (energy_to_fluid / h - emitter_output) / water_capacity,
+            (emitter_output - self.heat_loss_factor * (room_temp - self.ambient_temp)) / room_capacity
+        ])
+        jacobian = np.array([
+            [-gradient / water_capacity, gradient / water_capacity],
+            [gradient / room_capacity, -(gradient + self.heat_loss_factor) / room_capacity]
+        ])
+        delta = np.linalg.solve(np.eye(2) - theta * h * jacobian, h * f)
+        return mean_water_temp + delta[0], room_temp + delta[1]
+
 
 # spin off from RoomTempSolver to avoid spaghetti code.
 class RoomTempSolver2:
-    def __init__(self, building_parameters, amb_option, lwt, dT=5, initial_temp=16, steps_per_hour=6):
+    INTEGRATORS = ("euler", "rk45")
+
+    def __init__(self, building_parameters, amb_option, lwt, dT=5, initial_temp=16, steps_per_hour=6, recording="full", integrator="euler"):
         """
         Simplified version of RoomTempSolver for a constant LWT. ie. no need for COP, target temps and heating on/off.
 
@@ -242,7 +732,16 @@ class RoomTempSolver2:
         :param amb_option: key into return from get_ambient_hr_options()
         :param initial_temp: starting temp
         :param steps_per_hour: number of steps per hour in the solver and for the iter_* variables.
+        :param recording: one of RECORDING_LEVELS. Below "full", energy_lost and energy_emitted stay empty, and the results are in the running
+            totals. There is no switching, so "events" is the same as "summary"
+        :param integrator: "euler" or "rk45", as for RoomTempSolver
         """
+        if integrator not in self.INTEGRATORS:
+            raise ValueError(f"integrator must be one of {self.INTEGRATORS}")
+        self.integrator = integrator
+        if recording not in RECORDING_LEVELS:
+            raise ValueError(f"recording must be one of {RECORDING_LEVELS}")
+        self.recording = recording
         amb_defn = get_ambient_hr_options()[amb_option]
 
         # building setup
@@ -263,12 +762,17 @@ class RoomTempSolver2:
 
         # Convenient to get a list of ambient temperatures etc to match the iter_* data. Used internally and useful for plotting
         amb_model = AmbientTemps(amb_defn)
+        self.amb_model = amb_model  # for integrator="rk45"
+        self._rk_functions = None  # plain functions for rk45's rates, made on first use
+        self._rk_step = RK_FIRST_STEP
         self.times = list(np.arange(0, 24, 1 / steps_per_hour))
         self.ambient_temps = [amb_model.temp(hr) for hr in self.times]
 
         # energy balance
         self.energy_lost = list()
         self.energy_emitted = list()
+        self.heat_lost_total = 0  # Watt.hours, at every recording level
+        self.heat_emitted_total = 0
 
         # use as a "result" and to assess convergence
         self.full_day_loss = 0  # kWh
@@ -281,14 +785,23 @@ class RoomTempSolver2:
         self.mean_t_iter_delta = 99
         # and an iteration counter for non-convergence exit
         self.n_iterations = 0
+        # evaluations of the room temp's rate of change, over all iterations: one per step for euler
+        self.n_rhs_evaluations = 0
 
     def iterate(self):
+        if self.integrator == "rk45":
+            self._iterate_adaptive()
+            return
         max_t_iter_delta = 0
         sum_t_iter_delta = 0
         self.n_iterations += 1
+        self.n_rhs_evaluations += len(self.times)
 
         self.energy_lost = list()
         self.energy_emitted = list()
+        self.heat_lost_total = 0
+        self.heat_emitted_total = 0
+        full = self.recording == "full"
 
         for ix, hr in enumerate(self.times):
             amb = self.ambient_temps[ix]
@@ -297,8 +810,11 @@ class RoomTempSolver2:
             # heat loss and supplied by emitter
             lost = self.heat_loss_factor * (self.current_temp - amb) * self.time_step_duration
             emitted = self.emitter.output(t) * self.time_step_duration  # Watt.hours
-            self.energy_lost.append(lost)
-            self.energy_emitted.append(emitted)
+            self.heat_lost_total += lost
+            self.heat_emitted_total += emitted
+            if full:
+                self.energy_lost.append(lost)
+                self.energy_emitted.append(emitted)
 
             room_temp_change = (emitted - lost) / self.heat_capacity
             self.current_temp += room_temp_change
@@ -311,6 +827,59 @@ class RoomTempSolver2:
         self.max_t_iter_delta = max_t_iter_delta
         self.mean_t_iter_delta = sum_t_iter_delta / len(self.times)
 
-        loss_kwh = sum(self.energy_lost) / 1000
+        loss_kwh = self.heat_lost_total / 1000
         self.full_day_loss_delta = fabs(self.full_day_loss - loss_kwh)
         self.full_day_loss = loss_kwh
+
+    def _iterate_adaptive(self):
+        """iterate() for integrator="rk45": the day in one adaptive integration, of the room temp with the cumulative heat lost and emitted"""
+        self.n_iterations += 1
+
+        if self._rk_functions is None:
+            self._rk_functions = (self.amb_model.temp_function(), self.emitter.output)
+        amb_temp, output = self._rk_functions
+        heat_loss_factor, heat_capacity = self.heat_loss_factor, self.heat_capacity
+
+        def rates(hr, room_temp):
+            lost = heat_loss_factor * (room_temp - amb_temp(hr))
+            emitted = output(room_temp)
+            return (emitted - lost) / heat_capacity, lost, emitted
+
+        _, state, self._rk_step, _, n_evaluations, steps, _ = _dp45(rates, 0.0, 24.0, [self.current_temp, 0.0, 0.0], self._rk_step)
+        self.n_rhs_evaluations += n_evaluations
+        self.current_temp = float(state[0])
+
+        # resample onto the step grid: room temps at the END of each step, as for euler, and energies within each step
+        room_temps, lost_to, emitted_to = np.array(_dense_values(steps, [(ix + 1) / self.steps_per_hour for ix in range(len(self.times))])).T
+        lost_steps = np.diff(lost_to, prepend=0.0)
+        emitted_steps = np.diff(emitted_to, prepend=0.0)
+        full = self.recording == "full"
+        self.energy_lost = [float(e) for e in lost_steps] if full else list()
+        self.energy_emitted = [float(e) for e in emitted_steps] if full else list()
+        self.heat_lost_total = float(lost_to[-1])
+        self.heat_emitted_total = float(emitted_to[-1])
+
+        iter_deltas = np.abs(np.array(self.iter_room_temp) - room_temps)
+        self.max_t_iter_delta = float(iter_deltas.max())
+        self.mean_t_iter_delta = float(iter_deltas.mean())
+        self.iter_room_temp = [float(t) for t in room_temps]
+
+        loss_kwh = self.heat_lost_total / 1000
+        self.full_day_loss_delta = fabs(self.full_day_loss - loss_kwh)
+        self.full_day_loss = loss_kwh
+
+    def warm_start(self, times, room_temps, full_day_loss=None):
+        """
+        Start from a (nearly) periodic state from another run, e.g. at a coarser resolution, rather than from initial_temp.
+        As for RoomTempSolver.warm_start().
+
+        :param times: times (hours) of the other run's steps
+        :param room_temps: the other run's iter_room_temp, i.e. temps at the END of each step
+        :param full_day_loss: the other run's result. If given, the first iteration's full_day_loss_delta is relative to this
+        """
+        other_step = times[1] - times[0] if len(times) > 1 else 24
+        step_end_times = [t + self.time_step_duration for t in self.times]
+        self.iter_room_temp = list(np.interp(step_end_times, [t + other_step for t in times], room_temps, period=24))
+        self.current_temp = self.iter_room_temp[-1]
+        if full_day_loss is not None:
+            self.full_day_loss = full_day_loss
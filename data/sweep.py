@@ -0,0 +1,158 @@
+"""
+Sweeps of the Room Temp Solver across the config options, with the per-step trajectories written to a TrajectoryStore
+(data/result_store.py) as each scenario is solved rather than kept in memory, and analysis which reads them back lazily.
+
+Usage:
+    python -m data.sweep run <store directory> [--steps-per-hour 12] [--engine reference] [--cop-options ...] [--amb-options ...]
+    python -m data.sweep profile <store directory> [--field room_temp] [--cop-option ...] [--amb-option ...] [--target ...] [--building ...]
+"""
+import argparse
+import os
+
+import numpy as np
+
+from config import get_building_default_options, get_tmp_options, get_cop_point_options, get_ambient_hr_options, get_target_temp_options
+from data.engines import DEFAULT_ENGINE, solve
+from data.result_store import TrajectoryStore, scenario_key
+
+# Result series written for each scenario
+FIELDS = ("room_temp", "ambient_temp", "elec_used", "cop")
+# scenarios between flushes of the store, so an interrupted sweep loses little
+FLUSH_EVERY = 100
+
+
+def sweep_scenarios(building_options=None, cop_options=None, amb_options=None, target_options=None, steps_per_hour=12):
+    """
+    Every combination of the options, each defaulting to all of them.
+
+    :param building_options: keys into get_building_default_options()
+    :param cop_options: keys into get_cop_point_options(). Options whose point lists don't pair up are left out of the default
+    :param amb_options: keys into get_ambient_hr_options()
+    :param target_options: keys into get_target_temp_options()
+    :return: list of (key, meta, room_temp engine config), where meta has the option names
+    """
+    buildings = get_building_default_options()
+    targets = get_target_temp_options()
+    if cop_options is None:
+        cop_options = [k for k, v in get_cop_point_options().items() if len(v["T_amb"]) == len(v["COP"])]
+    scenarios = list()
+    for building in building_options or list(buildings):
+        building_params = dict(buildings[building])
+        building_params["tmp"] = get_tmp_options()[building_params.pop("tmp_category")]
+        for cop_option in cop_options:
+            for amb_option in amb_options or list(get_ambient_hr_options()):
+                for target in target_options or list(targets):
+                    meta = {"building": building, "cop_option": cop_option, "amb_option": amb_option, "target": target,
+                            "steps_per_hour": steps_per_hour}
+                    config = {"kind": "room_temp", "building": building_params, "cop_option": cop_option, "amb_option": amb_option,
+                              "target_temps_hourly": list(targets[target]), "steps_per_hour": steps_per_hour}
+                    scenarios.append((scenario_key(**meta), meta, config))
+    return scenarios
+
+
+def _json_safe(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def run_sweep(directory, scenarios, engine=DEFAULT_ENGINE, progress=None):
+    """
+    Solve each scenario and write its trajectories (FIELDS) to the store in directory, with the options and the Result summary as the
+    row's metadata. Scenarios already in the store are skipped, so an interrupted sweep can be re-run to finish it.
+
+    :param scenarios: from sweep_scenarios(), all at the same steps_per_hour
+    :param progress: optional function(n_done, n_scenarios)
+    :return: the store, opened for writing
+    """
+    n_steps = 24 * scenarios[0][2]["steps_per_hour"]
+    if os.path.exists(os.path.join(directory, TrajectoryStore.INDEX_FILE)):
+        store = TrajectoryStore(directory, mode="r+")
+        if store.n_steps != n_steps or list(store.fields) != list(FIELDS):
+            raise ValueError(f"The store in {directory} has {store.n_steps} steps of {store.fields}; the sweep needs {n_steps} steps of {FIELDS}")
+        if store.n_rows < len(set(store.keys()) | {key for key, _, _ in scenarios}):
+            raise ValueError(f"The store in {directory} only has room for {store.n_rows} scenarios")
+    else:
+        store = TrajectoryStore.create(directory, len(scenarios), n_steps, FIELDS)
+
+    for ix, (key, meta, config) in enumerate(scenarios):
+        if key not in store:
+            result = solve(config, engine)
+            summary = {k: _json_safe(v) for k, v in result.summary.items()}
+            store.write(key, meta=dict(meta, **summary), **{field: getattr(result, field) for field in FIELDS})
+            if (ix + 1) % FLUSH_EVERY == 0:
+                store.flush()
+        if progress is not None:
+            progress(ix + 1, len(scenarios))
+    store.flush()
+    return store
+
+
+def select(store, **options):
+    """Keys of the scenarios whose metadata matches all the options, e.g. select(store, amb_option="Winter")"""
+    return [key for key in store.keys() if all(store.metadata(key).get(k) == v for k, v in options.items())]
+
+
+def profile(store, field="room_temp", keys=None):
+    """
+    Per-step minimum, mean and maximum of a field across scenarios. Reads one scenario's view at a time, so memory is O(steps) however
+    many scenarios there are. NaN (e.g. the COP with the heating off) is left out.
+
+    :param keys: scenarios to include. Default is all
+    :return: dict with "n_scenarios" and per-step arrays "min", "mean", "max"
+    """
+    keys = store.keys() if keys is None else keys
+    low = np.full(store.n_steps, np.inf)
+    high = np.full(store.n_steps, -np.inf)
+    total = np.zeros(store.n_steps)
+    count = np.zeros(store.n_steps)
+    for key in keys:
+        values = store.read(key, field)
+        present = ~np.isnan(values)
+        n = len(values)
+        low[:n] = np.where(present, np.fmin(low[:n], values), low[:n])
+        high[:n] = np.where(present, np.fmax(high[:n], values), high[:n])
+        total[:n] += np.where(present, values, 0)
+        count[:n] += present
+    with np.errstate(invalid="ignore"):
+        mean = total / count
+    empty = count == 0
+    low[empty] = np.nan
+    high[empty] = np.nan
+    return {"n_scenarios": len(keys), "min": low, "mean": mean, "max": high}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep the Room Temp Solver across config options into a trajectory store, or analyse one")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run")
+    run_parser.add_argument("directory")
+    run_parser.add_argument("--steps-per-hour", type=int, default=12)
+    run_parser.add_argument("--engine", default=DEFAULT_ENGINE)
+    run_parser.add_argument("--buildings", nargs="+", help="default: all")
+    run_parser.add_argument("--cop-options", nargs="+", help="default: all")
+    run_parser.add_argument("--amb-options", nargs="+", help="default: all")
+    run_parser.add_argument("--targets", nargs="+", help="default: all")
+    profile_parser = subparsers.add_parser("profile")
+    profile_parser.add_argument("directory")
+    profile_parser.add_argument("--field", default="room_temp", choices=FIELDS)
+    for option in ("building", "cop_option", "amb_option", "target"):
+        profile_parser.add_argument("--" + option.replace("_", "-"), dest=option)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        sweep = sweep_scenarios(args.buildings, args.cop_options, args.amb_options, args.targets, args.steps_per_hour)
+
+        def report(n_done, n_scenarios):
+            if n_done % FLUSH_EVERY == 0 or n_done == n_scenarios:
+                print(f"{n_done}/{n_scenarios} scenarios")
+
+        with run_sweep(args.directory, sweep, args.engine, progress=report) as store:
+            print(f"{len(store)} scenarios in {args.directory}")
+    else:
+        with TrajectoryStore(args.directory) as store:
+            filters = {k: getattr(args, k) for k in ("building", "cop_option", "amb_option", "target") if getattr(args, k) is not None}
+            stats = profile(store, args.field, select(store, **filters))
+            steps_per_hour = store.n_steps // 24
+            print(f"{args.field} over {stats['n_scenarios']} scenarios, hourly: min / mean / max")
+            for hour in range(24):
+                ix = hour * steps_per_hour
+                print(f"{hour:02d}:00\t{stats['min'][ix]:.2f}\t{stats['mean'][ix]:.2f}\t{stats['max'][ix]:.2f}")
@@ -1,12 +1,16 @@
 import os
 import logging
+from bisect import bisect_right
 
 from logging.handlers import RotatingFileHandler
 from logging import StreamHandler
 import sys
 
+import numpy as np
 from scipy.interpolate import CubicSpline
 
+from config import get_emitter_type_options
+
 
 # logging
 os.makedirs("../Logs", exist_ok=True)
@@ -51,6 +55,10 @@ class Radiator:
             [p[0] for p in self.stelrad_correction_factor_points],
             [power_at_dt50 * p[1] for p in self.stelrad_correction_factor_points]
         )
+        self._gradient_spline = self._spline.derivative()
+        # solvers call these once per step, so as plain functions (see scalar_spline()); the values are the splines' own
+        self._output = scalar_spline(self._spline)
+        self._output_gradient = scalar_spline(self._gradient_spline)
 
     def output(self, room_temp, mean_water_temp=None):
         """
@@ -63,7 +71,163 @@ class Radiator:
             self.mean_water_temp = mean_water_temp
 
         dt_rad_room = self.mean_water_temp - room_temp
-        return self._spline([dt_rad_room])[0]
+        return self._output(dt_rad_room)
+
+    def output_gradient(self, room_temp, mean_water_temp=None):
+        """
+        d(output)/d(dT) in W/K, i.e. the rate of change of output with mean water temp (and minus that with room temp). Used by implicit integrators.
+        Arguments as for output()
+        """
+        if mean_water_temp is not None:
+            self.mean_water_temp = mean_water_temp
+
+        dt_rad_room = self.mean_water_temp - room_temp
+        return self._output_gradient(dt_rad_room)
+
+
+# Emitter following the standard power law: output = power_at_dt50 * (dT / 50) ^ n, where dT = mean water temp - room temp.
+# Unlike Radiator, this is vectorised and has a closed-form inverse (the mean water temp needed for a given output).
+# The Stelrad correction factors are fitted very closely by n = 1.3; fan coils and underfloor are closer to linear.
+class PowerLawEmitter:
+    _stelrad_exponent = None
+
+    @classmethod
+    def stelrad_exponent(cls):
+        """Least squares fit of n to Radiator.stelrad_correction_factor_points, in log space (so through factor = 1 at dT = 50)"""
+        if cls._stelrad_exponent is None:
+            points = [p for p in Radiator.stelrad_correction_factor_points if 0 < p[0] != 50]
+            x = np.log([p[0] / 50 for p in points])
+            y = np.log([p[1] for p in points])
+            cls._stelrad_exponent = float(x @ y / (x @ x))
+        return cls._stelrad_exponent
+
+    def __init__(self, power_at_dt50, mean_water_temp=None, exponent=None):
+        """
+
+        :param power_at_dt50: power output in Watts at dT(room-rad) = 50C
+        :param mean_water_temp: emitter mean water temp
+        :param exponent: n in the power law. If None, the value fitted to the Stelrad table is used (i.e. a radiator)
+        """
+        self.power_at_dt50 = power_at_dt50
+        self.mean_water_temp = mean_water_temp
+        self.exponent = self.stelrad_exponent() if exponent is None else exponent
+
+    def output(self, room_temp, mean_water_temp=None):
+        """
+        output in W. Arguments may be scalars or numpy arrays (broadcast together). No output when the water is cooler than the room.
+        :param room_temp: room temp
+        :param mean_water_temp: override mean_water_temp temp. If None, the value of the instance variable is used. If set, the instance variable is updated
+        :return: float for scalar arguments, otherwise an array
+        """
+        if mean_water_temp is not None:
+            self.mean_water_temp = mean_water_temp
+
+        dt_rad_room = np.maximum(np.asarray(self.mean_water_temp, dtype=float) - room_temp, 0)
+        power = self.power_at_dt50 * (dt_rad_room / 50) ** self.exponent
+        return float(power) if np.ndim(power) == 0 else power
+
+    def output_gradient(self, room_temp, mean_water_temp=None):
+        """d(output)/d(mean water temp) in W/K, which is also -d(output)/d(room temp). Same conventions as output()"""
+        if mean_water_temp is not None:
+            self.mean_water_temp = mean_water_temp
+
+        dt_rad_room = np.maximum(np.asarray(self.mean_water_temp, dtype=float) - room_temp, 0)
+        gradient = self.power_at_dt50 * self.exponent / 50 * (dt_rad_room / 50) ** (self.exponent - 1)
+        return float(gradient) if np.ndim(gradient) == 0 else gradient
+
+    def required_mean_water_temp(self, room_temp, power):
+        """Mean water temp giving the required output (W) at the room temp. Analytic inverse of output(); vectorised."""
+        dt_rad_room = 50 * (np.maximum(np.asarray(power, dtype=float), 0) / self.power_at_dt50) ** (1 / self.exponent)
+        t = room_temp + dt_rad_room
+        return float(t) if np.ndim(t) == 0 else t
+
+
+# Several emitters, possibly with different exponents (e.g. radiators + a fan coil), in one room, fed at the same mean water temp.
+# Same interface as PowerLawEmitter. The inverse of a sum of power laws with different exponents has no closed form, so it is found by Newton's
+# method starting from the analytic inverse of an equivalent single emitter; the output is monotonic in water temp so this converges in a few steps.
+class EmitterGroup:
+    def __init__(self, emitters, mean_water_temp=None):
+        """
+        :param emitters: list of PowerLawEmitter
+        :param mean_water_temp: mean water temp for all emitters
+        """
+        self.emitters = list(emitters)
+        self.mean_water_temp = mean_water_temp
+        self.power_at_dt50 = sum(e.power_at_dt50 for e in self.emitters)
+        # power-weighted exponent, for the starting point of the inverse
+        self._equivalent = PowerLawEmitter(self.power_at_dt50, exponent=sum(e.power_at_dt50 * e.exponent for e in self.emitters) / self.power_at_dt50)
+
+    @classmethod
+    def from_spec(cls, spec, mean_water_temp=None):
+        """
+        :param spec: list of (emitter type, power at dT50) where emitter type is a key into get_emitter_type_options(),
+            e.g. [("Radiator", 2900), ("Fan Coil", 3000)]
+        """
+        exponents = get_emitter_type_options()
+        return cls([PowerLawEmitter(power, exponent=exponents[emitter_type]) for emitter_type, power in spec], mean_water_temp)
+
+    def output(self, room_temp, mean_water_temp=None):
+        if mean_water_temp is not None:
+            self.mean_water_temp = mean_water_temp
+        return sum(e.output(room_temp, self.mean_water_temp) for e in self.emitters)
+
+    def output_gradient(self, room_temp, mean_water_temp=None):
+        if mean_water_temp is not None:
+            self.mean_water_temp = mean_water_temp
+        return sum(e.output_gradient(room_temp, self.mean_water_temp) for e in self.emitters)
+
+    def required_mean_water_temp(self, room_temp, power, tolerance=1e-6, max_iterations=50):
+        """Mean water temp giving the required output (W) at the room temp; vectorised."""
+        power = np.maximum(np.asarray(power, dtype=float), 0)
+        t = np.asarray(self._equivalent.required_mean_water_temp(room_temp, power), dtype=float)
+        for _ in range(max_iterations):
+            excess = np.asarray(sum(e.output(room_temp, t) for e in self.emitters)) - power
+            gradient = np.asarray(sum(e.output_gradient(room_temp, t) for e in self.emitters))
+            step = np.divide(excess, gradient, out=np.zeros_like(t), where=gradient > 0)
+            t = np.maximum(t - step, room_temp)  # never below room temp, where output is flat at 0
+            if np.all(np.abs(step) < tolerance):
+                break
+        return float(t) if np.ndim(t) == 0 else t
+
+
+def required_lwt(emitter, heat_loss_factor, room_temp, ambient_temp, dT=5, passive_heat=0):
+    """
+    Steady-state LWT which holds the room temp against the given ambient temp(s): the emitter output must match the fabric loss.
+
+    :param emitter: PowerLawEmitter or EmitterGroup
+    :param heat_loss_factor: W/K
+    :param ambient_temp: scalar or array
+    :param dT: flow-return temp difference. LWT = mean water temp + dT / 2
+    :param passive_heat: passive heating (people, computers, etc) in W
+    """
+    power = heat_loss_factor * (room_temp - np.asarray(ambient_temp, dtype=float)) - passive_heat
+    return emitter.required_mean_water_temp(room_temp, power) + dT / 2
+
+
+def scalar_spline(spline):
+    """
+    Function evaluating a scipy CubicSpline at one float, for loops which evaluate it one point at a time (e.g. an ODE's rate function),
+    where spline([x])[0] is mostly call overhead. The arithmetic is scipy's own, so the values are identical.
+    """
+    breakpoints = [float(b) for b in spline.x]
+    coefficients = [tuple(float(c) for c in spline.c[:, ix]) for ix in range(len(breakpoints) - 1)]
+    low, high, last = breakpoints[0], breakpoints[-1], len(breakpoints) - 2
+    extrapolate = bool(spline.extrapolate)
+
+    def evaluate(x):
+        if not extrapolate and not low <= x <= high:
+            return float("nan")
+        ix = min(max(bisect_right(breakpoints, x) - 1, 0), last)
+        s = x - breakpoints[ix]
+        c3, c2, c1, c0 = coefficients[ix]
+        z = s
+        value = c0 + c1 * z
+        z = z * s
+        value = value + c2 * z
+        z = z * s
+        return value + c3 * z
+
+    return evaluate
 
 
 # Spline for COP vs temperature.
@@ -75,6 +239,70 @@ class COP:
     def cop(self, t):
         return self._spline([t])[0]
 
+    def cops(self, ts):
+        """Vectorised cop(): array of COPs for an array of temps"""
+        return self._spline(np.asarray(ts, dtype=float))
+
+    def cop_function(self):
+        """cop() as a plain function, faster for many single temps, see scalar_spline()"""
+        return scalar_spline(self._spline)
+
+
+# COP as a function of both ambient temp and LWT, from a family of COP point sets for the same heat pump at different LWTs (e.g. WM85_LWT35 to WM85_LWT50).
+# Each LWT has its own COP spline vs ambient; between LWTs the COP is linearly interpolated, and linearly extrapolated beyond the ends.
+class COPSurface:
+    def __init__(self, cop_defns):
+        """
+        :param cop_defns: list of dicts as in get_cop_point_options(vs="ambient"), each with a different "LWT"
+        """
+        cop_defns = sorted(cop_defns, key=lambda d: d["LWT"])
+        if not cop_defns:
+            raise ValueError("COPSurface needs COP points for at least 1 LWT")
+        self.lwts = [d["LWT"] for d in cop_defns]
+        self._models = [COP(d["T_amb"], d["COP"]) for d in cop_defns]
+
+    def cop(self, t_amb, lwt):
+        if len(self.lwts) == 1:  # no information on variation with LWT, e.g. direct electric
+            return self._models[0].cop(t_amb)
+        ix = 0
+        while ix < len(self.lwts) - 2 and lwt > self.lwts[ix + 1]:
+            ix += 1
+        lwt_0, lwt_1 = self.lwts[ix], self.lwts[ix + 1]
+        cop_0, cop_1 = self._models[ix].cop(t_amb), self._models[ix + 1].cop(t_amb)
+        return max(cop_0 + (cop_1 - cop_0) * (lwt - lwt_0) / (lwt_1 - lwt_0), 1.0)  # a heat pump is never worse than direct electric
+
+    def at_lwt(self, lwt):
+        """COP model vs ambient at a fixed LWT, with the same interface as COP"""
+        return _FixedLWTCOP(self, lwt)
+
+    def cop_function(self, lwt):
+        """cop() at a fixed LWT as a plain function of t_amb, faster for many single temps (same values)"""
+        if len(self.lwts) == 1:
+            return self._models[0].cop_function()
+        ix = 0
+        while ix < len(self.lwts) - 2 and lwt > self.lwts[ix + 1]:
+            ix += 1
+        lwt_0, lwt_1 = self.lwts[ix], self.lwts[ix + 1]
+        cop_function_0, cop_function_1 = self._models[ix].cop_function(), self._models[ix + 1].cop_function()
+
+        def cop(t_amb):
+            cop_0, cop_1 = cop_function_0(t_amb), cop_function_1(t_amb)
+            return max(cop_0 + (cop_1 - cop_0) * (lwt - lwt_0) / (lwt_1 - lwt_0), 1.0)
+
+        return cop
+
+
+class _FixedLWTCOP:
+    def __init__(self, surface, lwt):
+        self._surface = surface
+        self.lwt = lwt
+
+    def cop(self, t):
+        return self._surface.cop(t, self.lwt)
+
+    def cop_function(self):
+        return self._surface.cop_function(self.lwt)
+
 
 # Spline for Daily ambient temp cycle. The temperature at 24hrs is forced to be the same as the passed 00hrs so that the iterative "solver" works OK
 class AmbientTemps:
@@ -95,6 +323,14 @@ class AmbientTemps:
         """
         return self._spline([hr])[0]
 
+    def temps(self, hrs):
+        """Vectorised temp(): array of temps for an array of hours in [0, 24]"""
+        return self._spline(np.asarray(hrs, dtype=float))
+
+    def temp_function(self):
+        """temp() as a plain function, faster for many single hours, see scalar_spline()"""
+        return scalar_spline(self._spline)
+
 
 # A simple device to allow for hour to be treated as a decimal in the "solver" but for the target temperatures to be defined as per-hour steps
 # As I would expect a target temp schedule to be defined this way.